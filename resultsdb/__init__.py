@@ -35,16 +35,18 @@ from flask_pyoidc.provider_configuration import (
 from flask_pyoidc.user_session import UserSession
 from flask_session import Session
 
+from resultsdb.authorization import LdapGroups, PermissionMatcher
+from resultsdb.cache import IdentityCache, ResponseCache, load_cache_backend
 from resultsdb.proxy import ReverseProxied
 from resultsdb.controllers.main import main
 from resultsdb.controllers.api_v2 import api as api_v2
 from resultsdb.controllers.api_v3 import api as api_v3, create_endpoints
+from resultsdb.controllers.common import validation_errors
 from resultsdb.messaging import load_messaging_plugin
 from resultsdb.models import db
 from resultsdb.tracing import setup_tracing
 from . import config
 
-
 # the version as used in setup.py
 __version__ = "2.2.0"
 
@@ -53,8 +55,6 @@ try:
 except NameError:
     basestring = (str, bytes)
 
-VALIDATION_KEYS = frozenset({"input", "loc", "msg", "type", "url"})
-
 
 def create_app(config_obj=None):
     app = Flask(__name__)
@@ -128,6 +128,8 @@ def create_app(config_obj=None):
         app.logger.info("OpenIDConnect authentication is disabled")
 
     setup_messaging(app)
+    setup_cache(app)
+    setup_permissions(app)
 
     app.logger.debug("Finished ResultsDB initialization")
     return app
@@ -198,6 +200,38 @@ def setup_messaging(app):
     )
 
 
+def setup_cache(app):
+    app.identity_cache = None
+    if app.config["IDENTITY_CACHE_SIZE"]:
+        app.identity_cache = IdentityCache(
+            max_entries=app.config["IDENTITY_CACHE_SIZE"],
+            ttl=app.config["IDENTITY_CACHE_TTL"],
+        )
+
+    app.ldap_groups = LdapGroups(
+        max_entries=app.config["LDAP_GROUP_CACHE_SIZE"],
+        ttl=app.config["LDAP_GROUP_CACHE_TTL"],
+        negative_ttl=app.config["LDAP_GROUP_CACHE_NEGATIVE_TTL"],
+        pool_size=app.config["LDAP_POOL_SIZE"],
+    )
+
+    app.latest_results_cache = None
+    if not app.config["RESULTS_LATEST_CACHE"]:
+        return
+
+    backend_name = app.config["RESULTS_LATEST_CACHE_BACKEND"]
+    app.logger.info("Using cache backend %s for latest results", backend_name)
+    backend = load_cache_backend(
+        name=backend_name,
+        backend_args=app.config["RESULTS_LATEST_CACHE_KWARGS"],
+    )
+    app.latest_results_cache = ResponseCache(backend, ttl=app.config["RESULTS_LATEST_CACHE_TTL"])
+
+
+def setup_permissions(app):
+    app.permission_matcher = PermissionMatcher(app.config.get("PERMISSIONS", []))
+
+
 def register_handlers(app):
     # TODO: find out why error handler works for 404 but not for 400
     @app.errorhandler(400)
@@ -233,10 +267,7 @@ def register_handlers(app):
 
 def handle_validation_error(error: ValidationError):
     errors = error.body_params or error.form_params or error.path_params or error.query_params
-    # Keep only interesting stuff and remove objects potentially
-    # unserializable in JSON.
-    err = [{k: v for k, v in e.items() if k in VALIDATION_KEYS} for e in errors]
-    response = jsonify({"validation_error": err})
+    response = jsonify({"validation_error": validation_errors(errors)})
     response.status_code = 400
     return response
 
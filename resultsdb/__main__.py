@@ -17,18 +17,64 @@
 # Authors:
 #   Josef Skladanka <jskladan@redhat.com>
 
+import datetime
+import os
+import time
+
 import click
 from alembic.config import Config
 from alembic import command as al_command
 from alembic.migration import MigrationContext
+from flask import current_app
 from flask.cli import FlaskGroup
 
 from resultsdb import create_app
+from resultsdb.archive import archive_counts, archive_results, reclaimable_sizes, resume_archive
+from resultsdb.importer import create_indexes, drop_indexes, import_results
+from resultsdb.messaging import dispatch_outbox
+from resultsdb.partitions import (
+    convert_tables,
+    create_partitions,
+    drop_partitions,
+    month_start,
+)
 from resultsdb.models import db
-from resultsdb.models.results import Group, Testcase, Result, ResultData
+from resultsdb.models.results import (
+    Group,
+    IdempotencyKey,
+    LatestResult,
+    Testcase,
+    Result,
+    ResultData,
+    TASKOTRON_KEYS,
+    TaskotronLastOutcome,
+    latest_result_data_hash,
+    result_data_json,
+    update_groups_results_count,
+    update_latest_results,
+    update_taskotron_last_outcomes,
+    utcnow_naive,
+)
 
+from sqlalchemy import text
 from sqlalchemy.engine import reflection
 
+# Sets the JSONB data column from the result_data table on PostgreSQL
+BACKFILL_RESULT_DATA_SQL = text("""
+    UPDATE result SET data = COALESCE(
+        (
+            SELECT jsonb_object_agg(key, "values") FROM (
+                SELECT key, jsonb_agg(value ORDER BY id) AS "values"
+                FROM result_data
+                WHERE result_data.result_id = result.id
+                GROUP BY key
+            ) AS grouped_data
+        ),
+        '{}'::jsonb
+    )
+    WHERE id >= :start AND id < :end AND data IS NULL
+    """)
+
 
 def get_alembic_config():
     # the location of the alembic ini file and alembic scripts changes when
@@ -131,10 +177,329 @@ def mock_data():
         db.session.add(j1)
         db.session.add(j2)
 
+        db.session.flush()
+        update_groups_results_count([r1, r2, r3])
         db.session.commit()
     else:
         print(" - skipped Testcase, Job, Result, ResultData")
 
 
+def update_results_in_batches(update, batch_size):
+    """
+    Calls `update(results)` for all the stored results in batches of
+    increasing ids, committing each batch so that results can be submitted
+    meanwhile.
+    """
+    last_id = 0
+    count = 0
+    while True:
+        results = db.session.scalars(
+            db.select(Result)
+            .options(db.selectinload(Result.data))
+            .where(Result.id > last_id)
+            .order_by(Result.id)
+            .limit(batch_size)
+        ).all()
+        if not results:
+            break
+
+        update(results)
+        db.session.commit()
+        last_id = results[-1].id
+        count += len(results)
+        print(" - processed %d results" % count)
+
+
+def delete_outdated_rows(model, keys, batch_size):
+    """
+    Deletes the rows of the `model` (LatestResult or TaskotronLastOutcome)
+    referencing deleted results or stored for other result data `keys`, in
+    committed batches. Returns their number.
+    """
+    last_id = 0
+    deleted = 0
+    while True:
+        rows = db.session.execute(
+            db.select(model.id, model.testcase_name, model.data_hash, Result)
+            .outerjoin(Result, Result.id == model.result_id)
+            .options(db.selectinload(Result.data))
+            .where(model.id > last_id)
+            .order_by(model.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        outdated = [
+            (row.id, row.Result.id if row.Result else None)
+            for row in rows
+            if row.Result is None
+            or row.testcase_name != row.Result.testcase_name
+            or row.data_hash != latest_result_data_hash(row.Result, keys)
+        ]
+        if outdated:
+            # Rows updated by a submission meanwhile reference another result
+            table = model.__table__
+            db.session.execute(
+                db.delete(table).where(db.tuple_(table.c.id, table.c.result_id).in_(outdated))
+            )
+        db.session.commit()
+        last_id = rows[-1].id
+        deleted += len(outdated)
+
+    return deleted
+
+
+@cli.command(name="rebuild_latest_results")
+@click.option("--batch-size", default=1000, show_default=True, help="Results processed at once.")
+def rebuild_latest_results(batch_size):
+    """
+    Rebuilds the latest_result table from all the stored results.
+
+    Each batch is committed, so the results can be submitted meanwhile.
+    The stored latest results are kept while they are rebuilt, and the ones
+    of deleted results or of other result data keys are deleted after.
+    """
+    keys = current_app.config["LATEST_RESULT_KEYS"]
+    if not keys:
+        raise click.ClickException("LATEST_RESULT_KEYS is not configured")
+
+    print("Rebuilding latest results for keys: %s" % ", ".join(keys))
+    update_results_in_batches(lambda results: update_latest_results(results, keys), batch_size)
+    deleted = delete_outdated_rows(LatestResult, keys, batch_size)
+    print(" - deleted %d outdated latest results" % deleted)
+    print("Stored %d latest results" % db.session.query(LatestResult).count())
+
+
+@cli.command(name="rebuild_taskotron_last_outcomes")
+@click.option("--batch-size", default=1000, show_default=True, help="Results processed at once.")
+def rebuild_taskotron_last_outcomes(batch_size):
+    """
+    Rebuilds the taskotron_last_outcome table from all the stored results.
+
+    Each batch is committed, so the results can be submitted meanwhile.
+    The stored last outcomes are kept while they are rebuilt, and the ones
+    of deleted results are deleted after.
+    """
+    print("Rebuilding last outcomes of Taskotron tasks")
+    update_results_in_batches(update_taskotron_last_outcomes, batch_size)
+    deleted = delete_outdated_rows(TaskotronLastOutcome, TASKOTRON_KEYS, batch_size)
+    print(" - deleted %d outdated last outcomes" % deleted)
+    print("Stored %d last outcomes" % db.session.query(TaskotronLastOutcome).count())
+
+
+@cli.command(name="backfill_result_data")
+@click.option("--batch-size", default=1000, show_default=True, help="Results updated at once.")
+def backfill_result_data(batch_size):
+    """Copies result data to the data column of results which do not have it set."""
+    max_id = db.session.query(db.func.max(Result.id)).scalar() or 0
+    postgresql = db.session.get_bind().dialect.name == "postgresql"
+
+    print("Backfilling result data")
+    for start in range(0, max_id + 1, batch_size):
+        end = start + batch_size
+        if postgresql:
+            db.session.execute(BACKFILL_RESULT_DATA_SQL, {"start": start, "end": end})
+        else:
+            results = (
+                db.session.query(Result)
+                .filter(Result.id >= start, Result.id < end, Result.data_json.is_(None))
+                .options(db.selectinload(Result.data))
+            )
+            for result in results:
+                result.data_json = result_data_json(result)
+        db.session.commit()
+        print(" - processed results up to id %d" % min(end - 1, max_id))
+
+
+@cli.command(name="dispatch")
+@click.option("--batch-size", default=100, show_default=True, help="Messages published at once.")
+@click.option(
+    "--interval",
+    default=1.0,
+    show_default=True,
+    help="Seconds to wait when the outbox is empty or publishing fails.",
+)
+@click.option("--once", is_flag=True, help="Exit when the outbox is empty.")
+def dispatch(batch_size, interval, once):
+    """Publishes the messages stored in the outbox (see MESSAGE_BUS_OUTBOX)."""
+    plugin = current_app.messaging_plugin
+    if not plugin:
+        raise click.ClickException("MESSAGE_BUS_PUBLISH is not enabled")
+
+    total = 0
+    while True:
+        try:
+            count = dispatch_outbox(plugin, batch_size)
+        except Exception:
+            db.session.rollback()
+            if once:
+                raise click.ClickException("Failed to publish messages, see the log")
+            time.sleep(interval)
+            continue
+
+        total += count
+        if count < batch_size:
+            if once:
+                break
+            time.sleep(interval)
+
+    print("Published %d messages" % total)
+
+
+@cli.command(name="purge_idempotency_keys")
+def purge_idempotency_keys():
+    """Removes the expired idempotency keys (see IDEMPOTENCY_KEY_TTL)."""
+    ttl = current_app.config["IDEMPOTENCY_KEY_TTL"]
+    expired = utcnow_naive() - datetime.timedelta(seconds=ttl)
+    count = db.session.query(IdempotencyKey).filter(IdempotencyKey.created_at < expired).delete()
+    db.session.commit()
+    print("Removed %d expired idempotency keys" % count)
+
+
+@cli.command(name="import")
+@click.argument("source", type=click.File("r"), default="-")
+@click.option("--batch-size", default=10000, show_default=True, help="Results inserted at once.")
+@click.option(
+    "--defer-indexes",
+    is_flag=True,
+    help="Drop indexes of the result tables during the import and rebuild them at the end.",
+)
+def import_command(source, batch_size, defer_indexes):
+    """
+    Imports results from NDJSON file (or standard input) in the API v2
+    format, e.g. from /api/v2.0/results/export.
+    """
+    indexes = drop_indexes() if defer_indexes else []
+    try:
+        count = import_results(
+            source, batch_size, lambda count: print(" - imported %d results" % count)
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        # The failed batch must not abort the rebuild of the indexes
+        db.session.rollback()
+        if indexes:
+            print("Rebuilding indexes")
+            create_indexes(indexes)
+
+    print("Imported %d results" % count)
+
+
+@cli.command(name="archive")
+@click.option(
+    "--older-than",
+    type=int,
+    required=True,
+    metavar="DAYS",
+    help="Archive results submitted more than DAYS days ago.",
+)
+@click.option(
+    "--output",
+    type=click.Path(file_okay=False, writable=True),
+    default=".",
+    show_default=True,
+    help="Directory for the archive files.",
+)
+@click.option("--batch-size", default=1000, show_default=True, help="Results archived at once.")
+@click.option("--dry-run", is_flag=True, help="Only report the rows to archive and their size.")
+def archive(older_than, output, batch_size, dry_run):
+    """
+    Moves old results to gzip-compressed NDJSON files, which can be loaded
+    back with "resultsdb import".
+    """
+    cutoff = utcnow_naive() - datetime.timedelta(days=older_than)
+    if dry_run:
+        counts = archive_counts(cutoff)
+        sizes = reclaimable_sizes(counts)
+        for name, count in counts.items():
+            size = "unknown size" if sizes[name] is None else "%d bytes" % sizes[name]
+            print(" - %s: %d rows, %s" % (name, count, size))
+        total = sum(size or 0 for size in sizes.values())
+        print("Would archive %d results submitted before %s" % (counts["result"], cutoff))
+        print("Estimated reclaimable size: %d bytes" % total)
+        return
+
+    os.makedirs(output, exist_ok=True)
+    resumed = resume_archive(output)
+    if resumed:
+        print(" - deleted %d results archived by an interrupted run" % resumed)
+
+    count = archive_results(
+        cutoff, output, batch_size, lambda count: print(" - archived %d results" % count)
+    )
+    print("Archived %d results submitted before %s" % (count, cutoff))
+
+
+@cli.group(name="partitions")
+def partitions():
+    """Manages the monthly partitions of the result tables on PostgreSQL."""
+
+
+@partitions.command(name="convert")
+@click.option(
+    "--months", default=3, show_default=True, help="Months after the current one to partition."
+)
+def partitions_convert(months):
+    """
+    Converts the result tables to partitioned tables, keeping the existing
+    results in the legacy partitions. Results submitted for months without
+    a partition are kept in the overflow partitions until it is created.
+
+    PostgreSQL cannot enforce foreign keys referencing a partitioned table,
+    so the foreign keys referencing the results (from result_data,
+    groups_to_results, latest_result and taskotron_last_outcome) are
+    dropped. The database then no longer prevents rows referencing missing
+    results, so results must be deleted only with the resultsdb commands.
+    """
+    try:
+        boundary, foreign_keys = convert_tables(months)
+    except RuntimeError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+
+    for name in foreign_keys:
+        print(" - dropped foreign key %s" % name)
+    print("Partitioned the result tables, monthly partitions start at %s" % boundary.date())
+
+
+@partitions.command(name="create")
+@click.option(
+    "--months", default=3, show_default=True, help="Months after the current one to partition."
+)
+def partitions_create(months):
+    """Creates the missing partitions for the current and the coming months."""
+    try:
+        created = create_partitions(utcnow_naive(), months + 1)
+    except RuntimeError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+
+    for name in created:
+        print(" - created %s" % name)
+    print("Created %d partitions" % len(created))
+
+
+@partitions.command(name="drop")
+@click.option(
+    "--before",
+    required=True,
+    type=click.DateTime(formats=["%Y-%m"]),
+    help="Month (YYYY-MM) whose partitions and newer are kept.",
+)
+def partitions_drop(before):
+    """Drops the monthly partitions of the results submitted before a month."""
+    try:
+        dropped = drop_partitions(month_start(before))
+    except RuntimeError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+
+    for name in dropped:
+        print(" - dropped %s" % name)
+    print("Dropped %d partitions" % len(dropped))
+
+
 if __name__ == "__main__":
     cli()
@@ -3,6 +3,7 @@ from flask import current_app as app
 from sqlalchemy import engine_from_config, pool
 
 from resultsdb.models import db
+from resultsdb.partitions import is_partition_name
 
 # add '.' to the pythonpath to support migration inside development env
 import sys
@@ -29,6 +30,13 @@ target_metadata = db.metadata
 # ... etc.
 
 
+def include_name(name, type_, parent_names):
+    # Ignore the partitions of the result tables, see "resultsdb partitions"
+    if type_ == "table":
+        return not is_partition_name(name)
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -42,7 +50,7 @@ def run_migrations_offline():
 
     """
     url = config.get_main_option("sqlalchemy.url")
-    context.configure(url=url, compare_type=True)
+    context.configure(url=url, compare_type=True, include_name=include_name)
 
     with context.begin_transaction():
         context.run_migrations()
@@ -63,7 +71,9 @@ def run_migrations_online():
     engine = engine_from_config(alembic_config, prefix="sqlalchemy.", poolclass=pool.NullPool)
 
     connection = engine.connect()
-    context.configure(connection=connection, target_metadata=target_metadata)
+    context.configure(
+        connection=connection, target_metadata=target_metadata, include_name=include_name
+    )
 
     try:
         with context.begin_transaction():
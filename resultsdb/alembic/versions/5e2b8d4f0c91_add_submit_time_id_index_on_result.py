@@ -0,0 +1,28 @@
+"""Add (submit_time, id) index on result
+
+Replaces the index on submit_time with a composite index which also backs
+the keyset pagination of results.
+
+Revision ID: 5e2b8d4f0c91
+Revises: a3f9c1d27e4b
+Create Date: 2026-10-18 10:03:17.204816
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "5e2b8d4f0c91"
+down_revision = "a3f9c1d27e4b"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index("result_idx_submit_time_id", "result", ["submit_time", "id"], unique=False)
+    op.drop_index("result_submit_time", table_name="result")
+
+
+def downgrade():
+    op.create_index("result_submit_time", "result", ["submit_time"], unique=False)
+    op.drop_index("result_idx_submit_time_id", table_name="result")
@@ -0,0 +1,36 @@
+"""Add latest_result table
+
+Revision ID: 7c4e1b9a2f65
+Revises: 5e2b8d4f0c91
+Create Date: 2026-10-18 13:41:09.372215
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "7c4e1b9a2f65"
+down_revision = "5e2b8d4f0c91"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "latest_result",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("testcase_name", sa.Text(), nullable=False),
+        sa.Column("data_hash", sa.String(length=40), nullable=False),
+        sa.Column("result_id", sa.Integer(), nullable=False),
+        sa.Column("submit_time", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["result_id"], ["result.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("testcase_name", "data_hash", name="latest_result_uq_testcase_data"),
+    )
+    op.create_index("latest_result_idx_result_id", "latest_result", ["result_id"], unique=False)
+
+
+def downgrade():
+    op.drop_index("latest_result_idx_result_id", table_name="latest_result")
+    op.drop_table("latest_result")
@@ -0,0 +1,35 @@
+"""Add results_count to group
+
+Revision ID: a3f9c1d27e4b
+Revises: cd581d0e83df
+Create Date: 2026-10-18 09:12:41.518302
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "a3f9c1d27e4b"
+down_revision = "cd581d0e83df"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+from sqlalchemy import text
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column(
+        "group",
+        sa.Column("results_count", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.execute(
+        text(
+            'UPDATE "group" SET results_count = ('
+            "SELECT COUNT(*) FROM groups_to_results"
+            ' WHERE groups_to_results.group_uuid = "group".uuid)'
+        )
+    )
+
+
+def downgrade():
+    op.drop_column("group", "results_count")
@@ -0,0 +1,30 @@
+"""Add outbox table
+
+Revision ID: b67fb832af39
+Revises: b81d7a3e5c20
+Create Date: 2026-10-18 03:49:53.375372
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "b67fb832af39"
+down_revision = "b81d7a3e5c20"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "outbox",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("message", sa.JSON(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade():
+    op.drop_table("outbox")
@@ -0,0 +1,48 @@
+"""Add data column to result
+
+The column is filled for the existing results by running
+"resultsdb backfill_result_data".
+
+Revision ID: b81d7a3e5c20
+Revises: 7c4e1b9a2f65
+Create Date: 2026-10-18 15:02:44.816530
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "b81d7a3e5c20"
+down_revision = "7c4e1b9a2f65"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.add_column(
+        "result",
+        sa.Column(
+            "data",
+            sa.JSON(none_as_null=True).with_variant(
+                postgresql.JSONB(none_as_null=True), "postgresql"
+            ),
+            nullable=True,
+        ),
+    )
+    if op.get_bind().dialect.name == "postgresql":
+        op.create_index(
+            "result_idx_data",
+            "result",
+            ["data"],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_ops={"data": "jsonb_path_ops"},
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.drop_index("result_idx_data", table_name="result")
+    op.drop_column("result", "data")
@@ -0,0 +1,28 @@
+"""Add submit_time to result_data
+
+The column copies the submit_time of the result, so that result_data can be
+partitioned together with result on PostgreSQL (see "resultsdb partitions").
+It is left empty for the existing result data.
+
+Revision ID: c4a7e2d9f813
+Revises: e5b2c8f41a3d
+Create Date: 2026-10-18 04:13:02.502118
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "c4a7e2d9f813"
+down_revision = "e5b2c8f41a3d"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column("result_data", sa.Column("submit_time", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("result_data", "submit_time")
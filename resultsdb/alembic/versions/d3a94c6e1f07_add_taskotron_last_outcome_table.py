@@ -0,0 +1,44 @@
+"""Add taskotron_last_outcome table
+
+Revision ID: d3a94c6e1f07
+Revises: b67fb832af39
+Create Date: 2026-10-18 04:12:37.581904
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "d3a94c6e1f07"
+down_revision = "b67fb832af39"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "taskotron_last_outcome",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("testcase_name", sa.Text(), nullable=False),
+        sa.Column("data_hash", sa.String(length=40), nullable=False),
+        sa.Column("result_id", sa.Integer(), nullable=False),
+        sa.Column("submit_time", sa.DateTime(), nullable=False),
+        sa.Column("outcome", sa.String(length=32), nullable=False),
+        sa.ForeignKeyConstraint(["result_id"], ["result.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "testcase_name", "data_hash", name="taskotron_last_outcome_uq_testcase_data"
+        ),
+    )
+    op.create_index(
+        "taskotron_last_outcome_idx_result_id",
+        "taskotron_last_outcome",
+        ["result_id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("taskotron_last_outcome_idx_result_id", table_name="taskotron_last_outcome")
+    op.drop_table("taskotron_last_outcome")
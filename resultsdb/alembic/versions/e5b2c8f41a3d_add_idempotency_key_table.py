@@ -0,0 +1,37 @@
+"""Add idempotency_key table
+
+Revision ID: e5b2c8f41a3d
+Revises: d3a94c6e1f07
+Create Date: 2026-10-18 04:31:08.214655
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "e5b2c8f41a3d"
+down_revision = "d3a94c6e1f07"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "idempotency_key",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("key", sa.String(length=255), nullable=False),
+        sa.Column("request_hash", sa.String(length=40), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("response", sa.JSON(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("key", name="idempotency_key_uq_key"),
+    )
+    op.create_index(
+        "idempotency_key_idx_created_at", "idempotency_key", ["created_at"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index("idempotency_key_idx_created_at", table_name="idempotency_key")
+    op.drop_table("idempotency_key")
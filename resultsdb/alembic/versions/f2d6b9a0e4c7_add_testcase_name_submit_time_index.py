@@ -0,0 +1,31 @@
+"""Add (testcase_name, submit_time) index on result
+
+Backs the queries filtering by testcases and submit_time together, like
+the aggregations of /results/stats over a time window.
+
+Revision ID: f2d6b9a0e4c7
+Revises: c4a7e2d9f813
+Create Date: 2026-10-18 14:26:41.318270
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "f2d6b9a0e4c7"
+down_revision = "c4a7e2d9f813"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index(
+        "result_idx_testcase_name_submit_time",
+        "result",
+        ["testcase_name", "submit_time"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("result_idx_testcase_name_submit_time", table_name="result")
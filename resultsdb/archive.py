@@ -0,0 +1,205 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Archival of old results, see "resultsdb archive".
+
+Results submitted before the cutoff are written, in batches ordered by id,
+to gzip-compressed NDJSON files in the format read by "resultsdb import".
+Each file is complete before it gets its final name, and only then are its
+results deleted together with their result data, group memberships, latest
+results and Taskotron last outcomes, in a short transaction per batch.
+
+If the archival is interrupted between writing a file and deleting its
+results, the next run deletes the results listed in the newest file before
+continuing, so no result is archived twice.
+"""
+
+import gzip
+import json
+import os
+import re
+
+from resultsdb.models import db
+from resultsdb.models.results import (
+    GroupsToResults,
+    Result,
+    ResultData,
+    delete_result_references,
+    result_data_json,
+)
+
+ARCHIVE_FILE_RE = re.compile(r"^results-(\d+)-(\d+)\.ndjson\.gz$")
+
+
+def archive_file_name(first_id, last_id):
+    return "results-%d-%d.ndjson.gz" % (first_id, last_id)
+
+
+def archive_files(directory):
+    """Returns the archive files in the directory ordered by the result ids."""
+    files = []
+    for name in os.listdir(directory):
+        match = ARCHIVE_FILE_RE.match(name)
+        if match:
+            files.append((int(match.group(1)), os.path.join(directory, name)))
+    return [path for _, path in sorted(files)]
+
+
+def archive_record(result):
+    return dict(
+        id=result.id,
+        testcase=dict(name=result.testcase.name, ref_url=result.testcase.ref_url),
+        submit_time=result.submit_time.isoformat(),
+        outcome=result.outcome,
+        note=result.note,
+        ref_url=result.ref_url,
+        groups=[group.uuid for group in result.groups],
+        data=result_data_json(result),
+    )
+
+
+def write_archive(path, records):
+    """Writes the records to a temporary file and renames it when complete."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        with gzip.GzipFile(fileobj=f, mode="wb") as gz:
+            for record in records:
+                gz.write(json.dumps(record).encode("utf-8") + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def delete_results(result_ids):
+    delete_result_references(result_ids)
+    db.session.execute(db.delete(ResultData).where(ResultData.result_id.in_(result_ids)))
+    db.session.execute(db.delete(Result).where(Result.id.in_(result_ids)))
+
+
+def archive_counts(cutoff):
+    """Returns the number of rows to archive in each table."""
+    ids = db.select(Result.id).where(Result.submit_time < cutoff)
+    return {
+        Result.__tablename__: db.session.query(Result).filter(Result.submit_time < cutoff).count(),
+        ResultData.__tablename__: db.session.query(ResultData)
+        .filter(ResultData.result_id.in_(ids))
+        .count(),
+        GroupsToResults.__tablename__: db.session.query(GroupsToResults)
+        .filter(GroupsToResults.result_id.in_(ids))
+        .count(),
+    }
+
+
+def table_size(name):
+    """Returns the size of the table with its indexes in bytes, or None if unknown."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        # Sums the partitions of partitioned tables
+        sql = "SELECT sum(pg_total_relation_size(relid)) FROM pg_partition_tree(:name)"
+    elif dialect == "sqlite":
+        sql = (
+            "SELECT sum(pgsize) FROM dbstat"
+            " WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = :name)"
+        )
+    else:
+        return None
+    return int(db.session.execute(db.text(sql), {"name": name}).scalar() or 0)
+
+
+def count_rows(name):
+    return db.session.execute(db.text("SELECT count(*) FROM %s" % name)).scalar()
+
+
+def table_rows(name):
+    """
+    Returns the number of rows in the table. On PostgreSQL it is estimated
+    from the statistics of the table (or of its partitions) instead of
+    counting all the rows.
+    """
+    if db.session.get_bind().dialect.name != "postgresql":
+        return count_rows(name)
+
+    leaves = db.session.execute(
+        db.text(
+            "SELECT t.relid::regclass::text, c.reltuples FROM pg_partition_tree(:name) t"
+            " JOIN pg_class c ON c.oid = t.relid WHERE t.isleaf"
+        ),
+        {"name": name},
+    )
+    total = 0
+    for leaf, reltuples in leaves:
+        # Not known until the table is vacuumed or analyzed
+        total += count_rows(leaf) if reltuples < 0 else int(reltuples)
+    return total
+
+
+def reclaimable_sizes(counts):
+    """
+    Estimates the size freed in each table by archiving the counted rows,
+    assuming the rows have the average size. Returns dict with None for
+    unknown sizes.
+    """
+    sizes = {}
+    for name, count in counts.items():
+        size = table_size(name)
+        # The estimated number of rows can be lower than the counted ones
+        total = max(table_rows(name), count)
+        sizes[name] = None if size is None else size * count // max(total, 1)
+    return sizes
+
+
+def resume_archive(directory):
+    """
+    Deletes the results listed in the newest archive file which are still
+    stored, left by an interrupted archival. Returns their number.
+    """
+    files = archive_files(directory)
+    if not files:
+        return 0
+
+    with gzip.open(files[-1], "rt", encoding="utf-8") as f:
+        ids = [json.loads(line)["id"] for line in f]
+    remaining = db.session.scalars(db.select(Result.id).where(Result.id.in_(ids))).all()
+    if remaining:
+        delete_results(remaining)
+        db.session.commit()
+    return len(remaining)
+
+
+def archive_results(cutoff, directory, batch_size, progress=None):
+    """
+    Archives the results submitted before `cutoff` to files in `directory`,
+    and calls `progress(count)` after each batch.
+
+    Returns the number of archived results.
+    """
+    count = 0
+    last_id = 0
+    while True:
+        results = db.session.scalars(
+            db.select(Result)
+            .where(Result.submit_time < cutoff, Result.id > last_id)
+            .order_by(Result.id)
+            .limit(batch_size)
+            .options(
+                db.joinedload(Result.testcase),
+                db.selectinload(Result.data),
+                db.selectinload(Result.groups),
+            )
+        ).all()
+        if not results:
+            break
+
+        ids = [result.id for result in results]
+        last_id = ids[-1]
+        path = os.path.join(directory, archive_file_name(ids[0], last_id))
+        write_archive(path, [archive_record(result) for result in results])
+
+        delete_results(ids)
+        db.session.commit()
+        # The deleted results must not stay in the identity map
+        db.session.expunge_all()
+        count += len(ids)
+        if progress:
+            progress(count)
+
+    return count
@@ -1,14 +1,23 @@
 # SPDX-License-Identifier: GPL-2.0+
+import json
 import logging
-from fnmatch import fnmatch
+import re
+from contextlib import contextmanager
+from fnmatch import fnmatch, translate
+from functools import lru_cache
+from threading import Lock
 
+from opentelemetry import metrics
 from werkzeug.exceptions import (
     BadGateway,
     InternalServerError,
     Forbidden,
 )
 
+from resultsdb.cache import MemoryBackend
+
 log = logging.getLogger(__name__)
+meter = metrics.get_meter(__name__)
 
 
 def get_group_membership(ldap, user, con, ldap_search):
@@ -31,6 +40,93 @@ def get_group_membership(ldap, user, con, ldap_search):
         raise BadGateway("Some error occurred initializing the LDAP connection")
 
 
+class LdapGroups(object):
+    """
+    Worker-local lookup of the LDAP groups of users.
+
+    Groups are cached for `ttl` seconds, or for `negative_ttl` seconds if
+    the user is not found in any group, in up to `max_entries` entries (0
+    disables the cache). Failed searches are not cached. Up to `pool_size`
+    connections to each LDAP host are kept open and reused.
+    """
+
+    def __init__(self, max_entries=0, ttl=0, negative_ttl=0, pool_size=0):
+        self.backend = MemoryBackend(max_entries=max_entries)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.pool_size = pool_size
+        self.lock = Lock()
+        # host -> idle connections
+        self.pools = {}
+        self.hits = 0
+        self.searches = 0
+        self.hits_counter = meter.create_counter(
+            "resultsdb.ldap.cache.hits",
+            description="Number of LDAP group lookups served from cache",
+        )
+        self.searches_counter = meter.create_counter(
+            "resultsdb.ldap.searches", description="Number of LDAP group searches"
+        )
+
+    @contextmanager
+    def connection(self, ldap, host):
+        """
+        Yields an idle connection to the host, or a new one.
+
+        The connection is returned to the pool only if no error occurred, so
+        that connections broken for example by a server restart are dropped.
+        """
+        with self.lock:
+            idle = self.pools.get(host)
+            con = idle.pop() if idle else None
+
+        if con is None:
+            try:
+                con = ldap.initialize(host)
+            except ldap.LDAPError:
+                log.exception("Some error occurred initializing the LDAP connection")
+                raise BadGateway("Some error occurred initializing the LDAP connection")
+
+        try:
+            yield con
+        except Exception:
+            self.discard(ldap, con)
+            raise
+
+        with self.lock:
+            idle = self.pools.setdefault(host, [])
+            if len(idle) < self.pool_size:
+                idle.append(con)
+                return
+        self.discard(ldap, con)
+
+    @staticmethod
+    def discard(ldap, con):
+        try:
+            con.unbind_s()
+        except ldap.LDAPError:
+            log.debug("Failed to close LDAP connection", exc_info=True)
+
+    def get_group_membership(self, ldap, host, user, ldap_search):
+        key = json.dumps([host, ldap_search.get("BASE"), ldap_search.get("SEARCH_STRING"), user])
+        found = self.backend.get_many([key]) if self.max_entries else {}
+        if key in found:
+            self.hits += 1
+            self.hits_counter.add(1)
+            return found[key]
+
+        self.searches += 1
+        self.searches_counter.add(1)
+        with self.connection(ldap, host) as con:
+            groups = get_group_membership(ldap, user, con, ldap_search)
+
+        ttl = self.ttl if groups else self.negative_ttl
+        if self.max_entries and ttl:
+            self.backend.set_many({key: groups}, ttl)
+        return groups
+
+
 def match_testcase_permissions(testcase, permissions):
     for permission in permissions:
         if "testcases" in permission:
@@ -41,14 +137,79 @@ def match_testcase_permissions(testcase, permissions):
                 yield permission
 
 
-def verify_authorization(user, testcase, permissions, ldap_host, ldap_searches):
+def is_glob(pattern):
+    return any(c in pattern for c in "*?[")
+
+
+class PermissionMatcher(object):
+    """
+    Finds the PERMISSIONS entries with a testcase pattern matching a name,
+    in the same order as match_testcase_permissions() without running
+    fnmatch() for every pattern.
+
+    Literal names are looked up in a dict, patterns of the form "prefix*"
+    in a trie, and the remaining patterns are combined into a single regex
+    with an optional lookahead for each. Results for the last `cache_size`
+    testcases are memoized.
+    """
+
+    def __init__(self, permissions, cache_size=1024):
+        self.source = permissions
+        self.permissions = list(permissions)
+        self.literals = {}
+        # Nested dicts by character, the None key holds permission indexes
+        self.prefixes = {}
+        self.regex_groups = []
+        regexes = []
+        for i, permission in enumerate(self.permissions):
+            for pattern in permission.get("testcases", []):
+                if not is_glob(pattern):
+                    self.literals.setdefault(pattern, set()).add(i)
+                elif pattern.endswith("*") and not is_glob(pattern[:-1]):
+                    node = self.prefixes
+                    for c in pattern[:-1]:
+                        node = node.setdefault(c, {})
+                    node.setdefault(None, set()).add(i)
+                else:
+                    name = "p%d" % len(regexes)
+                    regexes.append("(?:(?=(?P<%s>%s))|)" % (name, translate(pattern)))
+                    self.regex_groups.append((name, i))
+        self.regex = re.compile("".join(regexes)) if regexes else None
+        self.match = lru_cache(maxsize=cache_size)(self._match)
+
+    def compiled_from(self, permissions):
+        """Returns True if the permissions have not been replaced or extended."""
+        return permissions is self.source and len(permissions) == len(self.permissions)
+
+    def _match(self, testcase):
+        found = set(self.literals.get(testcase, ()))
+
+        node = self.prefixes
+        for c in testcase:
+            found.update(node.get(None, ()))
+            node = node.get(c)
+            if node is None:
+                break
+        else:
+            found.update(node.get(None, ()))
+
+        if self.regex is not None:
+            m = self.regex.match(testcase)
+            found.update(i for name, i in self.regex_groups if m.group(name) is not None)
+
+        return tuple(self.permissions[i] for i in sorted(found))
+
+
+def verify_authorization(
+    user, testcase, permission_matcher, ldap_host, ldap_searches, ldap_groups=None
+):
     if not (ldap_host and ldap_searches):
         raise InternalServerError(
             "LDAP_HOST and LDAP_SEARCHES also need to be defined if PERMISSIONS is defined"
         )
 
     allowed_groups = []
-    for permission in match_testcase_permissions(testcase, permissions):
+    for permission in permission_matcher.match(testcase):
         if user in permission.get("users", []):
             return True
         allowed_groups += permission.get("groups", [])
@@ -58,15 +219,12 @@ def verify_authorization(user, testcase, permissions, ldap_host, ldap_searches):
     except ImportError:
         raise InternalServerError("If PERMISSIONS is defined, python-ldap needs to be installed")
 
-    try:
-        con = ldap.initialize(ldap_host)
-    except ldap.LDAPError:
-        log.exception("Some error occurred initializing the LDAP connection")
-        raise BadGateway("Some error occurred initializing the LDAP connection")
+    if ldap_groups is None:
+        ldap_groups = LdapGroups()
 
     any_groups_found = False
     for cur_ldap_search in ldap_searches:
-        groups = get_group_membership(ldap, user, con, cur_ldap_search)
+        groups = ldap_groups.get_group_membership(ldap, ldap_host, user, cur_ldap_search)
         if any(g in groups for g in allowed_groups):
             return True
         any_groups_found = any_groups_found or len(groups) > 0
@@ -0,0 +1,278 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Response cache for the latest results queries, and identity cache for the
+result submissions.
+
+Cached entries are invalidated by new results using tags. Each entry
+depends on a few tags derived from the query filter (for example the
+requested item), and every tag has a random token stored in the cache
+backend. The entry remembers the tokens it was computed with, and
+committing a new result replaces the tokens of all the tags the result
+could match. An entry is used only if all its tokens are still the same,
+so only the backend's get_many() and set_many() are needed for the
+invalidation and the backend can be shared by multiple workers.
+"""
+
+import abc
+import hashlib
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+
+import pkg_resources
+from opentelemetry import metrics
+
+log = logging.getLogger(__name__)
+meter = metrics.get_meter(__name__)
+
+# Tag invalidated by any new result
+TAG_ALL = "all"
+
+
+class CacheBackend(object):
+    """Abstract base class that cache backends must extend.
+
+    Two abstract methods are declared which must be implemented:
+        - get_many(keys)
+        - set_many(mapping, ttl)
+
+    Keys are strings and values are JSON-serializable.
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    @abc.abstractmethod
+    def get_many(self, keys):
+        """Returns dict with the values of the keys found in the cache."""
+
+    @abc.abstractmethod
+    def set_many(self, mapping, ttl):
+        """Stores the values, which should expire after ttl seconds."""
+
+
+class MemoryBackend(CacheBackend):
+    """In-process cache backend, storing up to `max_entries` values."""
+
+    max_entries = 10000
+
+    def __init__(self, **kwargs):
+        super(MemoryBackend, self).__init__(**kwargs)
+        self.lock = Lock()
+        # key -> (expiration time, value), in least recently used order
+        self.entries = OrderedDict()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for key in keys:
+                try:
+                    expires, value = self.entries[key]
+                except KeyError:
+                    continue
+                if expires < now:
+                    del self.entries[key]
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, mapping, ttl):
+        expires = time.monotonic() + ttl
+        with self.lock:
+            for key, value in mapping.items():
+                self.entries[key] = (expires, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def load_cache_backend(name, backend_args):
+    """Instantiate and return the appropriate cache backend."""
+    points = pkg_resources.iter_entry_points("resultsdb.cache.backends")
+    classes = {"memory": MemoryBackend}
+    classes.update(dict([(point.name, point.load()) for point in points]))
+
+    log.debug("Found the following installed cache backends %r" % classes)
+    if name not in classes:
+        raise KeyError("%r not found in %r" % (name, classes.keys()))
+
+    cls = classes[name]
+
+    # Sanity check
+    if not issubclass(cls, CacheBackend):
+        raise TypeError("%s %r does not extend CacheBackend." % (name, cls))
+
+    log.debug("Instantiating cache backend %r named %s" % (cls, name))
+    return cls(**backend_args)
+
+
+def tag_key(*parts):
+    return "tag:" + json.dumps(parts)
+
+
+def filter_tags(testcases, result_data):
+    """
+    Returns tags of results which can match the filter.
+
+    Any result matching the filter has one of the values of each exactly
+    matched result data key, so the tags of a single such key are enough.
+    Testcase names are used otherwise, and filters matching only by
+    patterns or groups depend on all new results.
+    """
+    exact_keys = sorted(key for key in (result_data or {}) if ":" not in key)
+    if exact_keys:
+        key = exact_keys[0]
+        return [tag_key("data", key, value) for value in result_data[key]]
+    if testcases:
+        return [tag_key("testcase", name) for name in testcases]
+    return [tag_key(TAG_ALL)]
+
+
+def result_tags(result):
+    """Returns tags of the filters the result can match."""
+    tags = {tag_key(TAG_ALL), tag_key("testcase", result.testcase_name)}
+    tags.update(tag_key("data", rd.key, rd.value) for rd in result.data)
+    return tags
+
+
+def new_token():
+    return uuid.uuid4().hex
+
+
+class ResponseCache(object):
+    """
+    Caches response bodies using the given backend.
+
+    Entries expire after `ttl` seconds even if no new result invalidates
+    them, which also limits how long other workers can serve stale data
+    when using a backend which is not shared.
+    """
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.hits_counter = meter.create_counter(
+            "resultsdb.cache.hits", description="Number of responses served from cache"
+        )
+        self.misses_counter = meter.create_counter(
+            "resultsdb.cache.misses", description="Number of responses missing in cache"
+        )
+        self.invalidations_counter = meter.create_counter(
+            "resultsdb.cache.invalidations", description="Number of cache invalidations"
+        )
+
+    @staticmethod
+    def request_key(request):
+        """Returns cache key for the normalized request URL."""
+        args = sorted((key, sorted(request.args.getlist(key))) for key in request.args)
+        normalized = json.dumps([request.url_root, request.path, args])
+        return "response:" + hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    def lookup(self, key, tags):
+        """
+        Returns cached entry (or None), and the tokens of the tags.
+
+        The tokens must be passed to store() when storing the entry, they
+        are retrieved before the database is queried so that results
+        committed in the meantime invalidate the stored entry.
+        """
+        found = self.backend.get_many([key] + tags)
+        tokens = {tag: found.get(tag) for tag in tags}
+        missing = {tag: new_token() for tag, token in tokens.items() if token is None}
+        if missing:
+            self.backend.set_many(missing, self.ttl)
+            tokens.update(missing)
+
+        entry = found.get(key)
+        if not missing and entry is not None and entry["tokens"] == tokens:
+            self.hits += 1
+            self.hits_counter.add(1)
+            return entry, tokens
+
+        self.misses += 1
+        self.misses_counter.add(1)
+        return None, tokens
+
+    def store(self, key, tokens, entry):
+        self.backend.set_many({key: dict(entry, tokens=tokens)}, self.ttl)
+
+    def invalidate(self, result):
+        """Invalidates all entries which could contain the new result."""
+        self.backend.set_many({tag: new_token() for tag in result_tags(result)}, self.ttl)
+        self.invalidations += 1
+        self.invalidations_counter.add(1)
+
+
+class IdentityCache(object):
+    """
+    Worker-local LRU cache of the ids and attributes of recently used
+    testcases and groups, so that result submissions do not need to look
+    them up in the database every time.
+
+    Testcases and groups are never deleted, but other workers can change
+    their attributes, so the entries expire after `ttl` seconds.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.backend = MemoryBackend(max_entries=max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.hits_counter = meter.create_counter(
+            "resultsdb.identity_cache.hits",
+            description="Number of testcases and groups found in identity cache",
+        )
+        self.misses_counter = meter.create_counter(
+            "resultsdb.identity_cache.misses",
+            description="Number of testcases and groups missing in identity cache",
+        )
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def key(kind, name):
+        return "%s:%s" % (kind, name)
+
+    def lookup(self, kind, items):
+        """
+        Returns dict mapping names to the cached attributes.
+
+        The `items` are pairs of the name and the dict of attributes to set.
+        Items changing any of the cached attributes are treated as missing,
+        so that they are updated in the database.
+        """
+        keys = {name: self.key(kind, name) for name, _ in items}
+        found = self.backend.get_many(list(keys.values()))
+        cached = {name: found[key] for name, key in keys.items() if key in found}
+        for name, attrs in items:
+            entry = cached.get(name)
+            if entry is not None and any(attrs.get(k, v) != v for k, v in entry.items()):
+                del cached[name]
+
+        hits = len(cached)
+        self.hits += hits
+        self.hits_counter.add(hits, {"kind": kind})
+        misses = len(keys) - hits
+        self.misses += misses
+        self.misses_counter.add(misses, {"kind": kind})
+        return cached
+
+    def store(self, kind, entries):
+        """Stores the attributes, given as dict mapping names to dicts."""
+        self.backend.set_many(
+            {self.key(kind, name): attrs for name, attrs in entries.items()}, self.ttl
+        )
@@ -82,6 +82,16 @@ class Config(object):
 
     PERMISSIONS = []
 
+    # The LDAP groups of users checked by the PERMISSIONS are cached by each
+    # worker for LDAP_GROUP_CACHE_TTL seconds, or LDAP_GROUP_CACHE_NEGATIVE_TTL
+    # seconds for users not found in any group, in up to LDAP_GROUP_CACHE_SIZE
+    # entries (0 disables the cache). Up to LDAP_POOL_SIZE connections to the
+    # LDAP server are kept open and reused.
+    LDAP_GROUP_CACHE_SIZE = 1000
+    LDAP_GROUP_CACHE_TTL = 300
+    LDAP_GROUP_CACHE_NEGATIVE_TTL = 60
+    LDAP_POOL_SIZE = 4
+
     # Supported values: "oidc"
     AUTH_MODULE = None
 
@@ -114,9 +124,61 @@ class Config(object):
     #   <topic_prefix>.<environment>.<modname>.<topic>
     # e.g. org.fedoraproject.prod.resultsdb.result.new
     MESSAGE_BUS_KWARGS = {}
+    # Set this to True to store the messages in the outbox table in the same
+    # transaction as the results, instead of publishing them while handling
+    # the request. Run "resultsdb dispatch" to publish them.
+    MESSAGE_BUS_OUTBOX = False
 
-    # Publish Taskotron-compatible fedmsgs on the 'taskotron' topic
+    # Publish Taskotron-compatible fedmsgs on the 'taskotron' topic.
+    # Run "resultsdb rebuild_taskotron_last_outcomes" before enabling it.
     MESSAGE_BUS_PUBLISH_TASKOTRON = False
+
+    # Set this to True to cache the responses of /results/latest queries.
+    # Cached responses are invalidated by new results which match the filter,
+    # and expire after RESULTS_LATEST_CACHE_TTL seconds.
+    RESULTS_LATEST_CACHE = False
+    # Supported values: 'memory', or any other installed cache backend.
+    # The 'memory' backend is not shared between processes, so other workers
+    # can serve stale responses until these expire.
+    RESULTS_LATEST_CACHE_BACKEND = "memory"
+    # Extra arguments for the cache backend, e.g. {"max_entries": 10000}
+    RESULTS_LATEST_CACHE_KWARGS = {}
+    RESULTS_LATEST_CACHE_TTL = 60
+
+    # Number of testcases and groups whose ids and attributes each worker
+    # keeps in memory, so that result submissions do not need to look them up
+    # in the database. Set to 0 to disable. Changes made by other workers are
+    # picked up when the entries expire after IDENTITY_CACHE_TTL seconds.
+    IDENTITY_CACHE_SIZE = 1000
+    IDENTITY_CACHE_TTL = 300
+
+    # Result data keys (e.g. ("item", "type", "scenario")) identifying the
+    # results in the latest_result table, which keeps the latest result for
+    # each testcase and combination of values of these keys. The table is
+    # maintained only if the keys are set. Run "resultsdb rebuild_latest_results"
+    # after changing the keys, and only then set LATEST_RESULT_QUERIES to True
+    # to answer /results/latest queries filtering just by testcases and these
+    # keys from the table.
+    LATEST_RESULT_KEYS = ()
+    LATEST_RESULT_QUERIES = False
+
+    # Set this to True to read the result data from the JSON "data" column of
+    # the result table instead of the result_data table. On PostgreSQL, the
+    # exact matching result data filters then use the GIN-indexed JSONB
+    # column. Run "resultsdb backfill_result_data" before enabling this.
+    RESULT_DATA_JSON = False
+
+    # /results/count returns the PostgreSQL planner's row estimate instead of
+    # counting the results if the planner's cost of the query is higher.
+    RESULTS_COUNT_MAX_EXACT_COST = 100000
+
+    # Maximum number of results accepted by a single batch submission
+    RESULTS_BATCH_LIMIT = 1000
+
+    # Seconds for which a result submission with the Idempotency-Key header
+    # returns the response of the first submission with the same key.
+    # Set to 0 to ignore the header.
+    IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
     OTEL_EXPORTER_OTLP_METRICS_ENDPOINT = None
     OTEL_EXPORTER_SERVICE_NAME = "resultsdb"
 
@@ -146,6 +208,11 @@ class TestingConfig(DevelopmentConfig):
     FEDMENU_URL = "https://apps.stg.fedoraproject.org/fedmenu"
     FEDMENU_DATA_URL = "https://apps.stg.fedoraproject.org/js/data.js"
     ADDITIONAL_RESULT_OUTCOMES = ("AMAZING",)
+    # The tests recreate the database tables
+    IDENTITY_CACHE_SIZE = 0
+    # The tests mock a new LDAP connection for each test
+    LDAP_GROUP_CACHE_SIZE = 0
+    LDAP_POOL_SIZE = 0
     MESSAGE_BUS_PLUGIN = "dummy"
     MESSAGE_BUS_KWARGS = {}
     PERMISSIONS = [
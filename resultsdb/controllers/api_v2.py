@@ -18,28 +18,61 @@
 #   Josef Skladanka <jskladan@redhat.com>
 #   Ralph Bean <rbean@redhat.com>
 
+import csv
+import hashlib
+import io
 import re
 import uuid
-
-from flask import Blueprint, jsonify, request, url_for
+from datetime import datetime
+
+from flask import (
+    Blueprint,
+    Response,
+    json,
+    jsonify,
+    make_response,
+    request,
+    stream_with_context,
+    url_for,
+)
 from flask import current_app as app
 from flask_pydantic import validate
 
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
 from sqlalchemy.orm import exc as orm_exc
+from werkzeug.exceptions import BadRequest
+from werkzeug.http import generate_etag, quote_etag
 
+from resultsdb.cache import filter_tags
 from resultsdb.models import db
-from resultsdb.controllers.common import commit_result, SERIALIZE
+from resultsdb.controllers.common import (
+    GROUP_CACHED_ATTRS,
+    TESTCASE_CACHED_ATTRS,
+    cache_instances,
+    commit_batch,
+    commit_result,
+    idempotent_replay,
+    resolve_groups,
+    resolve_testcases,
+    SERIALIZE,
+)
 from resultsdb.parsers.api_v2 import (
     CreateGroupParams,
     CreateResultParams,
     CreateTestcaseParams,
     GroupsParams,
+    ResultsCountParams,
+    ResultsExportParams,
+    ResultsStatsParams,
     ResultsParams,
     TestcasesParams,
     QUERY_LIMIT,
+    encode_cursor,
 )
-from resultsdb.models.results import Group, Result, Testcase, ResultData
-from resultsdb.models.results import result_outcomes
+from resultsdb.models.results import Group, LatestResult, Result, Testcase, ResultData
+from resultsdb.models.results import result_data_join_condition, result_outcomes
 
 api = Blueprint("api_v2", __name__)
 
@@ -59,9 +92,24 @@ except NameError:
 # =============================================================================
 
 RE_PAGE = re.compile(r"([?&])page=([0-9]+)")
+RE_PAGE_ARG = re.compile(r"([?&])page=[0-9]*&?")
+RE_CURSOR = re.compile(r"([?&])cursor=[^&]*")
 RE_CALLBACK = re.compile(r"([?&])callback=[^&]*&?")
 RE_CLEAN_AMPERSANDS = re.compile(r"&+")
 
+# Number of results fetched from the DB cursor at once by the export
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CSV_FIELDS = (
+    "id",
+    "testcase",
+    "outcome",
+    "submit_time",
+    "note",
+    "ref_url",
+    "groups",
+    "data",
+)
+
 # =============================================================================
 #                               GLOBAL METHODS
 # =============================================================================
@@ -86,6 +134,18 @@ def pagination(q, page, limit):
     return q
 
 
+def eager_load_results(q):
+    """
+    Loads the relationships needed to serialize the results in bulk, with one
+    additional query per relationship for the whole page instead of lazy
+    loading them for each result separately.
+    """
+    options = [db.selectinload(Result.groups), db.selectinload(Result.testcase)]
+    if not app.config["RESULT_DATA_JSON"]:
+        options.append(db.selectinload(Result.data))
+    return q.options(*options)
+
+
 def prev_next_urls(data, limit=QUERY_LIMIT):
     global RE_PAGE
 
@@ -120,6 +180,185 @@ def prev_next_urls(data, limit=QUERY_LIMIT):
     return data, prev, next
 
 
+def keyset_pagination(q, cursor, limit, columns, descending=False):
+    """
+    Sets the ordering, keyset filter and limit for the DB query.
+    The `columns` are the sort key and must identify the rows uniquely, so
+    the page can start right after (or, for "prev" cursors, end right before)
+    the row the cursor points to without having to skip over the preceding
+    rows with OFFSET.
+
+    Rows for "prev" cursors are selected in the reversed order, and
+    keyset_prev_next_urls() is expected to reverse them back.
+    limit+1 is set as 'limit' for the same reason as in pagination().
+    """
+    backwards = cursor.get("direction") == "prev"
+    descending = descending != backwards
+    order = db.desc if descending else db.asc
+    q = q.order_by(None).order_by(*[order(column) for column in columns])
+
+    values = cursor.get("values")
+    if values:
+        if len(values) != len(columns):
+            raise BadRequest("Invalid cursor")
+        try:
+            values = [
+                (
+                    datetime.fromisoformat(value)
+                    if column.type.python_type is datetime
+                    else column.type.python_type(value)
+                )
+                for column, value in zip(columns, values)
+            ]
+        except (TypeError, ValueError):
+            raise BadRequest("Invalid cursor")
+
+        key = db.tuple_(*columns) if len(columns) > 1 else columns[0]
+        value = db.tuple_(*values) if len(values) > 1 else values[0]
+        q = q.filter(key < value if descending else key > value)
+
+    q = q.limit(limit + 1)
+    return q
+
+
+def keyset_prev_next_urls(data, limit, cursor, columns):
+    backwards = cursor.get("direction") == "prev"
+    has_more = len(data) > limit
+    data = data[:limit]
+    if backwards:
+        data = data[::-1]
+
+    placeholder = "[!@#$%^&*PLACEHOLDER*&^%$#@!]"
+    baseurl = RE_PAGE_ARG.sub(r"\1", request.url)
+    baseurl = RE_CALLBACK.sub(r"\1", baseurl)
+    if RE_CURSOR.search(baseurl):
+        baseurl = RE_CURSOR.sub(lambda m: m.group(1) + "cursor=" + placeholder, baseurl)
+    elif baseurl.endswith(("?", "&")):
+        baseurl = "%scursor=%s" % (baseurl, placeholder)
+    elif "?" in baseurl:
+        baseurl = "%s&cursor=%s" % (baseurl, placeholder)
+    else:
+        baseurl = "%s?cursor=%s" % (baseurl, placeholder)
+    baseurl = RE_CLEAN_AMPERSANDS.sub("&", baseurl)
+
+    # Going backwards, there is always the page we came from; going forward,
+    # there is a previous page unless this is the first one.
+    has_prev = has_more if backwards else bool(cursor.get("values"))
+    has_next = has_more or backwards
+
+    prev = None
+    next = None
+    if data:
+        if has_prev:
+            values = [getattr(data[0], column.key) for column in columns]
+            prev = baseurl.replace(placeholder, encode_cursor("prev", values))
+        if has_next:
+            values = [getattr(data[-1], column.key) for column in columns]
+            next = baseurl.replace(placeholder, encode_cursor("next", values))
+
+    return data, prev, next
+
+
+def paginate(q, query, columns, descending=False):
+    """
+    Returns data for the requested page, and URLs of the previous and next
+    page.
+
+    Keyset pagination on the `columns` is used if the request contains
+    `cursor` argument (can be empty for the first page), otherwise the pages
+    are selected by number.
+    """
+    if query.cursor is None:
+        q = pagination(q, query.page, query.limit)
+        return prev_next_urls(q.all(), query.limit)
+
+    q = keyset_pagination(q, query.cursor, query.limit, columns, descending)
+    return keyset_prev_next_urls(q.all(), query.limit, query.cursor, columns)
+
+
+def conditional(response):
+    """
+    Sets ETag computed from the response body, and turns the response into
+    304 Not Modified if the client already has the same version.
+    """
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def results_etag(q):
+    """
+    Returns weak ETag for a list of results matching the query.
+
+    Results are never modified, only added, deleted (by archival or by
+    dropping partitions) or imported with their original ids. The number,
+    the lowest and the highest id of the matching results therefore identify
+    the state of the whole result list for the requested URL, as long as no
+    results are deleted and imported with the same ids in between. This
+    allows answering repeated requests without loading and serializing the
+    results. The ETag is weak because changes of the embedded testcase
+    attributes are not reflected.
+
+    Returns None for requests without If-None-Match, which could not be
+    answered without the results, so the query is run only for conditional
+    requests. Their responses get the ETag of the body, see
+    set_results_etag().
+    """
+    if not request.if_none_match:
+        return None
+
+    count, min_id, max_id = (
+        q.order_by(None)
+        .with_entities(db.func.count(Result.id), db.func.min(Result.id), db.func.max(Result.id))
+        .one()
+    )
+    watermark = "%s\n%s\n%s\n%s" % (request.url, count, min_id, max_id)
+    return hashlib.sha1(watermark.encode("utf-8")).hexdigest()
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) of a statement, executed with its bound parameters processed."""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def compile_explain(element, compiler, **kw):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kw)
+
+
+def explain_query(q):
+    """Returns the PostgreSQL plan of the query as dict with the estimated rows and cost."""
+    plan = db.session.execute(Explain(q.statement)).scalar()
+    return plan[0]["Plan"]
+
+
+def not_modified(etag):
+    """Returns 304 response if the client already has a version with the weak ETag."""
+    if etag is None or not request.if_none_match.contains_weak(etag):
+        return None
+    return app.response_class(status=304, headers={"ETag": quote_etag(etag, weak=True)})
+
+
+def set_results_etag(response, etag):
+    """
+    Sets the weak ETag from results_etag() of the results response, or the
+    ETag of its body for requests without If-None-Match. Returns 304 response
+    instead if the client has the ETag of the same body, with the ETag from
+    results_etag() for its next requests.
+    """
+    body_etag = generate_etag(response.get_data())
+    if etag is None:
+        response.set_etag(body_etag, weak=True)
+        return response
+    if request.if_none_match.contains_weak(body_etag):
+        return app.response_class(status=304, headers={"ETag": quote_etag(etag, weak=True)})
+    response.set_etag(etag, weak=True)
+    return response
+
+
 # =============================================================================
 #                                      GROUPS
 # =============================================================================
@@ -149,14 +388,15 @@ def get_groups(query: GroupsParams):
     if query.uuid:
         q = q.filter(Group.uuid.in_(query.uuid.split(",")))
 
-    q = pagination(q, query.page, query.limit)
-    data, prev, next = prev_next_urls(q.all(), query.limit)
+    data, prev, next = paginate(q, query, [Group.id], descending=True)
 
-    return jsonify(
-        dict(
-            prev=prev,
-            next=next,
-            data=[SERIALIZE(o) for o in data],
+    return conditional(
+        jsonify(
+            dict(
+                prev=prev,
+                next=next,
+                data=[SERIALIZE(o) for o in data],
+            )
         )
     )
 
@@ -168,7 +408,7 @@ def get_group(group_id):
     if not group:
         return jsonify({"message": "Group not found"}), 404
 
-    return jsonify(SERIALIZE(group))
+    return conditional(jsonify(SERIALIZE(group)))
 
 
 @api.route("/groups", methods=["POST"])
@@ -189,6 +429,7 @@ def create_group(body: CreateGroupParams):
     db.session.add(group)
     db.session.commit()
 
+    cache_instances("group", {group.uuid: group}, GROUP_CACHED_ATTRS)
     return jsonify(SERIALIZE(group)), 201
 
 
@@ -248,6 +489,9 @@ def select_results(
 
     # Filter by result_data
     if result_data is not None:
+        use_jsonb = (
+            app.config["RESULT_DATA_JSON"] and db.session.get_bind().dialect.name == "postgresql"
+        )
         for key, values in result_data.items():
             try:
                 key, modifier = key.split(":")
@@ -256,6 +500,7 @@ def select_results(
 
             if modifier == "like":
                 alias = db.aliased(ResultData)
+                q = q.join(alias, result_data_join_condition(alias, since_start, since_end))
                 if len(values) > 1:  # multiple values
                     likes = []
                     # create the (value LIKE foo OR value LIKE bar OR ...) part
@@ -263,14 +508,23 @@ def select_results(
                         value = value.replace("*", "%")
                         likes.append(alias.value.like(value))
                     # put it together to (key = key AND (value LIKE foo OR value LIKE bar OR ...))
-                    q = q.join(alias).filter(db.and_(alias.key == key, db.or_(*likes)))
+                    q = q.filter(db.and_(alias.key == key, db.or_(*likes)))
                 else:
                     value = values[0].replace("*", "%")
-                    q = q.join(alias).filter(db.and_(alias.key == key, alias.value.like(value)))
+                    q = q.filter(db.and_(alias.key == key, alias.value.like(value)))
+
+            elif use_jsonb:
+                # (data @> {key: [foo]} OR data @> {key: [bar]} OR ...) can use the GIN index
+                contains = [
+                    Result.data_json.op("@>")(db.type_coerce({key: [value]}, JSONB))
+                    for value in values
+                ]
+                q = q.filter(db.or_(*contains))
 
             else:
                 alias = db.aliased(ResultData)
-                q = q.join(alias).filter(db.and_(alias.key == key, alias.value.in_(values)))
+                q = q.join(alias, result_data_join_condition(alias, since_start, since_end))
+                q = q.filter(db.and_(alias.key == key, alias.value.in_(values)))
     return q
 
 
@@ -279,6 +533,7 @@ def __get_results_parse_args(query: ResultsParams):
         "_sort": query.sort_,
         "limit": query.limit,
         "page": query.page,
+        "cursor": query.cursor,
         "testcases": query.testcases,
         "testcases:like": query.testcases_like_,
         "groups": query.groups,
@@ -286,6 +541,12 @@ def __get_results_parse_args(query: ResultsParams):
         "outcome": query.outcome,
         "since": query.since,
     }
+    if isinstance(query, ResultsExportParams):
+        args["_format"] = query.format_
+    if isinstance(query, ResultsCountParams):
+        args["_mode"] = query.mode_
+    if isinstance(query, ResultsStatsParams):
+        args["_group_by"] = query.group_by_
 
     # find results_data with the query parameters
     #  these are the paramters other than those defined in RequestParser
@@ -324,16 +585,23 @@ def __get_results(query: ResultsParams, group_ids=None, testcase_names=None):
         _sort=args["_sort"],
     )
 
-    q = pagination(q, args["page"], args["limit"])
-    data, prev, next = prev_next_urls(q.all(), args["limit"])
+    etag = results_etag(q)
+    response = not_modified(etag)
+    if response:
+        return response
+
+    q = eager_load_results(q)
+    descending = args["_sort"] != "asc:submit_time"
+    data, prev, next = paginate(q, query, [Result.submit_time, Result.id], descending)
 
-    return jsonify(
+    response = jsonify(
         dict(
             prev=prev,
             next=next,
             data=[SERIALIZE(o) for o in data],
         )
     )
+    return set_results_etag(response, etag)
 
 
 @api.route("/results", methods=["GET"])
@@ -346,6 +614,45 @@ def get_results(query: ResultsParams):
 @validate()
 def get_results_latest(query: ResultsParams):
     p = __get_results_parse_args(query)
+
+    cache = app.latest_results_cache
+    if not cache:
+        return __get_results_latest(p)
+
+    key = cache.request_key(request)
+    entry, tokens = cache.lookup(key, filter_tags(p["args"]["testcases"], p["result_data"]))
+    if entry:
+        response = not_modified(entry["etag"])
+        if response:
+            return response
+        response = app.response_class(entry["body"], mimetype="application/json")
+        response.set_etag(entry["etag"], weak=True)
+        return response
+
+    response = make_response(__get_results_latest(p))
+    if response.status_code == 200:
+        etag, _ = response.get_etag()
+        cache.store(key, tokens, {"body": response.get_data(as_text=True), "etag": etag})
+    return response
+
+
+def use_latest_result_table(args, result_data):
+    """
+    Returns True if the latest results matching the filter can be found
+    among the results in the latest_result table.
+
+    That is the case if the filter matches only by testcase and by the
+    result data keys the table is maintained for.
+    """
+    keys = app.config["LATEST_RESULT_KEYS"]
+    if not keys or not app.config["LATEST_RESULT_QUERIES"]:
+        return False
+    if args["since"]["start"] or args["since"]["end"] or args["groups"]:
+        return False
+    return all(key.split(":")[0] in keys for key in result_data or ())
+
+
+def __get_results_latest(p):
     args = p["args"]
     since_start = args["since"].get("start", None)
     since_end = args["since"].get("end", None)
@@ -363,17 +670,29 @@ def get_results_latest(query: ResultsParams):
             testcases_like=testcases_like,
             result_data=p["result_data"],
         )
+        sq = select_results(
+            since_start=since_start,
+            since_end=since_end,
+            groups=groups,
+            result_data=p["result_data"],
+        )
+
+        if use_latest_result_table(args, p["result_data"]):
+            # Only the latest result for each testcase and combination of the
+            # configured result data values can be the latest matching one.
+            candidates = db.select(LatestResult.result_id)
+            q = q.filter(Result.id.in_(candidates))
+            sq = sq.filter(Result.id.in_(candidates))
+
+        etag = results_etag(q)
+        response = not_modified(etag)
+        if response:
+            return response
 
         # Produce a subquery with the same filter criteria as above *except*
         # test case name, which we group by and join on.
         sq = (
-            select_results(
-                since_start=since_start,
-                since_end=since_end,
-                groups=groups,
-                result_data=p["result_data"],
-            )
-            .order_by(None)
+            sq.order_by(None)
             .with_entities(
                 Result.testcase_name.label("testcase_name"),
                 db.func.max(Result.submit_time).label("max_submit_time"),
@@ -389,13 +708,14 @@ def get_results_latest(query: ResultsParams):
             ),
         )
 
-        results = q.all()
+        results = eager_load_results(q).all()
 
-        return jsonify(
+        response = jsonify(
             dict(
                 data=[SERIALIZE(o) for o in results],
             )
         )
+        return set_results_etag(response, etag)
 
     if not any([testcases, testcases_like, since_start, since_end, groups, p["result_data"]]):
         return (
@@ -414,24 +734,197 @@ def get_results_latest(query: ResultsParams):
         _sort="disable_sorting",
     )
 
+    etag = results_etag(q)
+    response = not_modified(etag)
+    if response:
+        return response
+
     values_distinct_on = [Result.testcase_name]
     for i, key in enumerate(distinct_on):
         name = "result_data_%s_%s" % (i, key)
         alias = db.aliased(
             db.session.query(ResultData).filter(ResultData.key == key).subquery(), name=name
         )
-        q = q.outerjoin(alias)
+        q = q.outerjoin(alias, result_data_join_condition(alias.c, since_start, since_end))
         values_distinct_on.append(db.text("{}.value".format(name)))
 
     q = q.distinct(*values_distinct_on)
     q = q.order_by(*values_distinct_on).order_by(db.desc(Result.submit_time))
 
-    results = q.all()
+    results = eager_load_results(q).all()
     results = dict(
         data=[SERIALIZE(o) for o in results],
     )
     results["data"] = sorted(results["data"], key=lambda x: x["submit_time"], reverse=True)
-    return jsonify(results)
+    response = jsonify(results)
+    return set_results_etag(response, etag)
+
+
+def export_ndjson(results):
+    for result in results:
+        yield json.dumps(SERIALIZE(result)) + "\n"
+
+
+def export_csv(results):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_CSV_FIELDS)
+    yield buffer.getvalue()
+    for result in results:
+        buffer.seek(0)
+        buffer.truncate()
+        row = SERIALIZE(result)
+        row["testcase"] = row["testcase"]["name"]
+        row["groups"] = json.dumps(row["groups"])
+        row["data"] = json.dumps(row["data"])
+        writer.writerow([row[field] for field in EXPORT_CSV_FIELDS])
+        yield buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    "ndjson": (export_ndjson, "application/x-ndjson"),
+    "csv": (export_csv, "text/csv"),
+}
+
+
+@api.route("/results/export", methods=["GET"])
+@validate()
+def export_results(query: ResultsExportParams):
+    """
+    Streams all the results matching the filters, without pagination.
+
+    The results are fetched from a server-side cursor in batches, so the
+    memory used does not depend on the number of exported results.
+    """
+    p = __get_results_parse_args(query)
+    args = p["args"]
+
+    q = select_results(
+        since_start=args["since"]["start"],
+        since_end=args["since"]["end"],
+        outcomes=args["outcome"],
+        groups=args["groups"],
+        testcases=args["testcases"],
+        testcases_like=args["testcases:like"],
+        result_data=p["result_data"],
+        _sort=args["_sort"],
+    )
+    q = eager_load_results(q).yield_per(EXPORT_BATCH_SIZE)
+
+    export, mimetype = EXPORT_FORMATS[args["_format"]]
+    return Response(stream_with_context(export(q)), mimetype=mimetype)
+
+
+@api.route("/results/count", methods=["GET"])
+@validate()
+def count_results(query: ResultsCountParams):
+    """
+    Returns the number of results matching the filters.
+
+    On PostgreSQL, the planner's row estimate is returned for _mode=estimate,
+    and for _mode=auto if the planner's cost of the query exceeds
+    RESULTS_COUNT_MAX_EXACT_COST. The results are counted otherwise.
+    """
+    p = __get_results_parse_args(query)
+    args = p["args"]
+
+    q = select_results(
+        since_start=args["since"]["start"],
+        since_end=args["since"]["end"],
+        outcomes=args["outcome"],
+        groups=args["groups"],
+        testcases=args["testcases"],
+        testcases_like=args["testcases:like"],
+        result_data=p["result_data"],
+        _sort="disable_sorting",
+    )
+
+    mode = args["_mode"]
+    if mode != "exact" and db.session.get_bind().dialect.name == "postgresql":
+        plan = explain_query(q.with_entities(Result.id))
+        if mode == "estimate" or plan["Total Cost"] > app.config["RESULTS_COUNT_MAX_EXACT_COST"]:
+            return conditional(jsonify(dict(count=int(plan["Plan Rows"]), mode="estimate")))
+
+    # The joins of the result data filters can match a result multiple times
+    if p["result_data"]:
+        count = q.with_entities(db.func.count(db.distinct(Result.id))).scalar()
+    else:
+        count = q.with_entities(db.func.count(Result.id)).scalar()
+    return conditional(jsonify(dict(count=count, mode="exact")))
+
+
+def time_bucket(column, unit):
+    """Returns expression truncating the time to the start of the hour or day."""
+    if db.session.get_bind().dialect.name == "postgresql":
+        return db.func.date_trunc(unit, column)
+    time_format = {"hour": "%Y-%m-%dT%H:00:00", "day": "%Y-%m-%dT00:00:00"}[unit]
+    return db.func.strftime(time_format, column)
+
+
+@api.route("/results/stats", methods=["GET"])
+@validate()
+def get_results_stats(query: ResultsStatsParams):
+    """
+    Returns the number of results matching the filters for each combination
+    of the values of the _group_by fields, computed in a single GROUP BY.
+
+    Results with multiple values of a grouped result data key are counted
+    for each of the values, and results without the key under null, which
+    is sorted first.
+    """
+    p = __get_results_parse_args(query)
+    args = p["args"]
+
+    q = select_results(
+        since_start=args["since"]["start"],
+        since_end=args["since"]["end"],
+        outcomes=args["outcome"],
+        groups=args["groups"],
+        testcases=args["testcases"],
+        testcases_like=args["testcases:like"],
+        result_data=p["result_data"],
+        _sort="disable_sorting",
+    )
+
+    columns = []
+    for field in args["_group_by"]:
+        if field == "testcase":
+            column = Result.testcase_name
+        elif field == "outcome":
+            column = Result.outcome
+        elif field in ("hour", "day"):
+            column = time_bucket(Result.submit_time, field)
+        else:
+            alias = db.aliased(ResultData)
+            key = field.replace("data.", "", 1)
+            condition = result_data_join_condition(
+                alias, args["since"]["start"], args["since"]["end"]
+            )
+            q = q.outerjoin(alias, db.and_(condition, alias.key == key))
+            column = alias.value
+        columns.append(column.label("group_%d" % len(columns)))
+
+    # The joins of the result data filters can match a result multiple times
+    if p["result_data"]:
+        count = db.func.count(db.distinct(Result.id))
+    else:
+        count = db.func.count(Result.id)
+
+    rows = (
+        q.with_entities(*columns, count)
+        .group_by(*columns)
+        .order_by(*(column.asc().nulls_first() for column in columns))
+        .all()
+    )
+
+    data = []
+    for row in rows:
+        item = {}
+        for field, value in zip(args["_group_by"], row):
+            item[field] = value.isoformat() if isinstance(value, datetime) else value
+        item["count"] = row[-1]
+        data.append(item)
+    return conditional(jsonify(dict(data=data)))
 
 
 @api.route("/groups/<group_id>/results", methods=["GET"])
@@ -459,80 +952,116 @@ def get_result(result_id):
     except orm_exc.NoResultFound:
         return jsonify({"message": "Result not found"}), 404
 
-    return jsonify(SERIALIZE(result))
+    return conditional(jsonify(SERIALIZE(result)))
 
 
-@api.route("/results", methods=["POST"])
-@validate()
-def create_result(body: CreateResultParams):
-    if body.data:
-        invalid_keys = [key for key in body.data.keys() if ":" in key]
-        if invalid_keys:
-            app.logger.warning("Colon not allowed in key name: %s", invalid_keys)
-            return jsonify({"message": "Colon not allowed in key name: %r" % invalid_keys}), 400
+def invalid_data_keys(data):
+    return [key for key in (data or {}).keys() if ":" in key]
 
-    tc = body.testcase
 
-    testcase = Testcase.query.filter_by(name=tc["name"]).first()
-    if not testcase:
-        app.logger.debug("Testcase %s does not exist yet. Creating", tc["name"])
-        testcase = Testcase(name=tc["name"])
-    testcase.ref_url = tc.get("ref_url", testcase.ref_url)
-    db.session.add(testcase)
+def result_data_pairs(data):
+    """
+    Returns list of key-value pairs to store as result data.
+
+    For each key-value pair in data:
+      - convert keys to unicode
+      - if value is string: NOP
+      - if value is list or tuple: convert values to unicode, create
+        key-value pair for each value from the list
+      - if value is something else: convert to unicode
+    """
+    to_store = []
+    if not isinstance(data, dict):
+        return to_store
+
+    for key, value in data.items():
+        if not (isinstance(key, str) or isinstance(key, unicode)):
+            key = unicode(key)
+
+        if isinstance(value, str) or isinstance(value, unicode):
+            to_store.append((key, value))
+
+        elif isinstance(value, list) or isinstance(value, tuple):
+            for v in value:
+                if not (isinstance(v, str) or isinstance(v, unicode)):
+                    v = unicode(v)
+                to_store.append((key, v))
+        else:
+            value = unicode(value)
+            to_store.append((key, value))
+
+    return to_store
 
+
+def prepare_results(bodies):
+    """
+    Returns new Result objects for the validated CreateResultParams.
+
+    The testcases and groups of all the results are looked up at once.
+    """
     # groups is a list of strings(uuid) or dicts(group object)
     #  when a group defined by the string is not found, new is created
     #  group defined by the object, is updated/created with the values from the object
     # non-existing groups are created automatically
-    groups = []
-    if body.groups:
-        for grp in body.groups:
+    groups_by_body = []
+    for body in bodies:
+        grps = []
+        for grp in body.groups or []:
             if isinstance(grp, basestring):
                 grp = dict(uuid=grp)
             elif isinstance(grp, dict):
                 grp["uuid"] = grp.get("uuid", str(uuid.uuid1()))
+            grps.append(grp)
+        groups_by_body.append(grps)
+
+    testcases = resolve_testcases([body.testcase for body in bodies])
+    groups = resolve_groups([grp for grps in groups_by_body for grp in grps])
+
+    results = []
+    for body, grps in zip(bodies, groups_by_body):
+        result = Result(
+            testcases[body.testcase["name"]],
+            body.outcome,
+            [groups[grp["uuid"]] for grp in grps],
+            body.ref_url,
+            body.note,
+            body.submit_time,
+        )
+        for key, value in result_data_pairs(body.data):
+            ResultData(result, key, value)
+        results.append(result)
 
-            group = Group.query.filter_by(uuid=grp["uuid"]).first()
-            if not group:
-                group = Group(uuid=grp["uuid"])
-
-            group.description = grp.get("description", group.description)
-            group.ref_url = grp.get("ref_url", group.ref_url)
-
-            db.session.add(group)
-            groups.append(group)
-
-    result = Result(testcase, body.outcome, groups, body.ref_url, body.note, body.submit_time)
-    # Convert result_data
-    #  for each key-value pair in body.data
-    #    convert keys to unicode
-    #    if value is string: NOP
-    #    if value is list or tuple:
-    #      convert values to unicode, create key-value pair for each value from the list
-    #    if value is something else: convert to unicode
-    #  Store all the key-value pairs
-    if isinstance(body.data, dict):
-        to_store = []
-        for key, value in body.data.items():
-            if not (isinstance(key, str) or isinstance(key, unicode)):
-                key = unicode(key)
-
-            if isinstance(value, str) or isinstance(value, unicode):
-                to_store.append((key, value))
-
-            elif isinstance(value, list) or isinstance(value, tuple):
-                for v in value:
-                    if not (isinstance(v, str) or isinstance(v, unicode)):
-                        v = unicode(v)
-                    to_store.append((key, v))
-            else:
-                value = unicode(value)
-                to_store.append((key, value))
+    return results
 
-        for key, value in to_store:
-            ResultData(result, key, value)
 
-    return commit_result(result)
+@api.route("/results", methods=["POST"])
+@validate()
+def create_result(body: CreateResultParams):
+    invalid_keys = invalid_data_keys(body.data)
+    if invalid_keys:
+        app.logger.warning("Colon not allowed in key name: %s", invalid_keys)
+        return jsonify({"message": "Colon not allowed in key name: %r" % invalid_keys}), 400
+
+    idempotency_key, replay = idempotent_replay()
+    if replay is not None:
+        return replay
+
+    (result,) = prepare_results([body])
+    return commit_result(result, idempotency_key)
+
+
+def parse_result_params(item):
+    body = CreateResultParams.model_validate(item)
+    invalid_keys = invalid_data_keys(body.data)
+    if invalid_keys:
+        app.logger.warning("Colon not allowed in key name: %s", invalid_keys)
+        raise BadRequest("Colon not allowed in key name: %r" % invalid_keys)
+    return body
+
+
+@api.route("/results/batch", methods=["POST"])
+def create_results():
+    return commit_batch(request.get_json(), parse_result_params, prepare_results)
 
 
 # =============================================================================
@@ -560,14 +1089,15 @@ def select_testcases(args_name=None, args_name_like=None):
 @validate()
 def get_testcases(query: TestcasesParams):
     q = select_testcases(query.name, query.name_like_)
-    q = pagination(q, query.page, query.limit)
-    data, prev, next = prev_next_urls(q.all(), query.limit)
+    data, prev, next = paginate(q, query, [Testcase.name])
 
-    return jsonify(
-        dict(
-            prev=prev,
-            next=next,
-            data=[SERIALIZE(o) for o in data],
+    return conditional(
+        jsonify(
+            dict(
+                prev=prev,
+                next=next,
+                data=[SERIALIZE(o) for o in data],
+            )
         )
     )
 
@@ -579,7 +1109,7 @@ def get_testcase(testcase_name):
     except orm_exc.NoResultFound:
         return jsonify({"message": "Testcase not found"}), 404
 
-    return jsonify(SERIALIZE(testcase))
+    return conditional(jsonify(SERIALIZE(testcase)))
 
 
 @api.route("/testcases", methods=["POST"])
@@ -594,6 +1124,7 @@ def create_testcase(body: CreateTestcaseParams):
     db.session.add(testcase)
     db.session.commit()
 
+    cache_instances("testcase", {testcase.name: testcase}, TESTCASE_CACHED_ATTRS)
     return jsonify(SERIALIZE(testcase)), 201
 
 
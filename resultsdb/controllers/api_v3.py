@@ -1,15 +1,19 @@
 # SPDX-License-Identifier: GPL-2.0+
-from flask import Blueprint, jsonify, render_template
+from flask import Blueprint, jsonify, render_template, request
 from flask import current_app as app
 from flask_pydantic import validate
 from pydantic import RootModel
-
-from resultsdb.models import db
-from resultsdb.authorization import match_testcase_permissions, verify_authorization
-from resultsdb.controllers.common import commit_result
+from werkzeug.exceptions import Forbidden
+
+from resultsdb.authorization import PermissionMatcher, verify_authorization
+from resultsdb.controllers.common import (
+    commit_batch,
+    commit_result,
+    idempotent_replay,
+    resolve_testcases,
+)
 from resultsdb.models.results import (
     Result,
-    Testcase,
     ResultData,
 )
 from resultsdb.parsers.api_v3 import (
@@ -26,44 +30,94 @@ def permissions():
     return app.config.get("PERMISSIONS", [])
 
 
+def permission_matcher():
+    matcher = app.permission_matcher
+    if not matcher.compiled_from(permissions()):
+        matcher = app.permission_matcher = PermissionMatcher(permissions())
+    return matcher
+
+
 def _verify_authorization(user, testcase):
     ldap_host = app.config.get("LDAP_HOST")
     ldap_searches = app.config.get("LDAP_SEARCHES")
-    return verify_authorization(user, testcase, permissions(), ldap_host, ldap_searches)
+    return verify_authorization(
+        user, testcase, permission_matcher(), ldap_host, ldap_searches, app.ldap_groups
+    )
 
 
-def create_result(body: ResultParamsBase):
-    user = app.oidc.current_token_identity[app.config["OIDC_USERNAME_FIELD"]]
-    _verify_authorization(user, body.testcase)
+def current_user():
+    return app.oidc.current_token_identity[app.config["OIDC_USERNAME_FIELD"]]
+
 
-    testcase = Testcase.query.filter_by(name=body.testcase).first()
-    if not testcase:
-        app.logger.debug("Testcase %s does not exist yet. Creating", body.testcase)
-        testcase = Testcase(name=body.testcase)
+def testcase_params(body: ResultParamsBase):
+    testcase = {"name": body.testcase}
     if body.testcase_ref_url:
         app.logger.debug(
             "Updating ref_url for testcase %s: %s", body.testcase, body.testcase_ref_url
         )
-        testcase.ref_url = str(body.testcase_ref_url)
-    db.session.add(testcase)
+        testcase["ref_url"] = str(body.testcase_ref_url)
+    return testcase
 
-    ref_url = str(body.ref_url) if body.ref_url else None
 
-    result = Result(
-        testcase=testcase,
-        outcome=body.outcome,
-        ref_url=ref_url,
-        note=body.note,
-        groups=[],
-    )
+def prepare_results(bodies, user):
+    """
+    Returns new Result objects for the validated params.
+
+    The testcases of all the results are looked up at once.
+    """
+    testcases = resolve_testcases([testcase_params(body) for body in bodies])
 
-    if user:
-        ResultData(result, "username", user)
+    results = []
+    for body in bodies:
+        ref_url = str(body.ref_url) if body.ref_url else None
+
+        result = Result(
+            testcase=testcases[body.testcase],
+            outcome=body.outcome,
+            ref_url=ref_url,
+            note=body.note,
+            groups=[],
+        )
 
-    for name, value in body.result_data():
-        ResultData(result, name, value)
+        if user:
+            ResultData(result, "username", user)
 
-    return commit_result(result)
+        for name, value in body.result_data():
+            ResultData(result, name, value)
+
+        results.append(result)
+
+    return results
+
+
+def create_result(body: ResultParamsBase):
+    user = current_user()
+    _verify_authorization(user, body.testcase)
+
+    idempotency_key, replay = idempotent_replay()
+    if replay is not None:
+        return replay
+
+    (result,) = prepare_results([body], user)
+    return commit_result(result, idempotency_key)
+
+
+def create_results(params_class, items):
+    user = current_user()
+    authorized = set()
+
+    def parse_item(item):
+        body = params_class.model_validate(item)
+        if body.testcase not in authorized:
+            try:
+                _verify_authorization(user, body.testcase)
+            except Forbidden as e:
+                app.logger.warning("Permission denied: %s", e)
+                raise
+            authorized.add(body.testcase)
+        return body
+
+    return commit_batch(items, parse_item, lambda bodies: prepare_results(bodies, user))
 
 
 def create_endpoint(params_class, oidc, provider):
@@ -76,6 +130,10 @@ def create_endpoint(params_class, oidc, provider):
     def create(body: RootModel[params_class]):
         return create_result(body.root)
 
+    @oidc.token_auth(provider)
+    def create_batch():
+        return create_results(params_class, request.get_json())
+
     def get_schema():
         return jsonify(params.model_construct().model_json_schema()), 200
 
@@ -86,6 +144,12 @@ def create_endpoint(params_class, oidc, provider):
         methods=["POST"],
         view_func=create,
     )
+    api.add_url_rule(
+        f"/results/{artifact_type}s/batch",
+        endpoint=f"results_{artifact_type}s_batch",
+        methods=["POST"],
+        view_func=create_batch,
+    )
     api.add_url_rule(
         f"/schemas/{artifact_type}s",
         endpoint=f"schemas_{artifact_type}s",
@@ -102,7 +166,7 @@ def create_endpoints(oidc, provider):
 @validate()
 def get_permissions(query: PermissionsParams):
     if query.testcase:
-        return list(match_testcase_permissions(query.testcase, permissions()))
+        return list(permission_matcher().match(query.testcase))
 
     return permissions()
 
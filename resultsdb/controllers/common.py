@@ -1,9 +1,30 @@
 # SPDX-License-Identifier: GPL-2.0+
-from flask import jsonify
+import datetime
+import hashlib
+
+from flask import jsonify, request
 from flask import current_app as app
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, make_transient_to_detached, selectinload
+from sqlalchemy.orm.util import identity_key
+from werkzeug.exceptions import BadRequest, Forbidden
 
 from resultsdb.models import db
+from resultsdb.models.results import (
+    Group,
+    IdempotencyKey,
+    Result,
+    Testcase,
+    dialect_insert,
+    result_data_json,
+    update_groups_results_count,
+    update_latest_results,
+    update_taskotron_last_outcomes,
+    utcnow_naive,
+)
 from resultsdb.messaging import (
+    add_to_outbox,
     create_message,
     publish_taskotron_message,
 )
@@ -11,29 +32,317 @@ from resultsdb.serializers.api_v2 import Serializer
 
 SERIALIZE = Serializer().serialize
 
+VALIDATION_KEYS = frozenset({"input", "loc", "msg", "type", "url"})
+
+# Attributes of testcases and groups kept in the identity cache
+TESTCASE_CACHED_ATTRS = ("id", "name", "ref_url")
+GROUP_CACHED_ATTRS = ("id", "uuid", "description", "ref_url")
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
 
-def commit_result(result):
+def validation_errors(errors):
     """
-    Saves result in database and publishes message.
+    Keeps only interesting stuff from pydantic errors and removes objects
+    potentially unserializable in JSON.
+    """
+    return [{k: v for k, v in e.items() if k in VALIDATION_KEYS} for e in errors]
 
-    Returns value for the POST HTTP API response.
+
+def cached_instance(model, attrs):
+    """
+    Returns persistent instance of the model with the attributes from the
+    identity cache, without loading it from the database.
     """
-    db.session.add(result)
+    instance = db.session.identity_map.get(identity_key(model, attrs["id"]))
+    if instance is None:
+        instance = model(**{k: v for k, v in attrs.items() if k != "id"})
+        instance.id = attrs["id"]
+        make_transient_to_detached(instance)
+        db.session.add(instance)
+    return instance
+
+
+def cached_instances(model, kind, items):
+    """
+    Returns dict mapping names to the instances found in the identity cache.
+
+    The `items` are pairs of the name and the dict of attributes to set.
+    """
+    if not app.identity_cache:
+        return {}
+
+    cached = app.identity_cache.lookup(kind, items)
+    return {name: cached_instance(model, attrs) for name, attrs in cached.items()}
+
+
+def cache_instances(kind, instances, attrs):
+    """Stores the given attributes of the instances in the identity cache."""
+    if app.identity_cache and instances:
+        app.identity_cache.store(
+            kind,
+            {
+                name: {attr: getattr(instance, attr) for attr in attrs}
+                for name, instance in instances.items()
+            },
+        )
+
+
+def upsert_instances(model, name_attr, attrs, items):
+    """
+    Returns dict mapping names to persistent instances of the model.
+
+    The `items` are dicts with the name under `name_attr` and any of the
+    `attrs` to set, later items override the earlier ones with the same
+    name. Missing rows are inserted and the given attributes of the existing
+    ones are updated with native upserts, so concurrent submissions creating
+    the same rows do not fail on the unique constraint. Existing rows which
+    already have the values are not updated, so they are not locked, and
+    are selected after.
+    """
+    rows = {}
+    for item in items:
+        row = rows.setdefault(item[name_attr], {name_attr: item[name_attr]})
+        row.update((attr, item[attr]) for attr in attrs if attr in item)
+
+    # Rows setting the same attributes are upserted with single statement
+    statements = {}
+    for name in sorted(rows):
+        row = rows[name]
+        statements.setdefault(tuple(attr for attr in attrs if attr in row), []).append(row)
+
+    table = model.__table__
+    columns = [table.c.id, table.c[name_attr]] + [table.c[attr] for attr in attrs]
+    found = {}
+    for set_attrs, statement_rows in statements.items():
+        stmt = dialect_insert(table)
+        if set_attrs:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c[name_attr]],
+                set_={attr: stmt.excluded[attr] for attr in set_attrs},
+                where=db.or_(
+                    *(table.c[attr].is_distinct_from(stmt.excluded[attr]) for attr in set_attrs)
+                ),
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[table.c[name_attr]])
+        for row in db.session.execute(stmt.returning(*columns), statement_rows):
+            found[row._mapping[name_attr]] = cached_instance(model, dict(row._mapping))
+
+    # RETURNING does not include the existing rows which were not updated
+    unchanged = [name for name in sorted(rows) if name not in found]
+    if unchanged:
+        for row in db.session.execute(
+            db.select(*columns).where(table.c[name_attr].in_(unchanged))
+        ):
+            found[row._mapping[name_attr]] = cached_instance(model, dict(row._mapping))
+
+    return found
+
+
+def resolve_testcases(testcases):
+    """
+    Returns dict mapping testcase names to Testcase objects.
+
+    The `testcases` are dicts with "name" and optionally "ref_url" to set.
+    Testcases are taken from the identity cache, or created or updated with
+    a single upsert.
+    """
+    found = cached_instances(Testcase, "testcase", [(tc["name"], tc) for tc in testcases])
+    missing = [tc for tc in testcases if tc["name"] not in found]
+    if missing:
+        found.update(upsert_instances(Testcase, "name", ("ref_url",), missing))
+    return found
+
+
+def resolve_groups(groups):
+    """
+    Returns dict mapping group uuids to Group objects.
+
+    The `groups` are dicts with "uuid" and optionally "description" and
+    "ref_url" to set. Groups are taken from the identity cache, or created or
+    updated with a single upsert.
+    """
+    found = cached_instances(Group, "group", [(grp["uuid"], grp) for grp in groups])
+    missing = [grp for grp in groups if grp["uuid"] not in found]
+    if missing:
+        found.update(upsert_instances(Group, "uuid", ("description", "ref_url"), missing))
+    return found
+
+
+def idempotent_replay():
+    """
+    Looks up the response stored for the Idempotency-Key request header,
+    using the unique index on the key.
+
+    Returns the key to pass to commit_result() (None if the header is not
+    set), and the response to return instead of creating the result (None
+    unless the key was already used).
+    """
+    ttl = app.config["IDEMPOTENCY_KEY_TTL"]
+    key = request.headers.get("Idempotency-Key")
+    if not key or not ttl:
+        return None, None
+
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        message = "Idempotency-Key must be at most %d characters" % IDEMPOTENCY_KEY_MAX_LENGTH
+        return None, (jsonify({"message": message}), 400)
+
+    request_hash = hashlib.sha1(request.get_data()).hexdigest()
+    stored = db.session.scalars(
+        db.select(IdempotencyKey).where(IdempotencyKey.key == key)
+    ).one_or_none()
+    if stored is not None and stored.created_at < utcnow_naive() - datetime.timedelta(seconds=ttl):
+        # Expired, the key can be used again
+        db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.id == stored.id))
+        stored = None
+
+    if stored is None:
+        return (key, request_hash), None
+
+    if stored.request_hash != request_hash:
+        message = "Idempotency-Key was already used for a different request"
+        return None, (jsonify({"message": message}), 422)
+
+    app.logger.debug("Replaying response for Idempotency-Key %s", key)
+    response = jsonify(stored.response)
+    response.headers["Idempotent-Replayed"] = "true"
+    return None, (response, 201)
+
+
+def commit_results(results, idempotency_key=None):
+    """
+    Saves results in database in a single transaction and publishes
+    messages.
+
+    The rows of all the results are inserted together by the flush. The
+    serialized result is stored in the same transaction with the
+    `idempotency_key` from idempotent_replay(), if given, which allows only
+    a single result.
+
+    Returns list of the serialized results.
+    """
+    if not results:
+        return []
+
+    for result in results:
+        result.data_json = result_data_json(result)
+    db.session.add_all(results)
+    db.session.flush()
+    update_groups_results_count(results)
+    if app.config["LATEST_RESULT_KEYS"]:
+        update_latest_results(results, app.config["LATEST_RESULT_KEYS"])
+    if app.config["MESSAGE_BUS_PUBLISH_TASKOTRON"]:
+        prev_outcomes = update_taskotron_last_outcomes(results)
+    use_outbox = app.messaging_plugin and app.config["MESSAGE_BUS_OUTBOX"]
+    if use_outbox:
+        for result in results:
+            add_to_outbox(create_message(result))
+    if idempotency_key is not None:
+        (result,) = results
+        key, request_hash = idempotency_key
+        db.session.add(
+            IdempotencyKey(key=key, request_hash=request_hash, response=SERIALIZE(result))
+        )
+    result_ids = [result.id for result in results]
     db.session.commit()
 
-    app.logger.debug(
-        "Created new result for testcase %s with outcome %s",
-        result.testcase.name,
-        result.outcome,
+    # Reload the expired results at once rather than one by one
+    db.session.scalars(
+        db.select(Result)
+        .where(Result.id.in_(result_ids))
+        .options(
+            joinedload(Result.testcase),
+            selectinload(Result.groups),
+            selectinload(Result.data),
+        )
+    ).all()
+
+    # The reloaded attributes are up to date
+    cache_instances(
+        "testcase",
+        {result.testcase.name: result.testcase for result in results},
+        TESTCASE_CACHED_ATTRS,
+    )
+    cache_instances(
+        "group",
+        {group.uuid: group for result in results for group in result.groups},
+        GROUP_CACHED_ATTRS,
     )
 
-    if app.messaging_plugin:
-        app.logger.debug("Preparing to publish message for result id %d", result.id)
-        message = create_message(result)
-        app.messaging_plugin.publish(message)
+    for result in results:
+        app.logger.debug(
+            "Created new result for testcase %s with outcome %s",
+            result.testcase.name,
+            result.outcome,
+        )
 
-    if app.config["MESSAGE_BUS_PUBLISH_TASKOTRON"]:
-        app.logger.debug("Preparing to publish Taskotron message for result id %d", result.id)
-        publish_taskotron_message(result)
+        if app.latest_results_cache:
+            app.latest_results_cache.invalidate(result)
+
+        if app.messaging_plugin and not use_outbox:
+            app.logger.debug("Preparing to publish message for result id %d", result.id)
+            message = create_message(result)
+            app.messaging_plugin.publish(message)
+
+        if app.config["MESSAGE_BUS_PUBLISH_TASKOTRON"]:
+            app.logger.debug("Preparing to publish Taskotron message for result id %d", result.id)
+            publish_taskotron_message(result, prev_outcomes[result.id])
+
+    return [SERIALIZE(result) for result in results]
+
+
+def commit_result(result, idempotency_key=None):
+    """
+    Saves result in database and publishes message.
+
+    Returns value for the POST HTTP API response.
+    """
+    try:
+        data = commit_results([result], idempotency_key)
+    except IntegrityError:
+        if idempotency_key is None:
+            raise
+        # Concurrent request with the same key committed first
+        db.session.rollback()
+        _, replay = idempotent_replay()
+        if replay is None:
+            raise
+        return replay
+    return jsonify(data[0]), 201
+
+
+def commit_batch(items, parse_item, prepare_results):
+    """
+    Saves results of a batch submission in a single transaction.
+
+    Each item is validated with `parse_item(item)`, which returns the params
+    or raises ValidationError, BadRequest or Forbidden for the item. The
+    valid items are passed to `prepare_results(params_list)` returning the
+    new Result objects, and the invalid ones are skipped.
+
+    Returns value for the POST HTTP API response, with status of each item.
+    """
+    if not isinstance(items, list) or not items:
+        return jsonify({"message": "Expected non-empty list of results"}), 400
+
+    limit = app.config["RESULTS_BATCH_LIMIT"]
+    if len(items) > limit:
+        return jsonify({"message": "Too many results, the limit is %d" % limit}), 400
+
+    statuses = [None] * len(items)
+    valid = []
+    for i, item in enumerate(items):
+        try:
+            valid.append((i, parse_item(item)))
+        except ValidationError as e:
+            statuses[i] = {"status": 400, "validation_error": validation_errors(e.errors())}
+        except (BadRequest, Forbidden) as e:
+            statuses[i] = {"status": e.code, "message": e.description}
+
+    results = prepare_results([params for _, params in valid])
+    for (i, _), data in zip(valid, commit_results(results)):
+        statuses[i] = {"status": 201, "result": data}
 
-    return jsonify(SERIALIZE(result)), 201
+    status = 201 if len(valid) == len(items) else 207
+    return jsonify({"data": statuses}), status
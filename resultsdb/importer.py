@@ -0,0 +1,272 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Bulk import of results in the API v2 format, see "resultsdb import".
+
+The rows are inserted without the ORM: streamed with COPY on PostgreSQL,
+and with batched executemany on other databases. Missing testcases and
+groups are created, and the derived tables (group results counts, latest
+results, Taskotron last outcomes) are updated in the same transaction as
+each batch. No messages are published for the imported results.
+"""
+
+import datetime
+import io
+import itertools
+import json
+import uuid
+from collections import Counter, namedtuple
+
+import iso8601
+from flask import current_app as app
+
+from resultsdb.controllers.api_v2 import result_data_pairs
+from resultsdb.models import db
+from resultsdb.models.results import (
+    Group,
+    GroupsToResults,
+    Result,
+    ResultData,
+    Testcase,
+    dialect_insert,
+    increment_groups_results_count,
+    update_latest_results,
+    update_taskotron_last_outcomes,
+    utcnow_naive,
+)
+from resultsdb.parsers.api_v2 import CreateResultParams
+
+# Stand-ins for Result and ResultData with the attributes needed by
+# update_latest_results() and update_taskotron_last_outcomes()
+ImportedResult = namedtuple("ImportedResult", "id testcase_name submit_time outcome data")
+ImportedResultData = namedtuple("ImportedResultData", "key value")
+
+# Tables whose secondary indexes can be rebuilt after the import
+INDEXED_TABLES = (Result.__table__, ResultData.__table__, GroupsToResults.__table__)
+
+
+def parse_record(line):
+    """
+    Returns the result id (or None) and the CreateResultParams of a line.
+
+    Besides the formats accepted by the API, submit_time can be in the ISO
+    8601 format of the API responses.
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("Expected JSON object, got %r" % record)
+
+    submit_time = record.get("submit_time")
+    if isinstance(submit_time, str):
+        try:
+            submit_time = iso8601.parse_date(submit_time)
+            record["submit_time"] = submit_time.astimezone(datetime.timezone.utc).replace(
+                tzinfo=None
+            )
+        except iso8601.ParseError:
+            pass
+
+    return record.get("id"), CreateResultParams.model_validate(record)
+
+
+def group_values(group):
+    if isinstance(group, str):
+        return dict(uuid=group, description=None, ref_url=None)
+    return dict(
+        uuid=group.get("uuid") or str(uuid.uuid1()),
+        description=group.get("description"),
+        ref_url=group.get("ref_url"),
+    )
+
+
+def copy_value(value):
+    """Encodes value for COPY in the CSV format, where NULL is unquoted empty string."""
+    if value is None:
+        return ""
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    return '"%s"' % value.replace('"', '""')
+
+
+def insert_rows(table, columns, rows, postgresql):
+    """Inserts the rows (dicts with the column keys) with COPY or executemany."""
+    if not rows:
+        return
+
+    if not postgresql:
+        db.session.execute(db.insert(table), rows)
+        return
+
+    buf = io.StringIO()
+    for row in rows:
+        buf.write(",".join(copy_value(row[column]) for column in columns))
+        buf.write("\n")
+    buf.seek(0)
+
+    preparer = db.session.get_bind().dialect.identifier_preparer
+    sql = "COPY %s (%s) FROM STDIN WITH (FORMAT csv)" % (
+        preparer.format_table(table),
+        ", ".join(preparer.quote(table.c[column].name) for column in columns),
+    )
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(sql, buf)
+    finally:
+        cursor.close()
+
+
+def new_result_ids(count, postgresql):
+    """Returns iterator of ids for results without one in the imported data."""
+    if postgresql:
+        return iter(
+            db.session.scalars(
+                db.text(
+                    "SELECT nextval(pg_get_serial_sequence('result', 'id'))"
+                    " FROM generate_series(1, :count)"
+                ),
+                {"count": count},
+            ).all()
+        )
+    max_id = db.session.query(db.func.max(Result.id)).scalar() or 0
+    return iter(range(max_id + 1, max_id + count + 1))
+
+
+def import_batch(records, postgresql):
+    testcases = {}
+    groups = {}
+    for _, body in records:
+        name = body.testcase["name"]
+        testcases[name] = testcases.get(name) or body.testcase.get("ref_url")
+    if testcases:
+        stmt = dialect_insert(Testcase.__table__).on_conflict_do_nothing(index_elements=["name"])
+        db.session.execute(
+            stmt, [dict(name=name, ref_url=ref_url) for name, ref_url in testcases.items()]
+        )
+
+    result_ids = new_result_ids(sum(1 for id_, _ in records if id_ is None), postgresql)
+    now = utcnow_naive()
+    result_rows = []
+    data_rows = []
+    group_rows = []
+    imported = []
+    for result_id, body in records:
+        if result_id is None:
+            result_id = next(result_ids)
+
+        data = [ImportedResultData(key, value) for key, value in result_data_pairs(body.data)]
+        data_json = {}
+        for rd in data:
+            data_json.setdefault(rd.key, []).append(rd.value)
+        submit_time = body.submit_time or now
+
+        result_rows.append(
+            dict(
+                id=result_id,
+                testcase_name=body.testcase["name"],
+                submit_time=submit_time,
+                outcome=body.outcome,
+                note=body.note,
+                ref_url=body.ref_url,
+                data=data_json,
+            )
+        )
+        data_rows.extend(
+            dict(result_id=result_id, key=rd.key, value=rd.value, submit_time=submit_time)
+            for rd in data
+        )
+        for group in body.groups or []:
+            group = group_values(group)
+            groups.setdefault(group["uuid"], group)
+            group_rows.append(dict(group_uuid=group["uuid"], result_id=result_id))
+        imported.append(
+            ImportedResult(result_id, body.testcase["name"], submit_time, body.outcome, data)
+        )
+
+    if groups:
+        stmt = dialect_insert(Group.__table__).on_conflict_do_nothing(index_elements=["uuid"])
+        db.session.execute(stmt, list(groups.values()))
+
+    insert_rows(
+        Result.__table__,
+        ("id", "testcase_name", "submit_time", "outcome", "note", "ref_url", "data"),
+        result_rows,
+        postgresql,
+    )
+    insert_rows(
+        ResultData.__table__,
+        ("result_id", "key", "value", "submit_time"),
+        data_rows,
+        postgresql,
+    )
+    insert_rows(GroupsToResults.__table__, ("group_uuid", "result_id"), group_rows, postgresql)
+
+    increment_groups_results_count(Counter(row["group_uuid"] for row in group_rows))
+    if app.config["LATEST_RESULT_KEYS"]:
+        update_latest_results(imported, app.config["LATEST_RESULT_KEYS"])
+    if app.config["MESSAGE_BUS_PUBLISH_TASKOTRON"]:
+        update_taskotron_last_outcomes(imported)
+
+
+def import_results(lines, batch_size, progress=None):
+    """
+    Imports results from the lines of NDJSON, committing every `batch_size`
+    results, and calls `progress(count)` after each batch.
+
+    Results keep their ids if set, so either all or none of the imported
+    results should have it.
+
+    Returns the number of imported results. Raises ValueError for invalid
+    lines, the previous batches stay imported.
+    """
+    postgresql = db.session.get_bind().dialect.name == "postgresql"
+    lines = enumerate(lines, 1)
+    count = 0
+    while True:
+        batch = list(itertools.islice(lines, batch_size))
+        if not batch:
+            break
+
+        records = []
+        for lineno, line in batch:
+            if not line.strip():
+                continue
+            try:
+                records.append(parse_record(line))
+            except ValueError as e:
+                raise ValueError("Invalid result on line %d: %s" % (lineno, e)) from e
+        if not records:
+            continue
+
+        import_batch(records, postgresql)
+        db.session.commit()
+        count += len(records)
+        if progress:
+            progress(count)
+
+    if postgresql and count:
+        db.session.execute(
+            db.text("SELECT setval(pg_get_serial_sequence('result', 'id'), max(id)) FROM result")
+        )
+        db.session.commit()
+
+    return count
+
+
+def drop_indexes():
+    """Drops the secondary indexes of the result tables and returns them."""
+    indexes = [index for table in INDEXED_TABLES for index in table.indexes]
+    connection = db.session.connection()
+    for index in indexes:
+        index.drop(connection, checkfirst=True)
+    db.session.commit()
+    return indexes
+
+
+def create_indexes(indexes):
+    connection = db.session.connection()
+    for index in indexes:
+        index.create(connection, checkfirst=True)
+    db.session.commit()
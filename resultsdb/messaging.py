@@ -18,16 +18,25 @@
 #   Ralph Bean <rbean@redhat.com>
 
 import abc
+import atexit
+import fcntl
+import glob
 import json
-from threading import Lock
+import os
+import queue
+import uuid
+import weakref
+from threading import Lock, Thread
 
 import pkg_resources
 import stomp
-from opentelemetry import trace
-from tenacity import retry, stop_after_attempt, wait_exponential
+from opentelemetry import metrics, trace
+from opentelemetry.metrics import Observation
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
 from resultsdb.models import db
-from resultsdb.models.results import Result, ResultData
+from resultsdb.models.results import OutboxMessage, Result, ResultData, utcnow_naive
+from resultsdb.models.results import result_data_join_condition
 from resultsdb.serializers.api_v2 import Serializer
 
 import logging
@@ -44,12 +53,60 @@ from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapProp
 
 log = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
+meter = metrics.get_meter(__name__)
+
+OUTBOX_PUBLISHED = meter.create_counter(
+    "resultsdb.outbox.published", description="Number of messages published from the outbox"
+)
+OUTBOX_LAG = meter.create_histogram(
+    "resultsdb.outbox.lag",
+    unit="s",
+    description="Time between storing a message in the outbox and publishing it",
+)
 
 SERIALIZE = Serializer().serialize
 
 STOMP_RETRY_STOP = stop_after_attempt(3)
 STOMP_RETRY_WAIT = wait_exponential(multiplier=2, min=5, max=15)
 
+FEDMSG_RETRY_STOP = stop_after_attempt(3)
+FEDMSG_RETRY_WAIT = wait_exponential(multiplier=2, min=1, max=10)
+
+# Overflow policies of QueuedMessagingPlugin
+OVERFLOW_POLICIES = ("block", "drop", "spill")
+# Plugins publishing from a background thread, reported by the gauges below
+QUEUED_PLUGINS = weakref.WeakSet()
+
+MESSAGES_DROPPED = meter.create_counter(
+    "resultsdb.messaging.dropped", description="Number of messages dropped by messaging plugin"
+)
+MESSAGES_SPILLED = meter.create_counter(
+    "resultsdb.messaging.spilled",
+    description="Number of messages spilled to disk by messaging plugin",
+)
+
+
+def observe_queue_depth(options):
+    for plugin in list(QUEUED_PLUGINS):
+        yield Observation(plugin.queue.qsize(), {"plugin": plugin.name})
+
+
+def observe_spill_depth(options):
+    for plugin in list(QUEUED_PLUGINS):
+        yield Observation(plugin.spilled, {"plugin": plugin.name})
+
+
+meter.create_observable_gauge(
+    "resultsdb.messaging.queue_depth",
+    callbacks=[observe_queue_depth],
+    description="Number of messages waiting in the publish queue",
+)
+meter.create_observable_gauge(
+    "resultsdb.messaging.spill_depth",
+    callbacks=[observe_spill_depth],
+    description="Number of spilled messages waiting to be published",
+)
+
 
 def get_prev_result(result):
     """
@@ -61,6 +118,9 @@ def get_prev_result(result):
     (for example 'scenario' which is used in OpenQA results). But this is only
     used for publishing Taskotron compatibility messages, thus we keep this
     logic as is.
+
+    The submission uses the stored TaskotronLastOutcome instead, which
+    avoids this query.
     """
     q = db.session.query(Result).filter(Result.id != result.id)
     q = q.filter_by(testcase_name=result.testcase_name)
@@ -68,7 +128,7 @@ def get_prev_result(result):
     for result_data in result.data:
         if result_data.key in ["item", "type", "arch"]:
             alias = db.aliased(ResultData)
-            q = q.join(alias).filter(
+            q = q.join(alias, result_data_join_condition(alias)).filter(
                 db.and_(alias.key == result_data.key, alias.value == result_data.value)
             )
 
@@ -76,15 +136,17 @@ def get_prev_result(result):
     return q.first()
 
 
-def publish_taskotron_message(result):
+def publish_taskotron_message(result, prev_outcome):
     """
     Publish a fedmsg on the taskotron topic with Taskotron-compatible structure.
 
+    The `prev_outcome` is the outcome of the previous result for the same
+    task (or None), as returned by update_taskotron_last_outcomes().
+
     These messages are deprecated, consumers should consume from the resultsdb
     topic instead.
     """
-    prev_result = get_prev_result(result)
-    if prev_result is not None and prev_result.outcome == result.outcome:
+    if prev_outcome == result.outcome:
         # If the previous result had the same outcome, skip publishing
         # a message for this new result.
         # This was intended as a workaround to avoid spammy messages from the
@@ -109,7 +171,7 @@ def publish_taskotron_message(result):
         "result": {
             "id": result.id,
             "submit_time": result.submit_time.strftime("%Y-%m-%d %H:%M:%S UTC"),
-            "prev_outcome": prev_result.outcome if prev_result else None,
+            "prev_outcome": prev_outcome,
             "outcome": result.outcome,
             "log_url": result.ref_url,
         },
@@ -134,12 +196,63 @@ def create_message(result):
     return SERIALIZE(result)
 
 
+def add_to_outbox(message):
+    """Stores message to be published by dispatch_outbox() in the current transaction."""
+    # Keep the trace context of the request, the dispatcher does not override it
+    TraceContextTextMapPropagator().inject(message)
+    db.session.add(OutboxMessage(message=message))
+
+
+def dispatch_outbox(plugin, batch_size):
+    """
+    Publishes the oldest messages from the outbox and deletes them.
+
+    The messages are deleted only after they are published, so messages
+    published right before a crash are published again (at-least-once
+    delivery). On PostgreSQL, the rows are locked with SKIP LOCKED, so
+    multiple dispatchers can run at the same time (without keeping the order
+    of the messages).
+
+    The messages are sent with the publish_now() method of the plugin, which
+    raises an exception if the message bus did not accept the message.
+
+    Returns the number of published messages. If publishing fails, the
+    messages published so far are deleted and the exception is raised.
+    """
+    messages = db.session.scalars(
+        db.select(OutboxMessage)
+        .order_by(OutboxMessage.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+
+    published = 0
+    try:
+        for message in messages:
+            plugin.publish_now(message.message)
+            OUTBOX_LAG.record((utcnow_naive() - message.created_at).total_seconds())
+            db.session.delete(message)
+            published += 1
+    except Exception:
+        log.exception("Failed to publish message %d from the outbox", message.id)
+        raise
+    finally:
+        OUTBOX_PUBLISHED.add(published)
+        db.session.commit()
+
+    if published:
+        log.debug("Published %d messages from the outbox", published)
+    return published
+
+
 class MessagingPlugin(object):
     """Abstract base class that messaging plugins must extend.
 
     One abstract method is declared which must be implemented:
         - publish(message)
 
+    Plugins which can lose messages in publish() (e.g. log the errors
+    instead of raising them) must also implement publish_now(message).
     """
 
     __metaclass__ = abc.ABCMeta
@@ -152,6 +265,10 @@ class MessagingPlugin(object):
     def publish(self, message):
         pass
 
+    def publish_now(self, message):
+        """Publishes the message right away, raises an exception if it was not published."""
+        self.publish(message)
+
 
 class DummyPlugin(MessagingPlugin):
     """A dummy plugin used for testing.  Just logs the messages."""
@@ -168,10 +285,237 @@ class DummyPlugin(MessagingPlugin):
         log.info("%r->%r" % (self, message))
 
 
-class FedmsgPlugin(MessagingPlugin):
-    """A fedmsg plugin, used to publish to the fedmsg bus."""
+class QueuedMessagingPlugin(MessagingPlugin):
+    """
+    Base class of the messaging plugins which can publish from a background
+    thread.
+
+    With the `async_publish` option, publish() only adds the message to a
+    queue of at most `queue_size` messages, and a background thread sends
+    them in batches of up to `batch_size` messages. If the queue is full,
+    the `overflow` option decides whether publish() waits ("block"), the
+    message is dropped ("drop"), or the message is appended to a file in
+    `spill_dir` ("spill") to be sent once the queue is empty. Messages
+    which cannot be sent even after the retries are dropped, or spilled with
+    the "spill" policy.
+
+    The spilled messages are not ordered with the queued ones. Spill files
+    left behind by processes which exited are picked up by the next process
+    starting to publish.
+
+    Subclasses call _setup_async() when initialized, and implement
+    _send_with_retry(bodies) sending the JSON encoded messages.
+    """
+
+    # Used in the metrics and names of the spill files
+    name = None
+
+    async_publish = False
+    queue_size = 1000
+    batch_size = 100
+    overflow = "block"
+    spill_dir = None
+    # Seconds to wait for the queued messages to be sent on exit
+    shutdown_timeout = 10
+    # Seconds between attempts to send the spilled messages
+    spill_interval = 1
+
+    def _setup_async(self):
+        if not self.async_publish:
+            return
+
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Invalid 'overflow' option {self.overflow!r} for {self.name} messaging plugin,"
+                f" expected one of {OVERFLOW_POLICIES!r}"
+            )
+        if self.overflow == "spill" and self.spill_dir is None:
+            raise ValueError(f"Missing 'spill_dir' option for {self.name} messaging plugin")
+
+        self.sender_lock = Lock()
+        self._reset_sender()
+        QUEUED_PLUGINS.add(self)
+        atexit.register(self.close)
+
+    @abc.abstractmethod
+    def _send_with_retry(self, bodies):
+        """Sends the message bodies, removing them from the list once sent."""
+
+    def _reset_sender(self):
+        # Threads, locks and open files are not usable after fork
+        self.sender_pid = os.getpid()
+        self.sender = None
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.spill_lock = Lock()
+        self.spill_file = None
+        self.spilled = 0
+
+    def _start_sender(self):
+        with self.sender_lock:
+            if self.sender_pid != os.getpid():
+                self._reset_sender()
+            if self.sender is None:
+                self.sender = Thread(
+                    target=self._run_sender, name="%s-sender" % self.name, daemon=True
+                )
+                self.sender.start()
+
+    def _enqueue(self, body):
+        self._start_sender()
+        if self.overflow == "block":
+            self.queue.put(body)
+            return
+
+        try:
+            self.queue.put_nowait(body)
+        except queue.Full:
+            if self.overflow == "spill":
+                self._spill([body])
+            else:
+                log.error("%s publish queue is full, dropping message: %s", self.name, body)
+                MESSAGES_DROPPED.add(1, {"plugin": self.name})
+
+    def _run_sender(self):
+        if self.overflow == "spill":
+            self._adopt_spill_files()
+            self._send_spilled()
+
+        stopping = False
+        while not stopping:
+            try:
+                bodies = [self.queue.get(timeout=self.spill_interval)]
+            except queue.Empty:
+                self._send_spilled()
+                continue
+
+            while len(bodies) < self.batch_size:
+                try:
+                    bodies.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # None is queued by close()
+            stopping = None in bodies
+            self._send_batch([body for body in bodies if body is not None])
+
+    def _send_batch(self, bodies):
+        if not bodies:
+            return
+        try:
+            self._send_with_retry(bodies)
+        except Exception:
+            log.exception("Failed to publish %d messages through %s", len(bodies), self.name)
+            if self.overflow == "spill":
+                self._spill(bodies)
+            else:
+                MESSAGES_DROPPED.add(len(bodies), {"plugin": self.name})
+
+    def _spill(self, bodies):
+        with self.spill_lock:
+            if self.spill_file is None:
+                path = os.path.join(self.spill_dir, "%s-%s.ndjson" % (self.name, uuid.uuid4().hex))
+                self.spill_file = open(path, "a+")
+                # Released when the process exits, see _adopt_spill_files()
+                fcntl.flock(self.spill_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.spill_file.writelines(body + "\n" for body in bodies)
+            self.spill_file.flush()
+            self.spilled += len(bodies)
+        MESSAGES_SPILLED.add(len(bodies), {"plugin": self.name})
+
+    def _send_spilled(self):
+        with self.spill_lock:
+            if not self.spilled:
+                return
+            self.spill_file.seek(0)
+            bodies = self.spill_file.read().splitlines()
+            self.spill_file.truncate(0)
+            self.spilled = 0
+        log.info("Publishing %d spilled messages through %s", len(bodies), self.name)
+        self._send_batch(bodies)
+
+    def _adopt_spill_files(self):
+        """Moves messages from spill files of exited processes to own spill file."""
+        own = self.spill_file.name if self.spill_file else None
+        for path in glob.glob(os.path.join(self.spill_dir, "%s-*.ndjson" % self.name)):
+            if path == own:
+                continue
+            with open(path) as spill_file:
+                try:
+                    fcntl.flock(spill_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Owned by a running process
+                    continue
+                # Skip if adopted by another process in the meantime
+                if os.fstat(spill_file.fileno()).st_nlink == 0:
+                    continue
+                bodies = spill_file.read().splitlines()
+                if bodies:
+                    self._spill(bodies)
+                os.unlink(path)
+
+    def close(self):
+        """
+        Waits up to `shutdown_timeout` seconds for the queued messages to be
+        sent, and spills or drops the rest.
+        """
+        with self.sender_lock:
+            if self.sender_pid != os.getpid():
+                return
+            sender = self.sender
+            self.sender = None
+
+        if sender is not None:
+            try:
+                self.queue.put(None, timeout=self.shutdown_timeout)
+            except queue.Full:
+                pass
+            sender.join(self.shutdown_timeout)
+
+        bodies = []
+        while True:
+            try:
+                bodies.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        bodies = [body for body in bodies if body is not None]
+        if bodies:
+            if self.overflow == "spill":
+                self._spill(bodies)
+            else:
+                log.error("Dropping %d unsent messages on exit", len(bodies))
+                MESSAGES_DROPPED.add(len(bodies), {"plugin": self.name})
+
+        with self.spill_lock:
+            if self.spill_file is not None:
+                if not self.spilled:
+                    os.unlink(self.spill_file.name)
+                self.spill_file.close()
+                self.spill_file = None
+                self.spilled = 0
+
+
+class FedmsgPlugin(QueuedMessagingPlugin):
+    """
+    A fedmsg plugin, used to publish to the fedmsg bus.
+
+    With the `async_publish` option, the messages are published from a
+    background thread, see QueuedMessagingPlugin. fedora-messaging reuses
+    its connection and waits for the broker to confirm each message.
+    Timeouts and connection errors are retried, messages rejected by the
+    broker are dropped.
+    """
+
+    name = "fedmsg"
+
+    def __init__(self, **kwargs):
+        super(FedmsgPlugin, self).__init__(**kwargs)
+        self._setup_async()
 
     def publish(self, message):
+        if self.async_publish:
+            self._enqueue(json.dumps(message))
+            return
+
         try:
             msg = Message(topic="{}.result.new".format(self.modname), body=message)
             publish(msg)
@@ -185,8 +529,42 @@ class FedmsgPlugin(MessagingPlugin):
         except ConnectionException as e:
             log.error("Error sending message {}: {}".format(msg.id, e.reason))
 
+    def publish_now(self, message):
+        self._send_with_retry([json.dumps(message)], drop_rejected=False)
+
+    @retry(
+        stop=FEDMSG_RETRY_STOP,
+        wait=FEDMSG_RETRY_WAIT,
+        retry=retry_if_exception_type((PublishTimeout, ConnectionException)),
+        reraise=True,
+    )
+    def _send_with_retry(self, bodies, drop_rejected=True):
+        while bodies:
+            msg = Message(topic="{}.result.new".format(self.modname), body=json.loads(bodies[0]))
+            try:
+                publish(msg)
+                log.debug("Message published")
+            except (PublishReturned, PublishForbidden) as e:
+                if not drop_rejected:
+                    raise
+                # Retrying would not help
+                log.error("Fedora Messaging broker rejected message {}: {}".format(msg.id, e))
+                MESSAGES_DROPPED.add(1, {"plugin": self.name})
+            del bodies[0]
+
+
+class StompPlugin(QueuedMessagingPlugin):
+    """
+    A plugin publishing the messages to a STOMP broker.
+
+    By default, publish() sends the message right away, retrying with a
+    delay if the broker is not available. With the `async_publish` option,
+    the messages are sent from a background thread over the same connection,
+    see QueuedMessagingPlugin.
+    """
+
+    name = "stomp"
 
-class StompPlugin(MessagingPlugin):
     def __init__(self, **kwargs):
         args = kwargs.copy()
         conn_args = args["connection"].copy()
@@ -224,6 +602,8 @@ class StompPlugin(MessagingPlugin):
         if self.use_ssl:
             self.conn.set_ssl(**self.ssl_args)
 
+        self._setup_async()
+
     @tracer.start_as_current_span("StompPlugin.publish")
     def publish(self, msg):
         # Add telemetry information. This includes an extra key
@@ -231,23 +611,43 @@ class StompPlugin(MessagingPlugin):
         TraceContextTextMapPropagator().inject(msg)
 
         msg = json.dumps(msg)
+        if self.async_publish:
+            self._enqueue(msg)
+            return
+
         kwargs = {"body": msg, "headers": {}, "destination": self.destination}
         self._publish_with_retry(**kwargs)
 
+    def publish_now(self, msg):
+        self._publish_with_retry(body=json.dumps(msg), headers={}, destination=self.destination)
+
+    def _connect(self):
+        if not self.conn.is_connected():
+            log.info("Connecting to message bus")
+
+            # Inactive connection is be closed/disconnected automatically
+            # after a short time.
+            with tracer.start_as_current_span("StompPlugin.publish.connect"):
+                self.conn.connect(wait=True)
+
     @retry(stop=STOMP_RETRY_STOP, wait=STOMP_RETRY_WAIT, reraise=True)
     def _publish_with_retry(self, **kwargs):
         with self.conn_lock:
-            if not self.conn.is_connected():
-                log.info("Connecting to message bus")
-
-                # Inactive connection is be closed/disconnected automatically
-                # after a short time.
-                with tracer.start_as_current_span("StompPlugin.publish.connect"):
-                    self.conn.connect(wait=True)
+            self._connect()
             with tracer.start_as_current_span("StompPlugin.publish.send"):
                 self.conn.send(**kwargs)
             log.debug("Published message through stomp: %s", kwargs["body"])
 
+    @retry(stop=STOMP_RETRY_STOP, wait=STOMP_RETRY_WAIT, reraise=True)
+    def _send_with_retry(self, bodies):
+        with self.conn_lock:
+            self._connect()
+            with tracer.start_as_current_span("StompPlugin.publish.send_batch"):
+                while bodies:
+                    self.conn.send(body=bodies[0], headers={}, destination=self.destination)
+                    log.debug("Published message through stomp: %s", bodies[0])
+                    del bodies[0]
+
 
 def load_messaging_plugin(name, plugin_args):
     """Instantiate and return the appropriate messaging plugin."""
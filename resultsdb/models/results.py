@@ -18,18 +18,46 @@
 #   Josef Skladanka <jskladan@redhat.com>
 
 import datetime
+import hashlib
+import json
 import uuid as lib_uuid
+from collections import Counter
 
 from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 
 from resultsdb.models import db
 from resultsdb.serializers import DBSerialize
 
-__all__ = ["Testcase", "Group", "Result", "ResultData", "GroupsToResults", "result_outcomes"]
+__all__ = [
+    "Testcase",
+    "Group",
+    "Result",
+    "ResultData",
+    "GroupsToResults",
+    "LatestResult",
+    "TaskotronLastOutcome",
+    "OutboxMessage",
+    "IdempotencyKey",
+    "result_outcomes",
+    "update_groups_results_count",
+    "increment_groups_results_count",
+    "delete_result_references",
+    "latest_result_data_hash",
+    "dialect_insert",
+    "update_latest_results",
+    "update_taskotron_last_outcomes",
+    "result_data_json",
+    "result_data_join_condition",
+]
 
 PRESET_OUTCOMES = ("PASSED", "INFO", "FAILED", "NEEDS_INSPECTION")
 
+# Result data keys identifying the Taskotron task, see TaskotronLastOutcome
+TASKOTRON_KEYS = ("item", "type", "arch")
+
 
 def result_outcomes():
     additional_result_outcomes = tuple(current_app.config.get("ADDITIONAL_RESULT_OUTCOMES", []))
@@ -65,6 +93,8 @@ class Group(db.Model, DBSerialize):
     uuid = db.Column(db.String(36), unique=True)
     description = db.Column(db.Text)
     ref_url = db.Column(db.Text)
+    # Maintained on result submission, see update_groups_results_count()
+    results_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     results = relationship("Result", secondary="groups_to_results", backref="groups")
 
@@ -111,6 +141,12 @@ class Result(db.Model, DBSerialize):
     note = db.Column(db.Text)
     ref_url = db.Column(db.Text)
 
+    # Copy of the result data as {key: [values]}, see result_data_json().
+    # Stored as JSONB with GIN index on PostgreSQL.
+    data_json = db.Column(
+        "data", db.JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql")
+    )
+
     testcase = relationship("Testcase", backref="results")  # , lazy = False)
     data = relationship("ResultData", backref="result")  # , lazy = False)
 
@@ -120,12 +156,21 @@ class Result(db.Model, DBSerialize):
             "testcase_name",
             postgresql_ops={"testcase_name": "text_pattern_ops"},
         ),
-        db.Index("result_submit_time", "submit_time"),
+        # Backs the keyset pagination and the submit_time filters
+        db.Index("result_idx_submit_time_id", "submit_time", "id"),
+        # Backs the testcase filters combined with submit_time filters
+        db.Index("result_idx_testcase_name_submit_time", "testcase_name", "submit_time"),
         db.Index(
             "result_idx_outcome",
             "outcome",
             postgresql_ops={"outcome": "text_pattern_ops"},
         ),
+        db.Index(
+            "result_idx_data",
+            "data",
+            postgresql_using="gin",
+            postgresql_ops={"data": "jsonb_path_ops"},
+        ).ddl_if(dialect="postgresql"),
     )
 
     def __init__(self, testcase, outcome, groups=None, ref_url=None, note=None, submit_time=None):
@@ -134,7 +179,8 @@ class Result(db.Model, DBSerialize):
         self.ref_url = ref_url
         self.note = note
         self.groups = groups
-        self.submit_time = submit_time
+        # Set now rather than on flush, the result data are partitioned by it
+        self.submit_time = submit_time or utcnow_naive()
 
 
 class ResultData(db.Model, DBSerialize):
@@ -143,6 +189,10 @@ class ResultData(db.Model, DBSerialize):
 
     key = db.Column(db.Text)
     value = db.Column(db.Text)
+    # Copy of result.submit_time, the partition key on PostgreSQL if the
+    # tables are partitioned, see resultsdb.partitions. Not set for result
+    # data stored before it was added.
+    submit_time = db.Column(db.DateTime)
 
     __table_args__ = (
         db.Index(
@@ -158,3 +208,279 @@ class ResultData(db.Model, DBSerialize):
         self.result = result
         self.key = key
         self.value = value
+        self.submit_time = result.submit_time
+
+
+class LatestResult(db.Model):
+    """
+    The latest result for each testcase and combination of values of the
+    result data keys configured in LATEST_RESULT_KEYS.
+
+    Maintained on result submission, see update_latest_results().
+    """
+
+    __tablename__ = "latest_result"
+    id = db.Column(db.Integer, primary_key=True)
+    testcase_name = db.Column(db.Text, nullable=False)
+    # SHA-1 of the canonical JSON of the configured result data, see latest_result_data_hash()
+    data_hash = db.Column(db.String(40), nullable=False)
+    result_id = db.Column(db.Integer, db.ForeignKey("result.id"), nullable=False)
+    submit_time = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("testcase_name", "data_hash", name="latest_result_uq_testcase_data"),
+        db.Index("latest_result_idx_result_id", "result_id"),
+    )
+
+
+class TaskotronLastOutcome(db.Model):
+    """
+    The outcome of the latest result for each testcase and combination of
+    values of the item, type and arch result data keys.
+
+    Used to find the previous outcome for the Taskotron compatibility
+    messages, maintained on result submission when publishing them, see
+    update_taskotron_last_outcomes().
+    """
+
+    __tablename__ = "taskotron_last_outcome"
+    id = db.Column(db.Integer, primary_key=True)
+    testcase_name = db.Column(db.Text, nullable=False)
+    # See latest_result_data_hash()
+    data_hash = db.Column(db.String(40), nullable=False)
+    result_id = db.Column(db.Integer, db.ForeignKey("result.id"), nullable=False)
+    submit_time = db.Column(db.DateTime, nullable=False)
+    outcome = db.Column(db.String(32), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint(
+            "testcase_name", "data_hash", name="taskotron_last_outcome_uq_testcase_data"
+        ),
+        db.Index("taskotron_last_outcome_idx_result_id", "result_id"),
+    )
+
+
+class OutboxMessage(db.Model):
+    """
+    Message waiting to be published by "resultsdb dispatch".
+
+    Stored in the same transaction as the result when MESSAGE_BUS_OUTBOX is
+    enabled, so the message is not lost if publishing fails.
+    """
+
+    __tablename__ = "outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow_naive)
+    message = db.Column(db.JSON, nullable=False)
+
+
+class IdempotencyKey(db.Model):
+    """
+    Response to a result submission with the Idempotency-Key header.
+
+    Retried submissions with the same key get the stored response instead of
+    creating the result again, until the key expires after
+    IDEMPOTENCY_KEY_TTL seconds.
+    """
+
+    __tablename__ = "idempotency_key"
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), nullable=False)
+    # SHA-1 of the request body, to reject reusing the key for another result
+    request_hash = db.Column(db.String(40), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow_naive)
+    response = db.Column(db.JSON, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("key", name="idempotency_key_uq_key"),
+        db.Index("idempotency_key_idx_created_at", "created_at"),
+    )
+
+
+def result_data_json(result):
+    """Returns the result data as dict mapping keys to lists of values."""
+    data = {}
+    for rd in result.data:
+        data.setdefault(rd.key, []).append(rd.value)
+    return data
+
+
+def result_data_join_condition(result_data, since_start=None, since_end=None):
+    """
+    Returns the condition joining the `result_data` (an alias of ResultData
+    or its columns) to Result.
+
+    Besides the result id, it matches the submit_time copied from the result
+    and the time constraints of the query, so only the partitions which can
+    contain the result data are scanned (see resultsdb.partitions). Result
+    data stored before the column was added do not have it.
+    """
+    conditions = [
+        result_data.result_id == Result.id,
+        db.or_(result_data.submit_time == Result.submit_time, result_data.submit_time.is_(None)),
+    ]
+    if since_start:
+        conditions.append(
+            db.or_(result_data.submit_time >= since_start, result_data.submit_time.is_(None))
+        )
+    if since_end:
+        conditions.append(
+            db.or_(result_data.submit_time <= since_end, result_data.submit_time.is_(None))
+        )
+    return db.and_(*conditions)
+
+
+def update_groups_results_count(results):
+    """
+    Increments the stored results count of all groups the given results are
+    linked to. The results and groups need to be flushed to the database
+    already, so the counts are updated in the same transaction.
+    """
+    increment_groups_results_count(
+        Counter(group.uuid for result in results for group in result.groups)
+    )
+
+
+def increment_groups_results_count(counts):
+    """Increments the stored results count of the groups by the given counts."""
+    if not counts:
+        return
+
+    table = Group.__table__
+    db.session.execute(
+        db.update(table)
+        .where(table.c.uuid == db.bindparam("group_uuid"))
+        .values(results_count=table.c.results_count + db.bindparam("increment")),
+        # Updated in the same order by all transactions to avoid deadlocks
+        [{"group_uuid": uuid, "increment": count} for uuid, count in sorted(counts.items())],
+    )
+
+
+def delete_result_references(result_ids):
+    """
+    Deletes the group memberships, latest results and Taskotron last
+    outcomes of the results, and decrements the results count of the groups.
+
+    The `result_ids` are a list or a select of the ids.
+    """
+    table = GroupsToResults.__table__
+    counts = db.session.execute(
+        db.select(table.c.group_uuid, db.func.count())
+        .where(table.c.result_id.in_(result_ids))
+        .group_by(table.c.group_uuid)
+    ).all()
+    increment_groups_results_count({uuid: -count for uuid, count in counts})
+
+    for model in (GroupsToResults, LatestResult, TaskotronLastOutcome):
+        table = model.__table__
+        db.session.execute(db.delete(table).where(table.c.result_id.in_(result_ids)))
+
+
+def latest_result_data_hash(result, keys):
+    """
+    Returns hash identifying the values of the given result data keys.
+
+    Results with the same values (in any order) of all the keys get the same
+    hash, missing keys are treated as keys without values.
+    """
+    values = {key: [] for key in keys}
+    for rd in result.data:
+        if rd.key in values:
+            values[rd.key].append(rd.value)
+    for key_values in values.values():
+        key_values.sort()
+    canonical = json.dumps(values, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def dialect_insert(table):
+    """Returns INSERT statement supporting ON CONFLICT for the current database."""
+    dialect = postgresql if db.session.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+
+def update_latest_results(results, keys):
+    """
+    Stores the results as the latest ones for their testcase and values of
+    the result data keys, unless a result submitted later is already stored.
+    The results need to be flushed to the database already.
+    """
+    rows = {}
+    for result in results:
+        row = dict(
+            testcase_name=result.testcase_name,
+            data_hash=latest_result_data_hash(result, keys),
+            result_id=result.id,
+            submit_time=result.submit_time,
+        )
+        # A single statement must not update the same row twice
+        key = (row["testcase_name"], row["data_hash"])
+        if key not in rows or rows[key]["submit_time"] <= row["submit_time"]:
+            rows[key] = row
+
+    if not rows:
+        return
+
+    table = LatestResult.__table__
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.testcase_name, table.c.data_hash],
+        set_=dict(result_id=stmt.excluded.result_id, submit_time=stmt.excluded.submit_time),
+        where=stmt.excluded.submit_time >= table.c.submit_time,
+    )
+    # Locked in the same order by all transactions to avoid deadlocks
+    db.session.execute(stmt, [rows[key] for key in sorted(rows)])
+
+
+def update_taskotron_last_outcomes(results):
+    """
+    Stores the outcomes of the results as the last ones for their testcase
+    and Taskotron task, unless a result submitted later is already stored.
+    The results need to be flushed to the database already.
+
+    Returns dict mapping ids of the results to the outcome of the latest
+    other result for the same testcase and task stored before (or None).
+    """
+    table = TaskotronLastOutcome.__table__
+    keys = {
+        result.id: (result.testcase_name, latest_result_data_hash(result, TASKOTRON_KEYS))
+        for result in results
+    }
+    if not keys:
+        return {}
+
+    stored = db.session.execute(
+        db.select(
+            table.c.testcase_name, table.c.data_hash, table.c.submit_time, table.c.outcome
+        ).where(db.tuple_(table.c.testcase_name, table.c.data_hash).in_(set(keys.values())))
+    )
+    rows = {(row.testcase_name, row.data_hash): row._asdict() for row in stored}
+    changed = {}
+    prev_outcomes = {}
+    for result in results:
+        key = keys[result.id]
+        row = rows.get(key)
+        prev_outcomes[result.id] = row["outcome"] if row else None
+        if row is None or row["submit_time"] <= result.submit_time:
+            rows[key] = changed[key] = dict(
+                testcase_name=result.testcase_name,
+                data_hash=key[1],
+                result_id=result.id,
+                submit_time=result.submit_time,
+                outcome=result.outcome,
+            )
+
+    if changed:
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.testcase_name, table.c.data_hash],
+            set_=dict(
+                result_id=stmt.excluded.result_id,
+                submit_time=stmt.excluded.submit_time,
+                outcome=stmt.excluded.outcome,
+            ),
+            where=stmt.excluded.submit_time >= table.c.submit_time,
+        )
+        # Locked in the same order by all transactions to avoid deadlocks
+        db.session.execute(stmt, [changed[key] for key in sorted(changed)])
+    return prev_outcomes
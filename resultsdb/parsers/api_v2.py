@@ -1,7 +1,10 @@
 # SPDX-License-Identifier: LGPL-2.0-or-later
+import base64
+import binascii
+import json
 from datetime import datetime, timezone
 from numbers import Number
-from typing import Any, List, Optional, Union
+from typing import Any, List, Literal, Optional, Union
 from typing_extensions import Annotated
 
 import iso8601
@@ -37,6 +40,36 @@ def parse_since(since):
     return since_start, since_end
 
 
+def encode_cursor(direction, values):
+    """
+    Returns opaque cursor pointing before ("prev" direction) or after ("next"
+    direction) the row with the given sort key values.
+    """
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps([direction, values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def parse_cursor(cursor):
+    """
+    Returns dict with "direction" and "values" decoded from the cursor string
+    created by encode_cursor(). Empty cursor requests the first page.
+    """
+    if not cursor:
+        return {}
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        direction, values = json.loads(raw)
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError("invalid cursor")
+
+    if direction not in ("next", "prev") or not isinstance(values, list):
+        raise ValueError("invalid cursor")
+
+    return {"direction": direction, "values": values}
+
+
 def time_from_milliseconds(value):
     seconds, milliseconds = divmod(value, 1000)
     time = datetime.fromtimestamp(seconds, tz=timezone.utc)
@@ -46,6 +79,14 @@ def time_from_milliseconds(value):
 class BaseListParams(BaseModel):
     page: int = 0
     limit: int = QUERY_LIMIT
+    cursor: Optional[dict] = None
+
+    @field_validator("cursor", mode="before")
+    @classmethod
+    def parse_cursor(cls, v):
+        if isinstance(v, dict):
+            return v
+        return parse_cursor(v)
 
 
 class GroupsParams(BaseListParams):
@@ -98,6 +139,36 @@ class ResultsParams(BaseListParams):
         return outcomes
 
 
+class ResultsExportParams(ResultsParams):
+    format_: Literal["ndjson", "csv"] = Field(alias="_format", default="ndjson")
+
+
+class ResultsCountParams(ResultsParams):
+    mode_: Literal["auto", "exact", "estimate"] = Field(alias="_mode", default="auto")
+
+
+# Fields of /results/stats, besides "data.<key>" for result data keys
+STATS_GROUP_BY = ("testcase", "outcome", "hour", "day")
+
+
+class ResultsStatsParams(ResultsParams):
+    group_by_: QueryList = Field(alias="_group_by")
+
+    @field_validator("group_by_", mode="after")
+    @classmethod
+    def group_by_must_be_valid(cls, v):
+        if not v:
+            raise ValueError("must not be empty")
+        for field in v:
+            if field not in STATS_GROUP_BY and not (
+                field.startswith("data.") and len(field) > len("data.")
+            ):
+                raise ValueError(f'must be one of: {", ".join(STATS_GROUP_BY)}, data.<key>')
+        if len(set(v)) != len(v):
+            raise ValueError("must not contain duplicates")
+        return v
+
+
 class CreateResultParams(BaseModel):
     outcome: Annotated[str, StringConstraints(min_length=1, strip_whitespace=True, to_upper=True)]
     testcase: dict
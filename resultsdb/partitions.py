@@ -0,0 +1,362 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Monthly range partitioning of the result and result_data tables by
+submit_time on PostgreSQL, see "resultsdb partitions".
+
+convert_tables() turns the existing tables into partitioned tables. Their
+rows are kept in place as the result_legacy and result_data_legacy
+partitions, so nothing is copied. The result_data rows are co-partitioned
+with their results through the submit_time copied from the result. The
+result data stored before the column was added do not have it and stay in
+result_data_legacy.
+
+New results are stored in the partition for their month, so
+create_partitions() must be run regularly (e.g. daily from cron) to create
+the partitions for the coming months. Results submitted for months without
+a partition are stored in the result_overflow and result_data_overflow
+default partitions, and are moved to the monthly partitions when these are
+created. drop_partitions() drops the partitions of old months at once
+instead of deleting the results row by row.
+
+PostgreSQL cannot enforce foreign keys referencing the id of a partitioned
+table, so the foreign keys to result.id are dropped by the conversion.
+
+The conversion avoids scanning the tables while they are locked: check
+constraints proving that the legacy rows fit in their partitions, and the
+index of the new primary key of result, are added before without blocking
+the writes.
+"""
+
+import datetime
+import re
+
+from resultsdb.models import db
+from resultsdb.models.results import Result, ResultData, delete_result_references, utcnow_naive
+
+PARTITIONED_TABLES = (Result.__table__, ResultData.__table__)
+
+LEGACY_SUFFIX = "_legacy"
+OVERFLOW_SUFFIX = "_overflow"
+
+# Index of the (id, submit_time) primary key of result_legacy, built before
+# the conversion
+LEGACY_PRIMARY_KEY_INDEX = "result_legacy_id_submit_time"
+
+# Names of the partitions, e.g. result_y2026m10 or result_data_legacy
+PARTITION_NAME_RE = re.compile(
+    r"^(result|result_data)_(legacy|overflow|default|y(\d{4})m(\d{2}))$"
+)
+
+
+def month_start(value):
+    return datetime.datetime(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return "%s_y%04dm%02d" % (table.name, month.year, month.month)
+
+
+def is_partition_name(name):
+    return PARTITION_NAME_RE.match(name) is not None
+
+
+def execute(sql, params=None):
+    return db.session.execute(db.text(sql), params or {})
+
+
+def check_postgresql():
+    if db.session.get_bind().dialect.name != "postgresql":
+        raise RuntimeError("Partitioning is supported only on PostgreSQL")
+
+
+def is_partitioned():
+    check_postgresql()
+    return execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table"
+        " WHERE partrelid = to_regclass('result'))"
+    ).scalar()
+
+
+def check_partitioned():
+    if not is_partitioned():
+        raise RuntimeError(
+            "The result tables are not partitioned, run 'resultsdb partitions convert' first"
+        )
+
+
+def monthly_partitions(table):
+    """Returns dict mapping months to the names of the monthly partitions."""
+    names = execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+        " WHERE i.inhparent = to_regclass(:table)",
+        {"table": table.name},
+    ).scalars()
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME_RE.match(name)
+        if match and match.group(1) == table.name and match.group(3):
+            partitions[datetime.datetime(int(match.group(3)), int(match.group(4)), 1)] = name
+    return partitions
+
+
+def legacy_boundary():
+    """Returns the upper bound of the result_legacy partition, or None."""
+    bound = execute(
+        "SELECT pg_get_expr(c.relpartbound, c.oid) FROM pg_class c"
+        " WHERE c.oid = to_regclass('result_legacy') AND c.relispartition"
+    ).scalar()
+    if not bound:
+        return None
+    match = re.search(r"TO \('([^']+)'\)", bound)
+    return datetime.datetime.fromisoformat(match.group(1))
+
+
+def legacy_check_name(table):
+    return "%s%s_submit_time_check" % (table.name, LEGACY_SUFFIX)
+
+
+def prepare_legacy_tables(boundary):
+    """
+    Adds the check constraints implying the partition constraints of the
+    legacy partitions, and builds the index of the new primary key of
+    result. Each step is committed, and none of them blocks the writes for
+    longer than adding a constraint without validating it.
+    """
+    result, result_data = PARTITIONED_TABLES
+    checks = (
+        (result, "submit_time IS NOT NULL AND submit_time < '%s'"),
+        (result_data, "submit_time IS NULL OR submit_time < '%s'"),
+    )
+    for table, check in checks:
+        name = legacy_check_name(table)
+        execute("ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s" % (table.name, name))
+        execute(
+            "ALTER TABLE %s ADD CONSTRAINT %s CHECK (%s) NOT VALID"
+            % (table.name, name, check % boundary.isoformat())
+        )
+        db.session.commit()
+        # Scans the table without blocking reads and writes
+        execute("ALTER TABLE %s VALIDATE CONSTRAINT %s" % (table.name, name))
+        db.session.commit()
+
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql(
+            "DROP INDEX CONCURRENTLY IF EXISTS %s" % LEGACY_PRIMARY_KEY_INDEX
+        )
+        connection.exec_driver_sql(
+            "CREATE UNIQUE INDEX CONCURRENTLY %s ON %s (id, submit_time)"
+            % (LEGACY_PRIMARY_KEY_INDEX, result.name)
+        )
+
+
+def drop_prepared_legacy_tables():
+    """Drops what prepare_legacy_tables() added to the unpartitioned tables."""
+    for table in PARTITIONED_TABLES:
+        execute(
+            "ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s" % (table.name, legacy_check_name(table))
+        )
+    execute("DROP INDEX IF EXISTS %s" % LEGACY_PRIMARY_KEY_INDEX)
+    db.session.commit()
+
+
+def rename_legacy_table(table):
+    """Renames the table with its primary key and indexes to *_legacy."""
+    legacy = table.name + LEGACY_SUFFIX
+    execute("ALTER TABLE %s RENAME TO %s" % (table.name, legacy))
+    execute("ALTER TABLE %s RENAME CONSTRAINT %s_pkey TO %s_pkey" % (legacy, table.name, legacy))
+    for index in table.indexes:
+        new_name = index.name.replace(table.name, legacy, 1)
+        execute("ALTER INDEX IF EXISTS %s RENAME TO %s" % (index.name, new_name))
+    return legacy
+
+
+def create_parent_table(table, legacy, primary_key):
+    """Creates the partitioned table with the columns, indexes and id sequence of the legacy."""
+    execute(
+        "CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) PARTITION BY RANGE (submit_time)"
+        % (table.name, legacy)
+    )
+    sequence = execute("SELECT pg_get_serial_sequence(:table, 'id')", {"table": legacy}).scalar()
+    execute("ALTER SEQUENCE %s OWNED BY %s.id" % (sequence, table.name))
+    if primary_key:
+        execute("ALTER TABLE %s ALTER COLUMN submit_time SET NOT NULL" % table.name)
+        execute("ALTER TABLE %s ADD PRIMARY KEY (id, submit_time)" % table.name)
+
+    connection = db.session.connection()
+    for index in table.indexes:
+        index.create(connection)
+
+
+def convert_tables(months=3):
+    """
+    Converts result and result_data to partitioned tables, and creates
+    the monthly partitions for `months` months after the current one.
+
+    The existing results become the result_legacy partition for the times
+    up to the first monthly partition. The check constraints and the index
+    added by prepare_legacy_tables() let PostgreSQL attach it without
+    scanning it, so the tables are locked only briefly. Results submitted
+    for times after the boundary fail the check constraints until the
+    conversion is finished.
+
+    Returns the start of the first monthly partition, and the names of the
+    dropped foreign keys as "table.constraint".
+    """
+    if is_partitioned():
+        raise RuntimeError("The result tables are already partitioned")
+
+    now = utcnow_naive()
+    last = db.session.query(db.func.max(Result.submit_time)).scalar() or now
+    boundary = add_months(month_start(max(last, now)), 1)
+
+    prepare_legacy_tables(boundary)
+    try:
+        foreign_keys = attach_legacy_tables(boundary)
+        create_partitions(boundary, months)
+    except Exception:
+        db.session.rollback()
+        # Results for times after the boundary would fail the check constraints
+        drop_prepared_legacy_tables()
+        raise
+
+    return boundary, foreign_keys
+
+
+def attach_legacy_tables(boundary):
+    # The foreign keys from result_data, groups_to_results, latest_result
+    # and taskotron_last_outcome cannot reference the partitioned table
+    foreign_keys = execute(
+        "SELECT conrelid::regclass::text, conname FROM pg_constraint"
+        " WHERE contype = 'f' AND confrelid = 'result'::regclass"
+        " ORDER BY 1, 2"
+    ).all()
+    for table_name, constraint in foreign_keys:
+        execute('ALTER TABLE %s DROP CONSTRAINT "%s"' % (table_name, constraint))
+
+    result, result_data = PARTITIONED_TABLES
+
+    legacy = rename_legacy_table(result)
+    # Neither this nor attaching the partition scans the table, as both are
+    # implied by the check constraint
+    execute("ALTER TABLE %s ALTER COLUMN submit_time SET NOT NULL" % legacy)
+    execute("ALTER TABLE %s DROP CONSTRAINT %s_pkey" % (legacy, legacy))
+    execute(
+        "ALTER TABLE %s ADD CONSTRAINT %s_pkey PRIMARY KEY USING INDEX %s"
+        % (legacy, legacy, LEGACY_PRIMARY_KEY_INDEX)
+    )
+    create_parent_table(result, legacy, primary_key=True)
+    execute("ALTER TABLE result ADD FOREIGN KEY (testcase_name) REFERENCES testcase (name)")
+    execute(
+        "ALTER TABLE result ATTACH PARTITION %s FOR VALUES FROM (MINVALUE) TO ('%s')"
+        % (legacy, boundary.isoformat())
+    )
+    execute("CREATE TABLE result%s PARTITION OF result DEFAULT" % OVERFLOW_SUFFIX)
+
+    # Rows without submit_time cannot be in a range partition, so the legacy
+    # result data are the default partition of result_data_default, which
+    # is itself the default partition of result_data. Its check constraint
+    # lets PostgreSQL skip scanning it when creating the monthly partitions.
+    legacy = rename_legacy_table(result_data)
+    create_parent_table(result_data, legacy, primary_key=False)
+    execute(
+        "CREATE TABLE result_data_default PARTITION OF result_data DEFAULT"
+        " PARTITION BY RANGE (submit_time)"
+    )
+    execute("ALTER TABLE result_data_default ATTACH PARTITION %s DEFAULT" % legacy)
+    execute(
+        "CREATE TABLE result_data%s PARTITION OF result_data_default"
+        " FOR VALUES FROM ('%s') TO (MAXVALUE)" % (OVERFLOW_SUFFIX, boundary.isoformat())
+    )
+
+    return ["%s.%s" % tuple(row) for row in foreign_keys]
+
+
+def create_partitions(start, months):
+    """
+    Creates the missing partitions of both tables for `months` months from
+    the month of `start`, and returns their names.
+
+    PostgreSQL refuses to create a partition for rows which are in the
+    default partition, so the results submitted for the new months are
+    moved out of the overflow partitions, and back in through the parent
+    tables once the partitions are created.
+    """
+    check_partitioned()
+    start = month_start(start)
+    boundary = legacy_boundary()
+    if boundary and start < boundary:
+        months -= (boundary.year - start.year) * 12 + boundary.month - start.month
+        start = boundary
+
+    missing = []
+    for table in PARTITIONED_TABLES:
+        existing = monthly_partitions(table)
+        for i in range(months):
+            month = add_months(start, i)
+            if month not in existing:
+                missing.append((table, month))
+    if not missing:
+        db.session.commit()
+        return []
+
+    new_months = sorted(month for _, month in missing)
+    params = {"start": new_months[0], "end": add_months(new_months[-1], 1)}
+    for table in PARTITIONED_TABLES:
+        execute(
+            "CREATE TEMPORARY TABLE moved_%s (LIKE %s) ON COMMIT DROP" % (table.name, table.name)
+        )
+        execute(
+            "WITH moved AS (DELETE FROM %s%s WHERE submit_time >= :start AND submit_time < :end"
+            " RETURNING *) INSERT INTO moved_%s SELECT * FROM moved"
+            % (table.name, OVERFLOW_SUFFIX, table.name),
+            params,
+        )
+
+    created = []
+    for table, month in missing:
+        name = partition_name(table, month)
+        execute(
+            "CREATE TABLE %s PARTITION OF %s FOR VALUES FROM ('%s') TO ('%s')"
+            % (name, table.name, month.isoformat(), add_months(month, 1).isoformat())
+        )
+        created.append(name)
+
+    for table in PARTITIONED_TABLES:
+        execute("INSERT INTO %s SELECT * FROM moved_%s" % (table.name, table.name))
+
+    db.session.commit()
+    return created
+
+
+def drop_partitions(before):
+    """
+    Drops the monthly partitions with results submitted before the month of
+    `before`, with the rows referencing the results, and returns their names.
+
+    The legacy and overflow partitions are never dropped.
+    """
+    check_partitioned()
+    before = month_start(before)
+    result, result_data = PARTITIONED_TABLES
+    data_partitions = monthly_partitions(result_data)
+
+    dropped = []
+    for month, name in sorted(monthly_partitions(result).items()):
+        if month >= before:
+            break
+
+        delete_result_references(db.select(db.column("id")).select_from(db.table(name)))
+        if month in data_partitions:
+            execute("DROP TABLE %s" % data_partitions[month])
+            dropped.append(data_partitions[month])
+        execute("DROP TABLE %s" % name)
+        dropped.append(name)
+        db.session.commit()
+
+    return dropped
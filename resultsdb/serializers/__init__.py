@@ -25,19 +25,41 @@ except NameError:
     basestring = (str, bytes)
 
 
+# values of these types are returned unchanged by the serializers
+PLAIN_TYPES = frozenset((str, int, float, bool, type(None)))
+
+
 class DBSerialize(object):
     pass
 
 
 class BaseSerializer(object):
+    def __init__(self):
+        # maps classes of the serialized values to their _serialize_CLASSNAME methods
+        #   (or None for classes serialized generically)
+        self._serializers = {}
+
+    def _find_serializer(self, cls):
+        if DBSerialize in cls.__bases__:
+            return getattr(self, "_serialize_%s" % cls.__name__)
+        return None
+
     def serialize(self, value, **kwargs):
+        cls = value.__class__
+        if cls in PLAIN_TYPES:
+            return value
+
         # serialize the database objects
         #   the specific serializer needs to implement serialize_CLASSNAME methods
-        if DBSerialize in value.__class__.__bases__:
-            return getattr(self, "_serialize_%s" % value.__class__.__name__)(value, **kwargs)
+        try:
+            serializer = self._serializers[cls]
+        except KeyError:
+            serializer = self._serializers[cls] = self._find_serializer(cls)
+        if serializer is not None:
+            return serializer(value, **kwargs)
 
         # convert datetimes to the right format
-        if type(value) in (datetime, date):
+        if cls in (datetime, date):
             return value.isoformat()
 
         if isinstance(value, dict):
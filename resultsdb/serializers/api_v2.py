@@ -17,59 +17,108 @@
 # Authors:
 #   Josef Skladanka <jskladan@redhat.com>
 
-from flask import url_for
+from urllib.parse import quote, urlencode
+
+from flask import has_request_context, request, url_for
 from resultsdb.serializers import BaseSerializer
-from resultsdb.models.results import GroupsToResults
+
+HREF_PLACEHOLDER = "__HREF_PLACEHOLDER__"
+
+
+def quote_path(value):
+    """Quotes URL path argument the same way as werkzeug's default converters."""
+    return quote(str(value), safe="!$&'()*+,/:;=@")
+
+
+def quote_query(query):
+    """Encodes URL query arguments the same way as werkzeug's URL building."""
+    return urlencode(query, safe="!$'()*,/:;?@")
 
 
 class Serializer(BaseSerializer):
+    # The _serialize_CLASSNAME methods build the final JSON-ready dicts
+    # directly, all the values are either plain types or already serialized.
+
+    def __init__(self):
+        super().__init__()
+        # (url_root, href templates) for the last seen application root URL
+        self._href_templates = (None, None)
+
+    def _hrefs(self):
+        """
+        Returns (prefix, suffix) pairs of the external URLs for single
+        objects, and the external URL of the results collection.
+
+        These are built by url_for() only when the application root URL
+        (scheme, host and script name, see ReverseProxied) changes, the
+        hrefs are then created by concatenating the quoted identifiers.
+        """
+        url_root = request.url_root if has_request_context() else None
+        cached_url_root, templates = self._href_templates
+        if templates is not None and url_root is not None and url_root == cached_url_root:
+            return templates
+
+        def template(endpoint, arg):
+            url = url_for(endpoint, **{arg: HREF_PLACEHOLDER}, _external=True)
+            return tuple(url.split(HREF_PLACEHOLDER))
+
+        templates = dict(
+            result=template("api_v2.get_result", "result_id"),
+            group=template("api_v2.get_group", "group_id"),
+            testcase=template("api_v2.get_testcase", "testcase_name"),
+            results=url_for("api_v2.get_results", _external=True),
+        )
+        self._href_templates = (url_root, templates)
+        return templates
+
     def _serialize_Group(self, o, **kwargs):
-        rv = dict(
+        hrefs = self._hrefs()
+        prefix, suffix = hrefs["group"]
+        return dict(
             uuid=o.uuid,
             description=o.description,
             ref_url=o.ref_url,
-            results=url_for("api_v2.get_results", groups=[o.uuid], _external=True),
-            results_count=GroupsToResults.query.filter_by(group_uuid=o.uuid).count(),
-            href=url_for("api_v2.get_group", group_id=o.uuid, _external=True),
+            results="%s?%s" % (hrefs["results"], quote_query([("groups", o.uuid)])),
+            results_count=o.results_count,
+            href=prefix + quote_path(o.uuid) + suffix,
         )
 
-        return {key: self.serialize(value) for key, value in rv.items()}
-
     def _serialize_Testcase(self, o, **kwargs):
-        rv = dict(
+        prefix, suffix = self._hrefs()["testcase"]
+        return dict(
             name=o.name,
             ref_url=o.ref_url,
-            href=url_for("api_v2.get_testcase", testcase_name=o.name, _external=True),
+            href=prefix + quote_path(o.name) + suffix,
         )
 
-        return {key: self.serialize(value) for key, value in rv.items()}
-
     def _serialize_Result(self, o, **kwargs):
-        result_data = {}
-        for rd in o.data:
-            try:
-                result_data[rd.key].append(rd.value)
-            except KeyError:
-                result_data[rd.key] = [rd.value]
-
-        rv = dict(
+        if o.data_json is not None:
+            result_data = dict(o.data_json)
+        else:
+            # results stored before the data column was backfilled
+            result_data = {}
+            for rd in o.data:
+                try:
+                    result_data[rd.key].append(rd.value)
+                except KeyError:
+                    result_data[rd.key] = [rd.value]
+
+        testcase = o.testcase
+        prefix, suffix = self._hrefs()["result"]
+        return dict(
             id=o.id,
             groups=[group.uuid for group in o.groups],
-            testcase=o.testcase,
+            testcase=self._serialize_Testcase(testcase) if testcase is not None else None,
             submit_time=o.submit_time.isoformat(),
             outcome=o.outcome,
             note=o.note,
             ref_url=o.ref_url,
             data=result_data,
-            href=url_for("api_v2.get_result", result_id=o.id, _external=True),
+            href=prefix + quote_path(o.id) + suffix,
         )
 
-        return {key: self.serialize(value) for key, value in rv.items()}
-
     def _serialize_ResultData(self, o, **kwargs):
-        rv = dict(
+        return dict(
             key=o.key,
             value=o.value,
         )
-
-        return {key: self.serialize(value) for key, value in rv.items()}
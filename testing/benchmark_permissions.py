@@ -0,0 +1,89 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Microbenchmark of the PERMISSIONS lookups for API v3 submissions.
+
+Compares the linear fnmatch() scan of all the permission patterns with the
+compiled PermissionMatcher, with and without the memoized results, and
+checks that both return the same permissions.
+
+Run with:
+
+    python testing/benchmark_permissions.py [--permissions 500] [--repeat 5]
+"""
+
+import argparse
+import timeit
+
+from resultsdb.authorization import PermissionMatcher, match_testcase_permissions
+
+
+def create_permissions(count):
+    permissions = []
+    for i in range(count):
+        if i % 3 == 0:
+            testcases = ["fedora-ci.koji-build.%d.functional" % i]
+        elif i % 3 == 1:
+            testcases = ["fedora-ci.koji-build.%d.*" % i, "rhel-ci.%d.*" % i]
+        else:
+            testcases = ["*.%d.tier[0-2]" % i, "osci.*.%d.?" % i]
+        permissions.append({"groups": ["group%d" % i], "testcases": testcases})
+    return permissions
+
+
+def create_testcases(count):
+    testcases = []
+    for i in range(count):
+        testcases.extend(
+            [
+                "fedora-ci.koji-build.%d.functional" % i,
+                "rhel-ci.%d.gating" % i,
+                "baseos-ci.%d.tier1" % i,
+                "osci.brew-build.%d.x" % i,
+                "unknown.%d" % i,
+            ]
+        )
+    return testcases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--permissions", type=int, default=500, help="PERMISSIONS entries")
+    parser.add_argument("--repeat", type=int, default=5, help="number of measurements")
+    args = parser.parse_args()
+
+    permissions = create_permissions(args.permissions)
+    testcases = create_testcases(args.permissions)
+    compiled = PermissionMatcher(permissions, cache_size=0)
+    memoized = PermissionMatcher(permissions)
+
+    matchers = {
+        "linear": lambda testcase: list(match_testcase_permissions(testcase, permissions)),
+        "compiled": lambda testcase: list(compiled.match(testcase)),
+        "memoized": lambda testcase: list(memoized.match(testcase)),
+    }
+
+    for testcase in testcases:
+        expected = matchers["linear"](testcase)
+        assert matchers["compiled"](testcase) == expected, testcase
+        assert matchers["memoized"](testcase) == expected, testcase
+
+    timings = {}
+    for name, match in matchers.items():
+        timings[name] = min(
+            timeit.repeat(
+                lambda: [match(testcase) for testcase in testcases],
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        print(
+            "%-8s %8.2f us per lookup in %d permissions"
+            % (name, timings[name] * 1e6 / len(testcases), len(permissions))
+        )
+
+    for name in ("compiled", "memoized"):
+        print("speedup  %8.2fx %s" % (timings["linear"] / timings[name], name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Microbenchmark of the v2 API serializer on a page of results.
+
+Compares the current serializer with the previous generic implementation
+which re-serialized every value recursively, and checks that both produce
+the same output.
+
+Run with:
+
+    python testing/benchmark_serializer.py [--results 1000] [--repeat 5]
+"""
+
+import argparse
+import datetime
+import json
+import timeit
+
+from flask import url_for
+
+from resultsdb import create_app
+from resultsdb.config import Config
+from resultsdb.models.results import Group, Result, ResultData, Testcase
+from resultsdb.serializers import BaseSerializer, DBSerialize, basestring
+from resultsdb.serializers.api_v2 import Serializer
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    MESSAGE_BUS_PUBLISH = False
+
+
+class LegacySerializer(BaseSerializer):
+    """The serializer as it was before the per-type fast path."""
+
+    def serialize(self, value, **kwargs):
+        if DBSerialize in value.__class__.__bases__:
+            return getattr(self, "_serialize_%s" % value.__class__.__name__)(value, **kwargs)
+
+        if type(value) in (datetime.datetime, datetime.date):
+            return value.isoformat()
+
+        if isinstance(value, dict):
+            ret = {}
+            for k, v in value.items():
+                ret[k] = self.serialize(v, **kwargs)
+            return ret
+
+        if isinstance(value, basestring):
+            return value
+
+        if hasattr(value, "__iter__"):
+            ret = []
+            for v in value:
+                ret.append(self.serialize(v, **kwargs))
+            return ret
+
+        return value
+
+    def _serialize_Group(self, o, **kwargs):
+        rv = dict(
+            uuid=o.uuid,
+            description=o.description,
+            ref_url=o.ref_url,
+            results=url_for("api_v2.get_results", groups=[o.uuid], _external=True),
+            results_count=o.results_count,
+            href=url_for("api_v2.get_group", group_id=o.uuid, _external=True),
+        )
+
+        return {key: self.serialize(value) for key, value in rv.items()}
+
+    def _serialize_Testcase(self, o, **kwargs):
+        rv = dict(
+            name=o.name,
+            ref_url=o.ref_url,
+            href=url_for("api_v2.get_testcase", testcase_name=o.name, _external=True),
+        )
+
+        return {key: self.serialize(value) for key, value in rv.items()}
+
+    def _serialize_Result(self, o, **kwargs):
+        result_data = {}
+        for rd in o.data:
+            try:
+                result_data[rd.key].append(rd.value)
+            except KeyError:
+                result_data[rd.key] = [rd.value]
+
+        rv = dict(
+            id=o.id,
+            groups=[group.uuid for group in o.groups],
+            testcase=o.testcase,
+            submit_time=o.submit_time.isoformat(),
+            outcome=o.outcome,
+            note=o.note,
+            ref_url=o.ref_url,
+            data=result_data,
+            href=url_for("api_v2.get_result", result_id=o.id, _external=True),
+        )
+
+        return {key: self.serialize(value) for key, value in rv.items()}
+
+
+def create_results(count):
+    testcase = Testcase(name="fedora-ci.koji-build.tier0.functional", ref_url="http://example.com")
+    groups = [Group(uuid="group-%d" % i, ref_url="http://example.com") for i in range(2)]
+    results = []
+    for i in range(count):
+        result = Result(
+            testcase,
+            "PASSED",
+            groups=groups,
+            ref_url="http://example.com/result/%d" % i,
+            note="note",
+            submit_time=datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=i),
+        )
+        result.id = i + 1
+        ResultData(result, "item", "package-%d-1.fc40" % i)
+        ResultData(result, "type", "koji_build")
+        ResultData(result, "arch", "x86_64")
+        ResultData(result, "arch", "noarch")
+        ResultData(result, "scenario", "fedora.updates-everything-boot-iso.x86_64.64bit")
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--results", type=int, default=1000, help="results per page")
+    parser.add_argument("--repeat", type=int, default=5, help="number of measurements")
+    args = parser.parse_args()
+
+    app = create_app(BenchmarkConfig)
+
+    with app.test_request_context():
+        results = create_results(args.results)
+        serializers = {
+            "legacy": LegacySerializer().serialize,
+            "current": Serializer().serialize,
+        }
+
+        outputs = {
+            name: json.dumps([serialize(o) for o in results], sort_keys=True)
+            for name, serialize in serializers.items()
+        }
+        assert outputs["legacy"] == outputs["current"], "serializer output differs"
+
+        timings = {}
+        for name, serialize in serializers.items():
+            timings[name] = min(
+                timeit.repeat(
+                    lambda: [serialize(o) for o in results], number=1, repeat=args.repeat
+                )
+            )
+            print(
+                "%-8s %8.2f ms per page of %d results" % (name, timings[name] * 1000, len(results))
+            )
+
+    print("speedup  %8.2fx" % (timings["legacy"] / timings["current"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -17,18 +17,44 @@
 # Authors:
 #   Josef Skladanka <jskladan@redhat.com>
 
+import csv
+import gzip
+import io
 import json
 import datetime
 import os
+import tempfile
+import time
 import copy
 from unittest import TestCase
 from unittest.mock import ANY, patch
 
+from fedora_messaging.exceptions import PublishReturned, PublishTimeout
 from flask import current_app as app
+from sqlalchemy import event
 
 import resultsdb.messaging
+from resultsdb.cache import IdentityCache, MemoryBackend, ResponseCache
 from resultsdb.models import db
-from resultsdb.models.results import utcnow_naive
+from resultsdb.__main__ import (
+    archive,
+    backfill_result_data,
+    dispatch,
+    import_command,
+    partitions,
+    purge_idempotency_keys,
+    rebuild_latest_results,
+)
+from resultsdb.models.results import (
+    IdempotencyKey,
+    LatestResult,
+    OutboxMessage,
+    Result,
+    ResultData,
+    utcnow_naive,
+)
+from resultsdb.controllers.api_v2 import explain_query, select_results
+from resultsdb.partitions import add_months, month_start, partition_name
 
 try:
     basestring
@@ -129,6 +155,39 @@ class TestFuncApiV20(TestCase):
         # Reset this for each test.
         resultsdb.messaging.DummyPlugin.history = []
 
+    def helper_counting_queries(self, send_request):
+        """Returns the response and the list of SQL statements executed to produce it."""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            r = send_request()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        return r, statements
+
+    def helper_get_counting_queries(self, url, headers=None):
+        return self.helper_counting_queries(lambda: self.app.get(url, headers=headers))
+
+    def helper_executemany_parameters(self, table_name, send_request):
+        """Returns the parameters of INSERT and UPDATE statements for multiple rows."""
+        parameters = []
+        prefixes = ("INSERT INTO %s " % table_name, "UPDATE %s " % table_name)
+
+        def before_cursor_execute(conn, cursor, statement, params, context, executemany):
+            if executemany and statement.startswith(prefixes):
+                parameters.append(params)
+
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            send_request()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+        return parameters
+
     # =============== TESTCASES ==================
 
     def helper_create_testcase(self, name=None, ref_url=None):
@@ -228,6 +287,15 @@ class TestFuncApiV20(TestCase):
         assert len(data["data"]) == 1
         assert data["data"][0] == self.ref_testcase
 
+    def test_get_testcases_cursor_pagination(self):
+        names = [self.helper_create_testcase(name="tc%d" % i)[1]["name"] for i in range(5)]
+
+        url = "/api/v2.0/testcases?limit=2&cursor="
+        assert self.helper_follow_cursor(url, "name") == names
+
+        r = self.app.get("/api/v2.0/testcases?limit=2&page=1")
+        assert [testcase["name"] for testcase in r.json["data"]] == names[2:4]
+
     def test_get_testcases_by_name(self):
         self.test_create_testcase()
 
@@ -326,6 +394,31 @@ class TestFuncApiV20(TestCase):
         assert len(data["data"]) == 1
         assert data["data"][0] == self.ref_group
 
+    def test_get_groups_results_count(self):
+        self.test_create_group()
+        self.helper_create_result()
+        self.helper_create_result(groups=[self.ref_group_uuid, "other-group"])
+
+        r = self.app.get("/api/v2.0/groups/%s" % self.ref_group_uuid)
+        assert r.status_code == 200
+        assert r.json["results_count"] == 2
+
+        r = self.app.get("/api/v2.0/groups/other-group")
+        assert r.status_code == 200
+        assert r.json["results_count"] == 1
+
+        r1, statements1 = self.helper_get_counting_queries("/api/v2.0/groups?limit=1")
+        r2, statements2 = self.helper_get_counting_queries("/api/v2.0/groups?limit=2")
+        assert [g["results_count"] for g in r2.json["data"]] == [1, 2]
+        assert len(r1.json["data"]) == 1
+        assert len(statements1) == len(statements2) == 1, statements2
+
+    def test_get_groups_cursor_pagination(self):
+        uuids = [self.helper_create_group(uuid="group%d" % i)[1]["uuid"] for i in range(5)]
+
+        url = "/api/v2.0/groups?limit=2&cursor="
+        assert self.helper_follow_cursor(url, "uuid") == uuids[::-1]
+
     def test_get_groups_by_description(self):
         self.test_create_group()
 
@@ -588,6 +681,69 @@ class TestFuncApiV20(TestCase):
         assert r.status_code == 200
         assert data["name"] == name2
 
+    def test_create_result_upserts_testcase_and_groups(self):
+        self.test_create_group()
+        self.test_create_testcase()
+        uuid2 = "1c26effb-7c07-4d90-9428-86aac053288c"
+
+        # Existing testcase and group keep the attributes which are not set
+        r, statements = self.helper_counting_queries(
+            lambda: self.helper_create_result(
+                testcase=self.ref_testcase_name,
+                groups=[self.ref_group_uuid, {"uuid": uuid2, "description": "Group 2"}],
+            )
+        )
+        data = r[1]
+        assert r[0].status_code == 201, data
+        assert data["testcase"] == self.ref_testcase
+        assert sorted(data["groups"]) == sorted([self.ref_group_uuid, uuid2])
+        # The unchanged rows are not updated, but selected after the upserts
+        lookups = [s for s in statements if s.startswith(("SELECT testcase", 'SELECT "group"'))]
+        assert len(lookups) == 2, lookups
+
+        r = self.app.get("/api/v2.0/groups/%s" % self.ref_group_uuid)
+        assert r.json["description"] == self.ref_group_description
+        assert r.json["ref_url"] == self.ref_group_ref_url
+        r = self.app.get("/api/v2.0/groups/%s" % uuid2)
+        assert r.json["description"] == "Group 2"
+        assert r.json["ref_url"] is None
+        assert r.json["results_count"] == 1
+
+        # ... and the attributes which are set are updated
+        r, data = self.helper_create_result(
+            testcase={"name": self.ref_testcase_name, "ref_url": None},
+            groups=[{"uuid": uuid2, "ref_url": "http://example.com/group2"}],
+        )
+        assert r.status_code == 201, data
+        assert data["testcase"]["ref_url"] is None
+
+        r = self.app.get("/api/v2.0/groups/%s" % uuid2)
+        assert r.json["description"] == "Group 2"
+        assert r.json["ref_url"] == "http://example.com/group2"
+        assert r.json["results_count"] == 2
+
+    def test_create_result_does_not_update_unchanged_testcase(self):
+        self.require_postgres()
+        self.test_create_testcase()
+
+        def testcase_version():
+            db.session.rollback()
+            return db.session.execute(
+                db.text("SELECT xmin::text FROM testcase WHERE name = :name"),
+                {"name": self.ref_testcase_name},
+            ).scalar()
+
+        version = testcase_version()
+        for testcase in (self.ref_testcase_name, self.ref_testcase):
+            r, data = self.helper_create_result(testcase=testcase)
+            assert r.status_code == 201, data
+            assert testcase_version() == version
+
+        testcase = {"name": self.ref_testcase_name, "ref_url": "http://example.com/new"}
+        r, data = self.helper_create_result(testcase=testcase)
+        assert r.status_code == 201, data
+        assert testcase_version() != version
+
     def test_create_result_invalid_outcome(self):
         ref_data = json.dumps({"outcome": "FAKEOUTCOME", "testcase": self.ref_testcase})
 
@@ -699,6 +855,119 @@ class TestFuncApiV20(TestCase):
             ]
         }
 
+    def helper_create_results_batch(self, items):
+        r = self.app.post("/api/v2.0/results/batch", json=items)
+        data = json.loads(r.data)
+        return r, data
+
+    def helper_batch_item(self, **kwargs):
+        item = dict(
+            outcome=self.ref_result_outcome,
+            testcase=self.ref_testcase_name,
+            groups=[self.ref_group_uuid],
+            data=self.ref_result_data,
+        )
+        item.update(kwargs)
+        return item
+
+    def test_create_results_batch(self):
+        items = [
+            self.helper_batch_item(),
+            self.helper_batch_item(testcase=self.ref_testcase, outcome="FAILED"),
+        ]
+        r, data = self.helper_create_results_batch(items)
+
+        assert r.status_code == 201, data
+        assert [item["status"] for item in data["data"]] == [201, 201]
+        results = [item["result"] for item in data["data"]]
+        assert [result["outcome"] for result in results] == ["PASSED", "FAILED"]
+        assert results[1]["testcase"] == self.ref_testcase
+        assert results[0]["testcase"] == self.ref_testcase
+        assert results[0]["groups"] == [self.ref_group_uuid]
+        assert results[0]["data"] == self.ref_result["data"]
+
+        r = self.app.get("/api/v2.0/results/%d" % results[1]["id"])
+        assert json.loads(r.data) == results[1]
+
+        r = self.app.get("/api/v2.0/groups/%s" % self.ref_group_uuid)
+        assert json.loads(r.data)["results_count"] == 2
+
+    def test_create_results_batch_partial(self):
+        items = [
+            self.helper_batch_item(),
+            {"testcase": self.ref_testcase_name},
+            self.helper_batch_item(data={"invalid:key": "1"}),
+        ]
+        r, data = self.helper_create_results_batch(items)
+
+        assert r.status_code == 207, data
+        assert data["data"][0]["status"] == 201
+        assert data["data"][0]["result"]["outcome"] == self.ref_result_outcome
+        assert data["data"][1] == {
+            "status": 400,
+            "validation_error": [
+                {
+                    "loc": ["outcome"],
+                    "msg": "Field required",
+                    "type": "missing",
+                    "input": ANY,
+                    "url": ANY,
+                }
+            ],
+        }
+        assert data["data"][2] == {
+            "status": 400,
+            "message": "Colon not allowed in key name: ['invalid:key']",
+        }
+
+        r = self.app.get("/api/v2.0/results")
+        assert len(json.loads(r.data)["data"]) == 1
+
+    def test_create_results_batch_invalid(self):
+        for items in ({}, [], "BAD"):
+            r, data = self.helper_create_results_batch(items)
+            assert r.status_code == 400, data
+            assert data == {"message": "Expected non-empty list of results"}
+
+        with patch.dict(app.config, {"RESULTS_BATCH_LIMIT": 2}):
+            r, data = self.helper_create_results_batch([self.helper_batch_item()] * 3)
+        assert r.status_code == 400, data
+        assert data == {"message": "Too many results, the limit is 2"}
+
+    def helper_create_results_batch_counting_queries(self, count):
+        items = [
+            self.helper_batch_item(groups=[self.ref_group_uuid, "group-%d" % i])
+            for i in range(count)
+        ]
+        return self.helper_counting_queries(
+            lambda: self.app.post("/api/v2.0/results/batch", json=items)
+        )
+
+    def test_create_results_batch_lookups_do_not_depend_on_size(self):
+        # The testcase and groups are selected only if they exist already
+        self.helper_create_results_batch_counting_queries(1)
+        r1, statements1 = self.helper_create_results_batch_counting_queries(2)
+        r2, statements2 = self.helper_create_results_batch_counting_queries(10)
+
+        assert r1.status_code == 201
+        assert r2.status_code == 201
+        selects1 = [s for s in statements1 if s.startswith("SELECT")]
+        selects2 = [s for s in statements2 if s.startswith("SELECT")]
+        assert len(selects1) == len(selects2), selects2
+
+    def test_create_results_batch_query_count_does_not_depend_on_size(self):
+        # SQLite cannot return generated ids of multiple inserted rows in order
+        self.require_postgres()
+
+        # The testcase and groups are selected only if they exist already
+        self.helper_create_results_batch_counting_queries(1)
+        r1, statements1 = self.helper_create_results_batch_counting_queries(2)
+        r2, statements2 = self.helper_create_results_batch_counting_queries(10)
+
+        assert r1.status_code == 201
+        assert r2.status_code == 201
+        assert len(statements1) == len(statements2), statements2
+
     def test_get_result(self):
         self.test_create_result()
 
@@ -731,6 +1000,158 @@ class TestFuncApiV20(TestCase):
         assert len(data["data"]) == 1
         assert data["data"][0] == self.ref_result
 
+    def test_get_results_query_count_does_not_depend_on_page_size(self):
+        self.helper_create_testcase(name=self.ref_testcase_name + ".1")
+        for i in range(6):
+            self.helper_create_result(
+                groups=[self.ref_group_uuid, "group%d" % i],
+                testcase=self.ref_testcase_name + ".%d" % (i % 2),
+            )
+
+        for url in ("/api/v2.0/results", "/api/v2.0/groups/%s/results" % self.ref_group_uuid):
+            r1, statements1 = self.helper_get_counting_queries(url + "?limit=1")
+            r2, statements2 = self.helper_get_counting_queries(url + "?limit=6")
+
+            assert r1.status_code == r2.status_code == 200
+            assert len(r1.json["data"]) == 1
+            assert len(r2.json["data"]) == 6
+            assert sorted(r2.json["data"][0]["groups"]) == sorted([self.ref_group_uuid, "group5"])
+            assert len(statements1) == len(statements2), statements2
+
+        r, statements = self.helper_get_counting_queries("/api/v2.0/results?limit=6")
+        # Results, data, groups and testcases
+        assert len(statements) == 4, statements
+
+        r1, statements1 = self.helper_get_counting_queries("/api/v2.0/results/latest?limit=1")
+        assert len(r1.json["data"]) == 2
+        assert len(statements1) == 4, statements1
+
+    def test_get_result_conditional(self):
+        ref_result = self.helper_create_result()[1]
+        url = "/api/v2.0/results/%d" % ref_result["id"]
+
+        r = self.app.get(url)
+        assert r.status_code == 200
+        etag = r.headers["ETag"]
+        assert etag
+
+        r = self.app.get(url, headers={"If-None-Match": etag})
+        assert r.status_code == 304
+        assert r.data == b""
+
+        # testcase update changes the embedded testcase data
+        self.helper_create_testcase(ref_url="http://example.com/changed")
+        r = self.app.get(url, headers={"If-None-Match": etag})
+        assert r.status_code == 200
+        assert r.headers["ETag"] != etag
+
+    def test_get_group_and_testcase_conditional(self):
+        self.helper_create_group()
+        self.helper_create_testcase()
+        urls = (
+            "/api/v2.0/groups/" + self.ref_group_uuid,
+            "/api/v2.0/groups",
+            "/api/v2.0/testcases/" + self.ref_testcase_name,
+            "/api/v2.0/testcases",
+        )
+        for url in urls:
+            r = self.app.get(url)
+            assert r.status_code == 200
+            r = self.app.get(url, headers={"If-None-Match": r.headers["ETag"]})
+            assert r.status_code == 304, url
+
+    def test_get_results_conditional(self):
+        self.helper_create_result()
+        urls = (
+            "/api/v2.0/results",
+            "/api/v2.0/results?item=" + self.ref_result_item,
+            "/api/v2.0/results/latest",
+            "/api/v2.0/groups/%s/results" % self.ref_group_uuid,
+            "/api/v2.0/testcases/%s/results" % self.ref_testcase_name,
+        )
+        etags = {}
+        for url in urls:
+            r, statements = self.helper_get_counting_queries(url)
+            assert r.status_code == 200
+            assert r.headers["ETag"].startswith('W/"')
+            # The watermark is queried only for conditional requests
+            assert not any("max(result.id)" in s for s in statements), statements
+
+            # The ETag of the body is answered with the ETag of the watermark
+            r = self.app.get(url, headers={"If-None-Match": r.headers["ETag"]})
+            assert r.status_code == 304, url
+            etags[url] = r.headers["ETag"]
+
+            r, statements = self.helper_get_counting_queries(url, {"If-None-Match": etags[url]})
+            assert r.status_code == 304, url
+            assert r.headers["ETag"] == etags[url]
+            # Nothing is queried after the watermark
+            assert "max(result.id)" in statements[-1], statements
+
+        # Different filters or pages yield different ETags
+        assert len(set(etags.values())) == len(urls)
+        r = self.app.get("/api/v2.0/results?page=1", headers={"If-None-Match": etags[urls[0]]})
+        assert r.status_code == 200
+
+        # New matching result changes the ETag
+        self.helper_create_result()
+        for url in urls:
+            r = self.app.get(url, headers={"If-None-Match": etags[url]})
+            assert r.status_code == 200, url
+            assert r.headers["ETag"] != etags[url]
+
+        # ... while results not matching the filter do not
+        r = self.app.get(urls[1])
+        etag = r.headers["ETag"]
+        self.helper_create_result(data={"item": "other"})
+        r = self.app.get(urls[1], headers={"If-None-Match": etag})
+        assert r.status_code == 304
+
+    def helper_follow_cursor(self, url, key, link="next"):
+        """Follows the `link` URLs starting with `url`, returns all collected values of `key`."""
+        values = []
+        pages = 0
+        while url:
+            r = self.app.get(url)
+            assert r.status_code == 200, r.text
+            values.extend(item[key] for item in r.json["data"])
+            url = r.json[link]
+            pages += 1
+            assert pages < 10
+        return values
+
+    def test_get_results_cursor_pagination(self):
+        ids = [self.helper_create_result()[1]["id"] for _ in range(5)]
+
+        url = "/api/v2.0/results?limit=2&cursor="
+        assert self.helper_follow_cursor(url, "id") == ids[::-1]
+
+        url = "/api/v2.0/results?limit=2&cursor=&_sort=asc:submit_time"
+        assert self.helper_follow_cursor(url, "id") == ids
+
+        r = self.app.get("/api/v2.0/results?limit=2&cursor=&item=" + self.ref_result_item)
+        assert [result["id"] for result in r.json["data"]] == ids[:2:-1]
+        assert r.json["prev"] is None
+        assert "item=" + self.ref_result_item in r.json["next"]
+
+        r = self.app.get(r.json["next"])
+        assert [result["id"] for result in r.json["data"]] == ids[2:0:-1]
+        assert "cursor=" in r.json["prev"]
+        assert "page=" not in r.json["prev"]
+
+        # Going back from the second page
+        assert self.helper_follow_cursor(r.json["prev"], "id", link="prev") == ids[:2:-1]
+
+        # Results with the same submit_time are ordered by id
+        for result in Result.query.all():
+            result.submit_time = datetime.datetime(2024, 1, 1)
+        db.session.commit()
+        assert self.helper_follow_cursor(url, "id") == ids
+
+    def test_get_results_invalid_cursor(self):
+        r = self.app.get("/api/v2.0/results?cursor=invalid")
+        assert r.status_code == 400
+
     def test_get_results_sorted_by_submit_time_desc_by_default(self):
         r1 = self.helper_create_result()
         r2 = self.helper_create_result()
@@ -933,6 +1354,750 @@ class TestFuncApiV20(TestCase):
         assert len(data["data"]) == 1
         assert data["data"][0] == self.ref_result
 
+    def test_export_results_ndjson(self):
+        self.helper_create_result(outcome="PASSED")
+        self.helper_create_result(outcome="FAILED", data={"item": "foo"})
+        self.helper_create_result(outcome="PASSED", data={"item": "foo"})
+
+        r = self.app.get("/api/v2.0/results/export")
+        assert r.status_code == 200
+        assert r.mimetype == "application/x-ndjson"
+        assert r.is_streamed
+        lines = r.text.splitlines()
+        assert [json.loads(line) for line in lines] == self.app.get("/api/v2.0/results").json[
+            "data"
+        ]
+
+        r = self.app.get("/api/v2.0/results/export?_format=ndjson&outcome=PASSED&item=foo")
+        assert r.status_code == 200
+        lines = r.text.splitlines()
+        assert [json.loads(line) for line in lines] == (
+            self.app.get("/api/v2.0/results?outcome=PASSED&item=foo").json["data"]
+        )
+        assert len(lines) == 1
+
+    def test_export_results_csv(self):
+        self.helper_create_result(data={"item": "foo,bar", "arch": "x86_64"})
+
+        r = self.app.get("/api/v2.0/results/export?_format=csv")
+        assert r.status_code == 200
+        assert r.mimetype == "text/csv"
+        rows = list(csv.DictReader(io.StringIO(r.text)))
+        assert len(rows) == 1
+        result = self.app.get("/api/v2.0/results").json["data"][0]
+        assert rows[0] == {
+            "id": str(result["id"]),
+            "testcase": self.ref_testcase_name,
+            "outcome": result["outcome"],
+            "submit_time": result["submit_time"],
+            "note": result["note"],
+            "ref_url": result["ref_url"],
+            "groups": json.dumps(result["groups"]),
+            "data": json.dumps(result["data"], sort_keys=True),
+        }
+        assert json.loads(rows[0]["data"]) == {"item": ["foo,bar"], "arch": ["x86_64"]}
+
+        r = self.app.get("/api/v2.0/results/export?_format=csv&outcome=FAILED")
+        assert r.status_code == 200
+        assert r.text.splitlines() == [
+            ",".join(
+                ("id", "testcase", "outcome", "submit_time", "note", "ref_url", "groups", "data")
+            )
+        ]
+
+    def test_export_results_invalid_format(self):
+        r = self.app.get("/api/v2.0/results/export?_format=xml")
+        assert r.status_code == 400
+
+    def test_count_results(self):
+        self.helper_create_result(outcome="PASSED")
+        self.helper_create_result(outcome="FAILED", data={"item": "foo", "arch": "x86_64"})
+        self.helper_create_result(outcome="PASSED", data={"item": ["foo", "bar"]})
+
+        r = self.app.get("/api/v2.0/results/count?_mode=exact")
+        assert r.status_code == 200
+        assert r.json == {"count": 3, "mode": "exact"}
+        assert r.headers["ETag"]
+
+        r = self.app.get("/api/v2.0/results/count?_mode=exact&outcome=PASSED")
+        assert r.json == {"count": 2, "mode": "exact"}
+
+        # Results matching multiple values of a key are counted once
+        r = self.app.get("/api/v2.0/results/count?_mode=exact&item=foo,bar")
+        assert r.json == {"count": 2, "mode": "exact"}
+
+        r = self.app.get("/api/v2.0/results/count?_mode=exact&item=foo&arch=x86_64")
+        assert r.json == {"count": 1, "mode": "exact"}
+
+        r = self.app.get("/api/v2.0/results/count?_mode=exact&testcases=fake")
+        assert r.json == {"count": 0, "mode": "exact"}
+
+    def test_count_results_estimate_fallback(self):
+        if db.engine.name == "postgresql":
+            self.skipTest("Test for databases other than PostgreSQL")
+
+        self.helper_create_result()
+        for mode in ("auto", "estimate"):
+            r = self.app.get("/api/v2.0/results/count?_mode=%s" % mode)
+            assert r.status_code == 200
+            assert r.json == {"count": 1, "mode": "exact"}
+
+    def test_count_results_estimate(self):
+        self.require_postgres()
+
+        self.helper_create_result()
+        db.session.execute(db.text("ANALYZE result"))
+        r = self.app.get("/api/v2.0/results/count?_mode=estimate")
+        assert r.status_code == 200
+        assert r.json["mode"] == "estimate"
+        assert r.json["count"] >= 0
+
+        with patch.dict(app.config, {"RESULTS_COUNT_MAX_EXACT_COST": 0}):
+            r = self.app.get("/api/v2.0/results/count")
+        assert r.json["mode"] == "estimate"
+
+        r = self.app.get("/api/v2.0/results/count")
+        assert r.json == {"count": 1, "mode": "exact"}
+
+    def test_count_results_estimate_data_filter(self):
+        self.require_postgres()
+
+        self.helper_create_result(data={"item": "foo"})
+        self.helper_create_result(data={"item": "bar"})
+        for use_json in (False, True):
+            with patch.dict(app.config, {"RESULT_DATA_JSON": use_json}):
+                for mode in ("auto", "estimate"):
+                    r = self.app.get("/api/v2.0/results/count?_mode=%s&item=foo,baz" % mode)
+                    assert r.status_code == 200, (use_json, mode)
+                r = self.app.get("/api/v2.0/results/count?item=foo,baz")
+                assert r.json == {"count": 1, "mode": "exact"}
+
+    def test_count_results_invalid_mode(self):
+        r = self.app.get("/api/v2.0/results/count?_mode=fast")
+        assert r.status_code == 400
+
+    def test_results_stats(self):
+        self.helper_create_result(outcome="PASSED", data={"item": ["foo", "bar"]})
+        self.helper_create_result(outcome="FAILED", data={"item": "foo"})
+        self.helper_create_result(outcome="PASSED", data={})
+        self.helper_create_result(outcome="PASSED", testcase="other_testcase", data={})
+
+        r = self.app.get("/api/v2.0/results/stats?_group_by=testcase,outcome")
+        assert r.status_code == 200
+        assert r.headers["ETag"]
+        assert r.json["data"] == [
+            {"testcase": self.ref_testcase_name, "outcome": "FAILED", "count": 1},
+            {"testcase": self.ref_testcase_name, "outcome": "PASSED", "count": 2},
+            {"testcase": "other_testcase", "outcome": "PASSED", "count": 1},
+        ]
+
+        r = self.app.get(
+            "/api/v2.0/results/stats?_group_by=outcome&testcases=%s" % self.ref_testcase_name
+        )
+        assert r.json["data"] == [
+            {"outcome": "FAILED", "count": 1},
+            {"outcome": "PASSED", "count": 2},
+        ]
+
+        r = self.app.get("/api/v2.0/results/stats?_group_by=data.item,outcome")
+        assert r.json["data"] == [
+            {"data.item": None, "outcome": "PASSED", "count": 2},
+            {"data.item": "bar", "outcome": "PASSED", "count": 1},
+            {"data.item": "foo", "outcome": "FAILED", "count": 1},
+            {"data.item": "foo", "outcome": "PASSED", "count": 1},
+        ]
+
+        # Results matching multiple values of a key are counted once
+        r = self.app.get("/api/v2.0/results/stats?_group_by=outcome&item=foo,bar")
+        assert r.json["data"] == [
+            {"outcome": "FAILED", "count": 1},
+            {"outcome": "PASSED", "count": 1},
+        ]
+
+    def test_results_stats_time_buckets(self):
+        r, data = self.helper_create_results_batch(
+            [
+                self.helper_batch_item(submit_time=submit_time)
+                for submit_time in (
+                    "2024-01-02T03:04:05.000000Z",
+                    "2024-01-02T03:59:59.000000Z",
+                    "2024-01-02T04:00:00.000000Z",
+                    "2024-01-03T00:00:00.000000Z",
+                )
+            ]
+        )
+        assert r.status_code == 201, data
+
+        r = self.app.get("/api/v2.0/results/stats?_group_by=hour")
+        assert r.status_code == 200
+        assert r.json["data"] == [
+            {"hour": "2024-01-02T03:00:00", "count": 2},
+            {"hour": "2024-01-02T04:00:00", "count": 1},
+            {"hour": "2024-01-03T00:00:00", "count": 1},
+        ]
+
+        r = self.app.get("/api/v2.0/results/stats?_group_by=day&since=2024-01-02T04:00:00")
+        assert r.json["data"] == [
+            {"day": "2024-01-02T00:00:00", "count": 1},
+            {"day": "2024-01-03T00:00:00", "count": 1},
+        ]
+
+    def test_results_stats_invalid_group_by(self):
+        for query in (
+            "",
+            "?_group_by=",
+            "?_group_by=week",
+            "?_group_by=data.",
+            "?_group_by=day,day",
+        ):
+            r = self.app.get("/api/v2.0/results/stats" + query)
+            assert r.status_code == 400, query
+
+    def test_get_results_latest_cache(self):
+        cache = ResponseCache(MemoryBackend(), ttl=60)
+        url = "/api/v2.0/results/latest?item=foo"
+        with patch.object(app, "latest_results_cache", cache):
+            self.helper_create_result(data={"item": "foo"})
+
+            r1 = self.app.get(url)
+            assert r1.status_code == 200
+            assert len(r1.json["data"]) == 1
+            assert (cache.hits, cache.misses) == (0, 1)
+
+            r2, statements = self.helper_get_counting_queries(url)
+            assert statements == []
+            assert r2.data == r1.data
+            assert r2.headers["ETag"] == r1.headers["ETag"]
+            assert (cache.hits, cache.misses) == (1, 1)
+
+            r = self.app.get(url, headers={"If-None-Match": r1.headers["ETag"]})
+            assert r.status_code == 304
+            assert (cache.hits, cache.misses) == (2, 1)
+
+            # Normalized query hits the same entry
+            r = self.app.get("/api/v2.0/results/latest?item=foo&item=foo&_sort=")
+            r = self.app.get("/api/v2.0/results/latest?_sort=&item=foo&item=foo")
+            assert (cache.hits, cache.misses) == (3, 2)
+
+            # Result not matching the filter does not invalidate the entry
+            self.helper_create_result(data={"item": "bar"})
+            self.helper_create_result(testcase="other", data={"type": "foo"})
+            r = self.app.get(url)
+            assert r.data == r1.data
+            assert (cache.hits, cache.misses) == (4, 2)
+
+            # ... but a matching one does
+            self.helper_create_result(testcase="other", data={"item": "foo"})
+            r = self.app.get(url)
+            assert len(r.json["data"]) == 2
+            assert (cache.hits, cache.misses) == (4, 3)
+
+            # Entries expire after TTL
+            with patch("resultsdb.cache.time.monotonic", return_value=time.monotonic() + 61):
+                r = self.app.get(url)
+            assert len(r.json["data"]) == 2
+            assert (cache.hits, cache.misses) == (4, 4)
+
+            # Failed requests are not cached
+            r = self.app.get("/api/v2.0/results/latest?_distinct_on=scenario")
+            assert r.status_code == 400
+            r = self.app.get("/api/v2.0/results/latest?_distinct_on=scenario")
+            assert r.status_code == 400
+            assert (cache.hits, cache.misses) == (4, 6)
+
+    def helper_create_result_counting_lookups(self, **kwargs):
+        """Returns the response data and the testcase and group upsert statements."""
+        r, statements = self.helper_counting_queries(lambda: self.helper_create_result(**kwargs))
+        lookups = [
+            s for s in statements if s.startswith(("INSERT INTO testcase", 'INSERT INTO "group"'))
+        ]
+        return r[1], lookups
+
+    def test_create_result_identity_cache(self):
+        cache = IdentityCache(max_entries=100, ttl=60)
+        with patch.object(app, "identity_cache", cache):
+            data, lookups = self.helper_create_result_counting_lookups()
+            assert len(lookups) == 2
+            assert (cache.hits, cache.misses) == (0, 2)
+
+            data, lookups = self.helper_create_result_counting_lookups()
+            assert lookups == []
+            assert (cache.hits, cache.misses) == (2, 2)
+            assert cache.hit_rate == 0.5
+            assert data["testcase"]["name"] == self.ref_testcase_name
+            assert data["groups"] == [self.ref_group_uuid]
+
+            r = self.app.get("/api/v2.0/groups/%s" % self.ref_group_uuid)
+            assert r.json["results_count"] == 2
+
+            # Changed attributes bypass the cache
+            testcase = {"name": self.ref_testcase_name, "ref_url": "http://example.com/new"}
+            data, lookups = self.helper_create_result_counting_lookups(testcase=testcase)
+            assert len(lookups) == 1
+            assert data["testcase"]["ref_url"] == "http://example.com/new"
+
+            data, lookups = self.helper_create_result_counting_lookups()
+            assert lookups == []
+            assert data["testcase"]["ref_url"] == "http://example.com/new"
+
+            # Updates through the API refresh the cache
+            self.helper_create_testcase(ref_url="http://example.com/newer")
+            self.helper_create_group(description="New description")
+            data, lookups = self.helper_create_result_counting_lookups()
+            assert lookups == []
+            assert data["testcase"]["ref_url"] == "http://example.com/newer"
+
+            r = self.app.get("/api/v2.0/groups/%s" % self.ref_group_uuid)
+            assert r.json["description"] == "New description"
+
+    def test_get_results_latest_from_latest_result_table(self):
+        config = {"LATEST_RESULT_KEYS": ("item", "type"), "LATEST_RESULT_QUERIES": False}
+        with patch.dict(app.config, config):
+            self.helper_create_result(testcase="tc1", data={"item": "foo", "type": "a"})
+            self.helper_create_result(testcase="tc1", data={"item": "foo", "type": "a"})
+            r3 = self.helper_create_result(testcase="tc1", data={"item": "foo", "type": "b"})[1]
+            r4 = self.helper_create_result(testcase="tc2", data={"item": "bar"})[1]
+            r5 = self.helper_create_result(
+                testcase="tc1", data={"item": "foo", "type": "a", "scenario": "x"}
+            )[1]
+
+            latest = sorted((row.testcase_name, row.result_id) for row in LatestResult.query)
+            assert latest == [("tc1", r3["id"]), ("tc1", r5["id"]), ("tc2", r4["id"])]
+
+            urls = {
+                # URL: answered from latest_result table
+                "": True,
+                "item=foo": True,
+                "item=foo&type=a,b": True,
+                "item:like=*&testcases=tc1": True,
+                "item=foo&scenario=x": False,
+                "item=foo&since=2000-01-01": False,
+                "groups=" + self.ref_group_uuid: False,
+            }
+            expected = {url: self.app.get("/api/v2.0/results/latest?" + url).json for url in urls}
+
+            app.config["LATEST_RESULT_QUERIES"] = True
+            for url, uses_table in urls.items():
+                r, statements = self.helper_get_counting_queries("/api/v2.0/results/latest?" + url)
+                assert r.json == expected[url], url
+                assert any("latest_result" in s for s in statements) == uses_table, url
+
+    def test_rebuild_latest_results(self):
+        self.helper_create_result(testcase="tc1", data={"item": "foo", "type": "a"})
+        r2 = self.helper_create_result(testcase="tc1", data={"item": "foo", "type": "a"})[1]
+        r3 = self.helper_create_result(testcase="tc1", data={"item": "foo", "type": "b"})[1]
+        r4 = self.helper_create_result(testcase="tc2", data={"item": "foo", "type": "a"})[1]
+        assert LatestResult.query.count() == 0
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(rebuild_latest_results, ["--batch-size", "3"])
+        assert result.exit_code == 1
+        assert "LATEST_RESULT_KEYS is not configured" in result.output
+
+        with patch.dict(app.config, {"LATEST_RESULT_KEYS": ("item",)}):
+            result = runner.invoke(rebuild_latest_results, ["--batch-size", "3"])
+        assert result.exit_code == 0, result.output
+        assert " - processed 4 results" in result.output
+        assert "Stored 2 latest results" in result.output
+
+        # The latest results for the previous keys are deleted
+        with patch.dict(app.config, {"LATEST_RESULT_KEYS": ("item", "type")}):
+            result = runner.invoke(rebuild_latest_results, ["--batch-size", "3"])
+        assert result.exit_code == 0, result.output
+        assert " - deleted 2 outdated latest results" in result.output
+        assert "Stored 3 latest results" in result.output
+
+        latest = sorted((row.testcase_name, row.result_id) for row in LatestResult.query)
+        assert latest == [("tc1", r2["id"]), ("tc1", r3["id"]), ("tc2", r4["id"])]
+
+    def test_import_results(self):
+        self.helper_create_result(data={"item": "foo", "arch": ["x86_64", "noarch"]})
+        self.helper_create_result(outcome="FAILED", groups=[], data={})
+        self.helper_create_result(testcase=self.ref_testcase)
+        exported = self.app.get("/api/v2.0/results/export").data.decode("utf-8")
+        expected_results = self.app.get("/api/v2.0/results").json
+        expected_group = self.app.get("/api/v2.0/groups/%s" % self.ref_group_uuid).json
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+
+        result = app.test_cli_runner().invoke(
+            import_command, ["--batch-size", "2"], input=exported
+        )
+        assert result.exit_code == 0, result.output
+        assert " - imported 2 results" in result.output
+        assert "Imported 3 results" in result.output
+
+        assert self.app.get("/api/v2.0/results").json == expected_results
+        assert {r.id: r.data_json for r in Result.query} == {
+            r["id"]: r["data"] for r in expected_results["data"]
+        }
+        assert self.app.get("/api/v2.0/groups/%s" % self.ref_group_uuid).json == expected_group
+        assert self.app.get("/api/v2.0/testcases/%s" % self.ref_testcase_name).json == dict(
+            self.ref_testcase, href=ANY
+        )
+
+    def test_import_results_without_ids(self):
+        r1 = self.helper_create_result()[1]
+        lines = [
+            json.dumps(self.helper_batch_item(submit_time="2024-01-02T03:04:05Z")),
+            "",
+            json.dumps(self.helper_batch_item(testcase="new", groups=[{"uuid": "new-group"}])),
+        ]
+        indexes = {index["name"] for index in db.inspect(db.engine).get_indexes("result")}
+
+        with patch.dict(app.config, {"LATEST_RESULT_KEYS": ("item",)}):
+            result = app.test_cli_runner().invoke(
+                import_command, ["--defer-indexes"], input="\n".join(lines)
+            )
+        assert result.exit_code == 0, result.output
+        assert "Rebuilding indexes" in result.output
+        assert "Imported 2 results" in result.output
+        assert {index["name"] for index in db.inspect(db.engine).get_indexes("result")} == indexes
+
+        results = self.app.get("/api/v2.0/results").json["data"]
+        assert [r["id"] for r in results] == [r1["id"] + 2, r1["id"], r1["id"] + 1]
+        assert results[2]["submit_time"] == "2024-01-02T03:04:05"
+        assert results[0]["testcase"]["name"] == "new"
+        assert results[0]["groups"] == ["new-group"]
+        assert results[0]["data"] == r1["data"]
+        assert LatestResult.query.count() == 2
+
+        group = self.app.get("/api/v2.0/groups/%s" % self.ref_group_uuid).json
+        assert group["results_count"] == 2
+
+    def test_import_results_invalid(self):
+        lines = [
+            json.dumps(self.helper_batch_item()),
+            json.dumps(self.helper_batch_item(outcome="")),
+        ]
+        result = app.test_cli_runner().invoke(import_command, input="\n".join(lines))
+        assert result.exit_code == 1
+        assert "Invalid result on line 2" in result.output
+        assert Result.query.count() == 0
+
+    def test_import_results_duplicate_id(self):
+        r1 = self.helper_create_result()[1]
+        lines = [json.dumps(dict(self.helper_batch_item(), id=r1["id"]))]
+        indexes = {index["name"] for index in db.inspect(db.engine).get_indexes("result")}
+
+        result = app.test_cli_runner().invoke(
+            import_command, ["--defer-indexes"], input="\n".join(lines)
+        )
+        assert result.exit_code == 1
+        assert "unique" in str(result.exception).lower()
+        assert "Rebuilding indexes" in result.output
+        assert {index["name"] for index in db.inspect(db.engine).get_indexes("result")} == indexes
+        assert Result.query.count() == 1
+
+    def helper_create_old_results(self, count):
+        """Creates results submitted a year ago and one new result."""
+        old_time = (utcnow_naive() - datetime.timedelta(days=365)).isoformat(
+            timespec="microseconds"
+        )
+        r, data = self.helper_create_results_batch(
+            [self.helper_batch_item(submit_time=old_time) for _ in range(count)]
+            + [self.helper_batch_item()]
+        )
+        assert r.status_code == 201, data
+        return [item["result"]["id"] for item in data["data"]]
+
+    def test_archive_dry_run(self):
+        self.helper_create_old_results(2)
+        data_count = ResultData.query.count()
+
+        result = app.test_cli_runner().invoke(archive, ["--older-than", "30", "--dry-run"])
+        assert result.exit_code == 0, result.output
+        assert " - result: 2 rows" in result.output
+        assert " - result_data: %d rows" % (data_count * 2 // 3) in result.output
+        assert " - groups_to_results: 2 rows" in result.output
+        assert "Would archive 2 results" in result.output
+        assert "Estimated reclaimable size: " in result.output
+        assert Result.query.count() == 3
+
+    def test_archive_dry_run_estimates_table_rows(self):
+        self.require_postgres()
+        self.helper_create_old_results(2)
+        db.session.commit()
+        for name in ("result", "result_data", "groups_to_results"):
+            db.session.execute(db.text("ANALYZE %s" % name))
+
+        runner = app.test_cli_runner()
+        result, statements = self.helper_counting_queries(
+            lambda: runner.invoke(archive, ["--older-than", "30", "--dry-run"])
+        )
+        assert result.exit_code == 0, result.output
+        assert " - result: 2 rows" in result.output
+        # The rows of the whole tables are not counted
+        assert not [s for s in statements if s.startswith("SELECT count(*) FROM")], statements
+
+    def test_archive_changes_results_etag(self):
+        self.helper_create_result()
+        ids = self.helper_create_old_results(1)
+        url = "/api/v2.0/results"
+        r = self.app.get(url)
+        r = self.app.get(url, headers={"If-None-Match": r.headers["ETag"]})
+        assert r.status_code == 304
+        etag = r.headers["ETag"]
+
+        # The archived result is neither the first nor the last one
+        with tempfile.TemporaryDirectory() as output:
+            runner = app.test_cli_runner()
+            result = runner.invoke(archive, ["--older-than", "30", "--output", output])
+        assert result.exit_code == 0, result.output
+        assert db.session.get(Result, ids[0]) is None
+
+        r = self.app.get(url, headers={"If-None-Match": etag})
+        assert r.status_code == 200
+        assert len(r.json["data"]) == 2
+
+    def test_archive(self):
+        ids = self.helper_create_old_results(3)
+        expected = [self.app.get("/api/v2.0/results/%d" % id_).json for id_ in ids[:3]]
+
+        with tempfile.TemporaryDirectory() as output:
+            runner = app.test_cli_runner()
+            result = runner.invoke(
+                archive, ["--older-than", "30", "--output", output, "--batch-size", "2"]
+            )
+            assert result.exit_code == 0, result.output
+            assert " - archived 2 results" in result.output
+            assert "Archived 3 results" in result.output
+            names = sorted(os.listdir(output))
+            assert names == [
+                "results-%d-%d.ndjson.gz" % (ids[0], ids[1]),
+                "results-%d-%d.ndjson.gz" % (ids[2], ids[2]),
+            ]
+
+            assert [result.id for result in Result.query] == [ids[3]]
+            assert ResultData.query.filter(ResultData.result_id.in_(ids[:3])).count() == 0
+            group = self.app.get("/api/v2.0/groups/%s" % self.ref_group_uuid).json
+            assert group["results_count"] == 1
+
+            # The archive can be imported back
+            for name in names:
+                with gzip.open(os.path.join(output, name), "rt") as f:
+                    result = runner.invoke(import_command, input=f.read())
+                assert result.exit_code == 0, result.output
+
+        assert [self.app.get("/api/v2.0/results/%d" % id_).json for id_ in ids[:3]] == expected
+        group = self.app.get("/api/v2.0/groups/%s" % self.ref_group_uuid).json
+        assert group["results_count"] == 4
+
+    def test_archive_resume(self):
+        ids = self.helper_create_old_results(2)
+
+        with tempfile.TemporaryDirectory() as output:
+            runner = app.test_cli_runner()
+            args = ["--older-than", "30", "--output", output, "--batch-size", "1"]
+            with patch("resultsdb.archive.delete_results", side_effect=RuntimeError("crash")):
+                result = runner.invoke(archive, args)
+            assert result.exit_code == 1
+            db.session.rollback()
+            assert os.listdir(output) == ["results-%d-%d.ndjson.gz" % (ids[0], ids[0])]
+            assert Result.query.count() == 3
+
+            result = runner.invoke(archive, args)
+            assert result.exit_code == 0, result.output
+            assert " - deleted 1 results archived by an interrupted run" in result.output
+            assert "Archived 1 results" in result.output
+            assert len(os.listdir(output)) == 2
+            assert [result.id for result in Result.query] == [ids[2]]
+
+    def test_result_data_submit_time(self):
+        r, data = self.helper_create_results_batch(
+            [
+                self.helper_batch_item(submit_time="2024-01-02T03:04:05.000000Z"),
+                self.helper_batch_item(),
+            ]
+        )
+        assert r.status_code == 201, data
+        for result in Result.query:
+            assert result.data
+            assert {rd.submit_time for rd in result.data} == {result.submit_time}
+
+    def test_partitions_require_postgresql(self):
+        if db.engine.name == "postgresql":
+            self.skipTest("Test for databases other than PostgreSQL")
+
+        result = app.test_cli_runner().invoke(partitions, ["create"])
+        assert result.exit_code == 1
+        assert "Partitioning is supported only on PostgreSQL" in result.output
+
+    def test_partitions_convert_failed(self):
+        self.require_postgres()
+
+        self.helper_create_result()
+        with patch("resultsdb.partitions.attach_legacy_tables", side_effect=RuntimeError("x")):
+            result = app.test_cli_runner().invoke(partitions, ["convert"])
+        assert result.exit_code == 1
+
+        # The constraints and the index added before are removed
+        inspector = db.inspect(db.engine)
+        assert inspector.get_check_constraints("result") == []
+        assert inspector.get_check_constraints("result_data") == []
+        indexes = {index["name"] for index in inspector.get_indexes("result")}
+        assert indexes == {index.name for index in Result.__table__.indexes}
+
+    def helper_count_rows(self, table_name):
+        return db.session.execute(db.text("SELECT count(*) FROM %s" % table_name)).scalar()
+
+    def test_partitions(self):
+        self.require_postgres()
+
+        self.helper_create_result()
+        runner = app.test_cli_runner()
+        result = runner.invoke(partitions, ["convert", "--months", "2"])
+        assert result.exit_code == 0, result.output
+        assert " - dropped foreign key result_data.result_data_result_id_fkey" in result.output
+        primary_key = db.inspect(db.engine).get_pk_constraint("result_legacy")
+        assert primary_key["constrained_columns"] == ["id", "submit_time"]
+
+        months = [add_months(month_start(utcnow_naive()), i) for i in range(1, 4)]
+        result_partitions = [partition_name(Result.__table__, month) for month in months]
+        data_partitions = [partition_name(ResultData.__table__, month) for month in months]
+        r, data = self.helper_create_results_batch(
+            [
+                self.helper_batch_item(
+                    submit_time=(month + datetime.timedelta(days=1)).isoformat(
+                        timespec="microseconds"
+                    )
+                )
+                for month in months[:2]
+            ]
+        )
+        assert r.status_code == 201, data
+        ids = [item["result"]["id"] for item in data["data"]]
+        data_count = len(ResultData.query.filter_by(result_id=ids[0]).all())
+        assert self.helper_count_rows("result_legacy") == 1
+        assert self.helper_count_rows("result_data_legacy") == data_count
+        for name in result_partitions[:2]:
+            assert self.helper_count_rows(name) == 1
+        for name in data_partitions[:2]:
+            assert self.helper_count_rows(name) == data_count
+
+        # Queries by submit_time only scan the matching partitions
+        q = select_results(
+            since_start=months[1],
+            since_end=months[1] + datetime.timedelta(days=7),
+            testcases=[self.ref_testcase_name],
+        )
+        plan = json.dumps(explain_query(q))
+        assert result_partitions[1] in plan, plan
+        assert result_partitions[0] not in plan, plan
+        assert "result_legacy" not in plan, plan
+        r = self.app.get("/api/v2.0/results?since=%s" % months[1].isoformat())
+        assert [result["id"] for result in r.json["data"]] == [ids[1]]
+
+        # So do the joins of the result data filters
+        for value in (self.ref_result_item, self.ref_result_item + "*"):
+            q = select_results(
+                since_start=months[1],
+                since_end=months[1] + datetime.timedelta(days=7),
+                result_data={"item:like" if "*" in value else "item": [value]},
+            )
+            plan = json.dumps(explain_query(q))
+            assert data_partitions[1] in plan, plan
+            assert data_partitions[0] not in plan, plan
+            assert [result.id for result in q] == [ids[1]]
+
+        # Results for months without a partition go to the overflow partitions
+        r, data = self.helper_create_results_batch(
+            [
+                self.helper_batch_item(
+                    submit_time=(month + datetime.timedelta(days=1)).isoformat(
+                        timespec="microseconds"
+                    )
+                )
+                for month in (months[2], add_months(months[2], 120))
+            ]
+        )
+        assert r.status_code == 201, data
+        assert self.helper_count_rows("result_overflow") == 2
+        assert self.helper_count_rows("result_data_overflow") == 2 * data_count
+
+        result = runner.invoke(partitions, ["create", "--months", "3"])
+        assert result.exit_code == 0, result.output
+        assert " - created %s" % result_partitions[2] in result.output
+        assert " - created %s" % data_partitions[2] in result.output
+        assert "Created 2 partitions" in result.output
+        assert self.helper_count_rows(result_partitions[2]) == 1
+        assert self.helper_count_rows(data_partitions[2]) == data_count
+        assert self.helper_count_rows("result_overflow") == 1
+        assert self.helper_count_rows("result_data_overflow") == data_count
+        result_id = data["data"][0]["result"]["id"]
+        r = self.app.get("/api/v2.0/results/%s" % result_id)
+        assert r.status_code == 200, r.json
+
+        result = runner.invoke(partitions, ["drop", "--before", months[1].strftime("%Y-%m")])
+        assert result.exit_code == 0, result.output
+        assert "Dropped 2 partitions" in result.output
+        assert db.session.get(Result, ids[0]) is None
+        assert Result.query.count() == 4
+        group = self.app.get("/api/v2.0/groups/%s" % self.ref_group_uuid).json
+        assert group["results_count"] == 4
+
+    def helper_get_results_with_data_json(self, url):
+        """Returns the response with RESULT_DATA_JSON enabled and the SQL statements."""
+        with patch.dict(app.config, {"RESULT_DATA_JSON": True}):
+            return self.helper_get_counting_queries(url)
+
+    def test_result_data_json(self):
+        self.helper_create_result(data={"item": "foo", "arch": ["x86_64", "noarch"]})
+        self.helper_create_result(data={"item": "bar"})
+        self.helper_create_result(data={})
+
+        assert [result.data_json for result in Result.query.order_by(Result.id)] == [
+            {"item": ["foo"], "arch": ["x86_64", "noarch"]},
+            {"item": ["bar"]},
+            {},
+        ]
+
+        for url in ("/api/v2.0/results", "/api/v2.0/results?item=foo&arch=noarch"):
+            expected = self.app.get(url).json
+            r, statements = self.helper_get_results_with_data_json(url)
+            assert r.json == expected
+            assert not any(s.startswith("SELECT result_data.") for s in statements), statements
+
+    def test_result_data_json_filters(self):
+        self.require_postgres()
+
+        self.helper_create_result(data={"item": "foo", "arch": ["x86_64", "noarch"]})
+        self.helper_create_result(data={"item": "bar", "arch": "noarch"})
+
+        urls = (
+            "/api/v2.0/results?item=foo",
+            "/api/v2.0/results?item=foo,bar",
+            "/api/v2.0/results?item=foo,bar&arch=x86_64",
+            "/api/v2.0/results?item:like=f*&arch=noarch",
+            "/api/v2.0/results?item=baz",
+        )
+        for url in urls:
+            expected = self.app.get(url).json
+            r, statements = self.helper_get_results_with_data_json(url)
+            assert r.json == expected, url
+            assert any("result.data @> " in s for s in statements), statements
+
+    def test_backfill_result_data(self):
+        self.helper_create_result(data={"item": "foo", "arch": ["x86_64", "noarch"]})
+        self.helper_create_result(data={})
+        self.helper_create_result(data={"item": "bar"})
+        expected = self.app.get("/api/v2.0/results").json
+        db.session.execute(db.update(Result).values(data_json=None))
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(backfill_result_data, ["--batch-size", "2"])
+        assert result.exit_code == 0, result.output
+
+        db.session.expire_all()
+        assert [result.data_json for result in Result.query.order_by(Result.id)] == [
+            {"item": ["foo"], "arch": ["x86_64", "noarch"]},
+            {},
+            {"item": ["bar"]},
+        ]
+        r, _ = self.helper_get_results_with_data_json("/api/v2.0/results")
+        assert r.json == expected
+
     def test_get_results_latest(self):
         self.helper_create_testcase()
         self.helper_create_testcase(name=self.ref_testcase_name + ".1")
@@ -1180,6 +2345,182 @@ class TestFuncApiV20(TestCase):
         assert plugin.history[0]["note"] == self.ref_result_note
         assert plugin.history[0]["testcase"]["name"] == self.ref_testcase_name
 
+    def helper_create_result_idempotent(self, key, **kwargs):
+        item = self.helper_batch_item(**kwargs)
+        r = self.app.post("/api/v2.0/results", json=item, headers={"Idempotency-Key": key})
+        return r, json.loads(r.data)
+
+    def test_create_result_idempotency_key(self):
+        r1, data1 = self.helper_create_result_idempotent("key1")
+        assert r1.status_code == 201, data1
+        assert "Idempotent-Replayed" not in r1.headers
+
+        r2, statements = self.helper_counting_queries(
+            lambda: self.helper_create_result_idempotent("key1")
+        )
+        assert r2[0].status_code == 201, r2[1]
+        assert r2[0].headers["Idempotent-Replayed"] == "true"
+        assert r2[1] == data1
+        assert len([s for s in statements if "idempotency_key" in s]) == 1
+        assert not [s for s in statements if s.startswith(("INSERT", "UPDATE"))]
+
+        r3, data3 = self.helper_create_result_idempotent("key2")
+        assert r3.status_code == 201, data3
+        assert data3["id"] != data1["id"]
+
+        assert Result.query.count() == 2
+        assert [m["id"] for m in resultsdb.messaging.DummyPlugin.history] == [
+            data1["id"],
+            data3["id"],
+        ]
+
+    def test_create_result_idempotency_key_other_request(self):
+        self.helper_create_result_idempotent("key1")
+        r, data = self.helper_create_result_idempotent("key1", outcome="FAILED")
+        assert r.status_code == 422
+        assert data == {"message": "Idempotency-Key was already used for a different request"}
+        assert Result.query.count() == 1
+
+    def test_create_result_idempotency_key_too_long(self):
+        r, data = self.helper_create_result_idempotent("x" * 256)
+        assert r.status_code == 400
+        assert data == {"message": "Idempotency-Key must be at most 255 characters"}
+        assert Result.query.count() == 0
+
+    def test_create_result_idempotency_key_expired(self):
+        r1, data1 = self.helper_create_result_idempotent("key1")
+        IdempotencyKey.query.update({"created_at": utcnow_naive() - datetime.timedelta(days=2)})
+        db.session.commit()
+
+        r2, data2 = self.helper_create_result_idempotent("key1")
+        assert r2.status_code == 201, data2
+        assert "Idempotent-Replayed" not in r2.headers
+        assert data2["id"] != data1["id"]
+
+        r3, data3 = self.helper_create_result_idempotent("key1")
+        assert data3 == data2
+
+    def test_create_result_idempotency_key_disabled(self):
+        with patch.dict(app.config, {"IDEMPOTENCY_KEY_TTL": 0}):
+            self.helper_create_result_idempotent("key1")
+            self.helper_create_result_idempotent("key1")
+        assert Result.query.count() == 2
+        assert IdempotencyKey.query.count() == 0
+
+    def test_purge_idempotency_keys(self):
+        self.helper_create_result_idempotent("key1")
+        self.helper_create_result_idempotent("key2")
+        IdempotencyKey.query.filter_by(key="key1").update(
+            {"created_at": utcnow_naive() - datetime.timedelta(days=2)}
+        )
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(purge_idempotency_keys)
+        assert result.exit_code == 0, result.output
+        assert "Removed 1 expired idempotency keys" in result.output
+        assert [k.key for k in IdempotencyKey.query] == ["key2"]
+
+    def test_rows_updated_in_sorted_order(self):
+        groups = ["group-b", "group-c", "group-a"]
+        items = [self.helper_batch_item(groups=groups, testcase="tc")] * 2
+
+        parameters = self.helper_executemany_parameters(
+            '"group"', lambda: self.helper_create_results_batch(items)
+        )
+        assert len(parameters) == 2
+        for params in parameters:
+            assert sorted(groups, key=str(params).index) == sorted(groups)
+
+        testcases = ["tc-b", "tc-c", "tc-a"]
+        items = [self.helper_batch_item(testcase=testcase) for testcase in testcases]
+        with patch.dict(app.config, {"LATEST_RESULT_KEYS": ("item",)}):
+            parameters = self.helper_executemany_parameters(
+                "latest_result", lambda: self.helper_create_results_batch(items)
+            )
+        assert len(parameters) == 1
+        assert sorted(testcases, key=str(parameters[0]).index) == sorted(testcases)
+
+        with patch.dict(app.config, {"MESSAGE_BUS_PUBLISH_TASKOTRON": True}):
+            with patch("resultsdb.messaging.publish"):
+                parameters = self.helper_executemany_parameters(
+                    "taskotron_last_outcome", lambda: self.helper_create_results_batch(items)
+                )
+        assert len(parameters) == 1
+        assert sorted(testcases, key=str(parameters[0]).index) == sorted(testcases)
+
+    def test_message_outbox(self):
+        plugin = resultsdb.messaging.DummyPlugin
+        with patch.dict(app.config, {"MESSAGE_BUS_OUTBOX": True}):
+            r1 = self.helper_create_result()[1]
+            r2 = self.helper_create_result(outcome="FAILED")[1]
+        assert plugin.history == []
+        assert OutboxMessage.query.count() == 2
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(dispatch, ["--once", "--batch-size", "1"])
+        assert result.exit_code == 0, result.output
+        assert "Published 2 messages" in result.output
+        assert plugin.history == [r1, r2]
+        assert OutboxMessage.query.count() == 0
+
+        result = runner.invoke(dispatch, ["--once"])
+        assert result.exit_code == 0, result.output
+        assert "Published 0 messages" in result.output
+
+    def test_message_outbox_publish_failed(self):
+        with patch.dict(app.config, {"MESSAGE_BUS_OUTBOX": True}):
+            self.helper_create_result()
+            r2 = self.helper_create_result(outcome="FAILED")[1]
+
+        runner = app.test_cli_runner()
+        plugin = resultsdb.messaging.DummyPlugin
+        with patch.object(plugin, "publish", side_effect=[None, RuntimeError("broker down")]):
+            result = runner.invoke(dispatch, ["--once"])
+        assert result.exit_code == 1, result.output
+        assert "Failed to publish messages" in result.output
+
+        # Only the published message was removed
+        assert [m.message["id"] for m in OutboxMessage.query] == [r2["id"]]
+
+        result = runner.invoke(dispatch, ["--once"])
+        assert result.exit_code == 0, result.output
+        assert plugin.history == [r2]
+
+    def test_message_outbox_fedmsg_publish_failed(self):
+        with patch.dict(app.config, {"MESSAGE_BUS_OUTBOX": True}):
+            r1 = self.helper_create_result()[1]
+            r2 = self.helper_create_result(outcome="FAILED")[1]
+
+        runner = app.test_cli_runner()
+        plugin = resultsdb.messaging.FedmsgPlugin(modname="resultsdb")
+        published = []
+        failures = [PublishTimeout()] * 3 + [None, PublishReturned(reason="Unroutable"), None]
+
+        def publish(message):
+            failure = failures.pop(0)
+            if failure is not None:
+                raise failure
+            published.append(message.body)
+
+        sleep = patch("resultsdb.messaging.FedmsgPlugin._send_with_retry.retry.sleep")
+        with patch.object(app, "messaging_plugin", plugin), sleep:
+            with patch("resultsdb.messaging.publish", side_effect=publish):
+                # Timeouts are retried, the messages stay in the outbox
+                result = runner.invoke(dispatch, ["--once"])
+                assert result.exit_code == 1, result.output
+                assert OutboxMessage.query.count() == 2
+
+                # Rejected messages are not dropped
+                result = runner.invoke(dispatch, ["--once"])
+                assert result.exit_code == 1, result.output
+                assert [m.message["id"] for m in OutboxMessage.query] == [r2["id"]]
+
+                result = runner.invoke(dispatch, ["--once"])
+                assert result.exit_code == 0, result.output
+
+        assert [message["id"] for message in published] == [r1["id"], r2["id"]]
+        assert OutboxMessage.query.count() == 0
+
     def test_get_outcomes_on_landing_page(self):
         r = self.app.get("/api/v2.0/")
         data = json.loads(r.data)
@@ -19,11 +19,14 @@
 
 import json
 import copy
+from unittest.mock import patch
 
 from flask import current_app as app
 
 import resultsdb.messaging
+from resultsdb.__main__ import rebuild_taskotron_last_outcomes
 from resultsdb.models import db
+from resultsdb.models.results import TaskotronLastOutcome, utcnow_naive
 
 
 class MyResultData(object):
@@ -189,3 +192,63 @@ class TestFuncCreateFedmsg:
 
         prev_result = resultsdb.messaging.get_prev_result(self.ref_result_obj)
         assert prev_result is None
+
+    def helper_taskotron_messages(self, publish):
+        return [
+            (msg.body["result"]["outcome"], msg.body["result"]["prev_outcome"])
+            for (msg,), _ in publish.call_args_list
+        ]
+
+    @patch("resultsdb.messaging.publish")
+    def test_taskotron_message_prev_outcome(self, publish):
+        with patch.dict(app.config, {"MESSAGE_BUS_PUBLISH_TASKOTRON": True}):
+            self.helper_create_result()
+            self.helper_create_result()
+            self.helper_create_result(outcome="FAILED")
+            data = dict(self.ref_result_data, arch="noarch")
+            self.helper_create_result(outcome="FAILED", data=data)
+
+        # The second result is skipped, the outcome has not changed
+        assert self.helper_taskotron_messages(publish) == [
+            ("PASSED", None),
+            ("FAILED", "PASSED"),
+            ("FAILED", None),
+        ]
+        assert publish.call_args.args[0].body["task"] == {
+            "item": self.ref_result_item,
+            "type": self.ref_result_type,
+            "name": self.ref_testcase_name,
+        }
+
+        outcomes = db.session.query(TaskotronLastOutcome).order_by(TaskotronLastOutcome.id)
+        assert [(o.result_id, o.outcome) for o in outcomes] == [(3, "FAILED"), (4, "FAILED")]
+
+    @patch("resultsdb.messaging.publish")
+    def test_rebuild_taskotron_last_outcomes(self, publish):
+        self.helper_create_result()
+        self.helper_create_result(outcome="FAILED")
+        assert db.session.query(TaskotronLastOutcome).count() == 0
+
+        # Stored for other result data, deleted by the rebuild
+        db.session.add(
+            TaskotronLastOutcome(
+                testcase_name=self.ref_testcase_name,
+                data_hash="0" * 40,
+                result_id=1,
+                submit_time=utcnow_naive(),
+                outcome="PASSED",
+            )
+        )
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(
+            rebuild_taskotron_last_outcomes, ["--batch-size", "1"]
+        )
+        assert result.exit_code == 0, result.output
+        assert " - processed 2 results" in result.output
+        assert " - deleted 1 outdated last outcomes" in result.output
+        assert "Stored 1 last outcomes" in result.output
+
+        with patch.dict(app.config, {"MESSAGE_BUS_PUBLISH_TASKOTRON": True}):
+            self.helper_create_result()
+        assert self.helper_taskotron_messages(publish) == [("PASSED", "FAILED")]
@@ -4,6 +4,7 @@ from unittest.mock import ANY, patch, Mock
 import ldap
 import pytest
 
+from resultsdb.authorization import LdapGroups, PermissionMatcher, match_testcase_permissions
 from resultsdb.models import db
 from resultsdb.parsers.api_v3 import RESULTS_PARAMS_CLASSES
 
@@ -24,6 +25,13 @@ def mock_ldap():
         yield con
 
 
+@pytest.fixture
+def ldap_groups(app):
+    groups = LdapGroups(max_entries=10, ttl=300, negative_ttl=60, pool_size=2)
+    with patch.object(app, "ldap_groups", groups):
+        yield groups
+
+
 @pytest.fixture
 def client(app):
     return app.test_client()
@@ -154,6 +162,38 @@ def test_api_v3_scratch_build(client):
     assert r.json["data"]["type"] == ["brew-build_scratch"]
 
 
+def test_api_v3_create_brew_builds_batch(client):
+    items = [
+        brew_build_request_data(),
+        brew_build_request_data(item="glibc-2.26-28.fc27", outcome="FAILED"),
+    ]
+    r = client.post("/api/v3/results/brew-builds/batch", json=items)
+    assert r.status_code == 201, r.text
+    assert [item["status"] for item in r.json["data"]] == [201, 201]
+    results = [item["result"] for item in r.json["data"]]
+    assert results[0]["testcase"]["name"] == "testcase1"
+    assert results[0]["data"]["item"] == ["glibc-2.26-27.fc27"]
+    assert results[1]["testcase"]["name"] == "testcase1"
+    assert results[1]["outcome"] == "FAILED"
+    assert results[1]["data"]["item"] == ["glibc-2.26-28.fc27"]
+    assert results[1]["data"]["username"] == ["testuser1"]
+    assert results[1]["data"]["type"] == ["brew-build"]
+
+
+def test_api_v3_idempotency_key(client):
+    data = brew_build_request_data()
+    headers = {"Idempotency-Key": "c1b2a3"}
+    r1 = client.post("/api/v3/results/brew-builds", json=data, headers=headers)
+    assert r1.status_code == 201, r1.text
+    r2 = client.post("/api/v3/results/brew-builds", json=data, headers=headers)
+    assert r2.status_code == 201, r2.text
+    assert r2.headers["Idempotent-Replayed"] == "true"
+    assert r2.json == r1.json
+
+    r = client.get("/api/v2.0/results")
+    assert [result["id"] for result in r.json["data"]] == [r1.json["id"]]
+
+
 def test_api_v3_productmd_compose_id_simple(client):
     data = {
         "id": "RHEL-8.8.0-20221129.0",
@@ -230,6 +270,39 @@ def test_api_v3_permissions_for_testcase_not_matching(client, permissions):
     assert r.json == []
 
 
+def test_permission_matcher():
+    permissions = [
+        {"users": ["user1"], "testcases": ["testcase1"]},
+        {"users": ["user2"], "testcases": ["testcase1*", "testcase2"]},
+        {"users": ["user3"], "testcases": ["*"]},
+        {"users": ["user4"], "testcases": ["test*.tier?", "*.tier[!0]", "testcase1.*"]},
+        {"users": ["user5"], "testcases": ["other*", "[a-c]*"]},
+        {"users": ["user6"]},
+    ]
+    matcher = PermissionMatcher(permissions)
+    for testcase in (
+        "testcase1",
+        "testcase1.tier0",
+        "testcase1.tier1",
+        "testcase2",
+        "testcase",
+        "other",
+        "c",
+        "",
+    ):
+        expected = list(match_testcase_permissions(testcase, permissions))
+        assert list(matcher.match(testcase)) == expected, testcase
+
+    assert [p["users"] for p in matcher.match("testcase1.tier1")] == [
+        ["user2"],
+        ["user3"],
+        ["user4"],
+    ]
+    assert matcher.compiled_from(permissions)
+    permissions.append({"users": ["user7"], "testcases": ["testcase1"]})
+    assert not matcher.compiled_from(permissions)
+
+
 def test_api_v3_permission_denied(client, permissions, caplog):
     permissions.append(
         {
@@ -250,6 +323,26 @@ def test_api_v3_permission_denied(client, permissions, caplog):
     assert f"Permission denied: {expected_error}" in caplog.text
 
 
+def test_api_v3_batch_permission_denied(client, permissions, caplog):
+    permissions.append(
+        {
+            "users": ["testuser1"],
+            "testcases": ["testcase1*"],
+        }
+    )
+    items = [
+        brew_build_request_data(),
+        brew_build_request_data(testcase="other1"),
+        brew_build_request_data(outcome=None),
+    ]
+    r = client.post("/api/v3/results/brew-builds/batch", json=items)
+    assert r.status_code == 207, r.text
+    assert [item["status"] for item in r.json["data"]] == [201, 403, 400]
+    expected_error = "User testuser1 is not authorized to submit results for the test case other1"
+    assert r.json["data"][1] == {"status": 403, "message": expected_error}
+    assert f"Permission denied: 403 Forbidden: {expected_error}" in caplog.text
+
+
 def test_api_v3_permission_matches_username(client, permissions):
     permissions.append(
         {
@@ -377,6 +470,66 @@ def test_api_v3_permission_no_groups_found(client, permissions, mock_ldap, caplo
     assert f"Permission denied: {expected_error}" in caplog.text
 
 
+def test_api_v3_permission_ldap_group_cache(client, permissions, mock_ldap, ldap_groups):
+    permissions.append(
+        {
+            "groups": ["testgroup1"],
+            "testcases": ["testcase1*"],
+        }
+    )
+    data = brew_build_request_data()
+    for _ in range(3):
+        r = client.post("/api/v3/results/brew-builds", json=data)
+        assert r.status_code == 201, r.text
+    mock_ldap.search_s.assert_called_once_with(
+        "ou=Groups,dc=example,dc=com", ANY, "(memberUid=testuser1)", ["cn"]
+    )
+    ldap.initialize.assert_called_once_with("ldap://ldap.example.com")
+    assert ldap_groups.hits == 2
+    assert ldap_groups.searches == 1
+
+
+def test_api_v3_permission_ldap_group_cache_negative(client, permissions, mock_ldap, ldap_groups):
+    permissions.append(
+        {
+            "groups": ["testgroup1"],
+            "testcases": ["testcase1*"],
+        }
+    )
+    mock_ldap.search_s.return_value = []
+    data = brew_build_request_data()
+    for _ in range(2):
+        r = client.post("/api/v3/results/brew-builds", json=data)
+        assert r.status_code == 403, r.text
+        assert "failed to find the user in LDAP" in r.json["message"]
+    mock_ldap.search_s.assert_called_once()
+    assert ldap_groups.hits == 1
+    assert ldap_groups.searches == 1
+
+
+def test_api_v3_permission_ldap_pool_drops_failed_connection(
+    client, permissions, mock_ldap, ldap_groups
+):
+    permissions.append(
+        {
+            "groups": ["testgroup1"],
+            "testcases": ["testcase1*"],
+        }
+    )
+    mock_ldap.search_s.side_effect = [ldap.SERVER_DOWN(), mock_ldap.search_s.return_value]
+    data = brew_build_request_data()
+    r = client.post("/api/v3/results/brew-builds", json=data)
+    assert r.status_code == 502, r.text
+    mock_ldap.unbind_s.assert_called_once()
+
+    # The failure is not cached and a new connection is used
+    r = client.post("/api/v3/results/brew-builds", json=data)
+    assert r.status_code == 201, r.text
+    assert mock_ldap.search_s.call_count == 2
+    assert ldap.initialize.call_count == 2
+    assert ldap_groups.pools["ldap://ldap.example.com"] == [mock_ldap]
+
+
 @pytest.mark.parametrize("params_class", RESULTS_PARAMS_CLASSES)
 def test_api_v3_consistency(params_class, client):
     """
@@ -1,13 +1,21 @@
 import datetime
+import json
 import ssl
+import threading
 from unittest.mock import patch
 
 import stomp
-from pytest import fixture, raises
+from fedora_messaging.exceptions import ConnectionException, PublishReturned, PublishTimeout
+from flask import url_for
+from opentelemetry.metrics import Observation
+from pytest import fixture, mark, raises
 
 import resultsdb.controllers.api_v2 as apiv2
+import resultsdb.cache as cache
 import resultsdb.messaging as messaging
-from resultsdb.parsers.api_v2 import parse_since
+from resultsdb.models.results import Group, Result, Testcase
+from resultsdb.parsers.api_v2 import encode_cursor, parse_cursor, parse_since
+from resultsdb.serializers.api_v2 import Serializer
 
 MESSAGE_BUS_KWARGS = {
     "destination": "results.new",
@@ -22,12 +30,38 @@ MESSAGE_BUS_KWARGS = {
 }
 
 
+class FakeBroker:
+    """Stands in for fedora_messaging.api.publish, raising the given failures first."""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.messages = []
+        self.threads = set()
+
+    def publish(self, message):
+        self.threads.add(threading.current_thread().name)
+        if self.failures:
+            failure = self.failures.pop(0)
+            if failure is not None:
+                raise failure
+        self.messages.append(message)
+
+
+@fixture
+def fake_broker():
+    broker = FakeBroker()
+    with patch("resultsdb.messaging.FedmsgPlugin._send_with_retry.retry.sleep"):
+        with patch("resultsdb.messaging.publish", broker.publish):
+            yield broker
+
+
 @fixture
 def mock_stomp():
     with patch("resultsdb.messaging.StompPlugin._publish_with_retry.retry.sleep"):
-        with patch("resultsdb.messaging.stomp.connect.StompConnection11") as mock:
-            mock().is_connected.return_value = False
-            yield mock
+        with patch("resultsdb.messaging.StompPlugin._send_with_retry.retry.sleep"):
+            with patch("resultsdb.messaging.stomp.connect.StompConnection11") as mock:
+                mock().is_connected.return_value = False
+                yield mock
 
 
 class MyRequest(object):
@@ -133,6 +167,140 @@ class TestParseSince:
         assert end == self.date_obj
 
 
+class TestCursor:
+    def test_encode_and_parse(self):
+        time = datetime.datetime(2016, 1, 1, 1, 2, 3, 40000)
+        cursor = encode_cursor("next", [time, 42])
+        assert "=" not in cursor
+        assert parse_cursor(cursor) == {
+            "direction": "next",
+            "values": ["2016-01-01T01:02:03.040000", 42],
+        }
+
+    def test_parse_empty(self):
+        assert parse_cursor("") == {}
+
+    def test_parse_invalid(self):
+        for cursor in ("invalid", encode_cursor("sideways", [1]), "W10"):
+            with raises(ValueError, match="invalid cursor"):
+                parse_cursor(cursor)
+
+
+class TestSerializerHrefs:
+    @mark.parametrize(
+        "base_url",
+        (
+            "http://localhost",
+            "https://resultsdb.example.com:8443/some/prefix",
+        ),
+    )
+    @mark.parametrize(
+        "name",
+        (
+            "fedora-ci.koji-build./plans/basic.functional",
+            "name with spaces",
+            "?query#fragment&a=b+c;d",
+            "100%/../escaped%2F",
+            "unicode \u017elu\u0165ou\u010dk\u00fd k\u016f\u0148",
+            "!$&'()*+,:;=@[]{}|\\^`\"<>",
+        ),
+    )
+    def test_hrefs_match_url_for(self, app, base_url, name):
+        serialize = Serializer().serialize
+        with app.test_request_context(base_url=base_url):
+            testcase = Testcase(name=name)
+            group = Group(uuid=name)
+            result = Result(
+                testcase, "PASSED", groups=[group], submit_time=datetime.datetime.now()
+            )
+            result.id = 42
+
+            assert serialize(testcase)["href"] == url_for(
+                "api_v2.get_testcase", testcase_name=name, _external=True
+            )
+            assert serialize(group)["href"] == url_for(
+                "api_v2.get_group", group_id=name, _external=True
+            )
+            assert serialize(group)["results"] == url_for(
+                "api_v2.get_results", groups=[name], _external=True
+            )
+            assert serialize(result)["href"] == url_for(
+                "api_v2.get_result", result_id=42, _external=True
+            )
+            assert serialize(result)["testcase"] == serialize(testcase)
+
+    def test_hrefs_follow_request_url_root(self, app):
+        serialize = Serializer().serialize
+        testcase = Testcase(name="testcase")
+        with app.test_request_context(base_url="http://localhost"):
+            assert serialize(testcase)["href"] == "http://localhost/api/v2.0/testcases/testcase"
+        with app.test_request_context(base_url="https://example.com/prefix"):
+            assert serialize(testcase)["href"] == (
+                "https://example.com/prefix/api/v2.0/testcases/testcase"
+            )
+
+
+class TestCache:
+    def test_memory_backend(self):
+        backend = cache.MemoryBackend(max_entries=2)
+        backend.set_many({"a": 1, "b": 2}, ttl=60)
+        assert backend.get_many(["a", "c"]) == {"a": 1}
+        backend.set_many({"c": 3}, ttl=60)
+        # "b" was the least recently used
+        assert backend.get_many(["a", "b", "c"]) == {"a": 1, "c": 3}
+
+    def test_memory_backend_expiration(self):
+        backend = cache.MemoryBackend()
+        with patch("resultsdb.cache.time.monotonic", return_value=100):
+            backend.set_many({"a": 1}, ttl=10)
+        with patch("resultsdb.cache.time.monotonic", return_value=110):
+            assert backend.get_many(["a"]) == {"a": 1}
+        with patch("resultsdb.cache.time.monotonic", return_value=111):
+            assert backend.get_many(["a"]) == {}
+        assert backend.entries == {}
+
+    def test_filter_tags(self):
+        assert cache.filter_tags(None, None) == [cache.tag_key("all")]
+        assert cache.filter_tags(["tc1", "tc2"], {"item:like": ["foo*"]}) == [
+            cache.tag_key("testcase", "tc1"),
+            cache.tag_key("testcase", "tc2"),
+        ]
+        assert cache.filter_tags(["tc1"], {"type": ["a"], "item": ["b", "c"]}) == [
+            cache.tag_key("data", "item", "b"),
+            cache.tag_key("data", "item", "c"),
+        ]
+
+    def test_identity_cache(self):
+        identity_cache = cache.IdentityCache(max_entries=10, ttl=60)
+        assert identity_cache.hit_rate == 0.0
+        identity_cache.store("testcase", {"tc1": {"id": 1, "name": "tc1", "ref_url": "a"}})
+
+        items = [("tc1", {"name": "tc1"}), ("tc2", {"name": "tc2"})]
+        assert identity_cache.lookup("testcase", items) == {
+            "tc1": {"id": 1, "name": "tc1", "ref_url": "a"}
+        }
+        assert identity_cache.lookup("group", items) == {}
+        assert (identity_cache.hits, identity_cache.misses) == (1, 3)
+
+        # Changing cached attribute bypasses the cache
+        items = [("tc1", {"name": "tc1"}), ("tc1", {"name": "tc1", "ref_url": "b"})]
+        assert identity_cache.lookup("testcase", items) == {}
+        items = [("tc1", {"name": "tc1", "ref_url": "a"})]
+        assert identity_cache.lookup("testcase", items) == {
+            "tc1": {"id": 1, "name": "tc1", "ref_url": "a"}
+        }
+        assert (identity_cache.hits, identity_cache.misses) == (2, 4)
+        assert identity_cache.hit_rate == 2 / 6
+
+    def test_load_backend(self):
+        backend = cache.load_cache_backend("memory", {"max_entries": 5})
+        assert isinstance(backend, cache.MemoryBackend)
+        assert backend.max_entries == 5
+
+        with raises(KeyError):
+            cache.load_cache_backend("nonexistent", {})
+
+
 class TestMessaging:
     def test_load_plugin(self):
         plugin = messaging.load_messaging_plugin("dummy", {})
@@ -224,6 +392,126 @@ If you ran `python setup.py develop` and are still seeing this error, then:
         assert mock_stomp().connect.call_count == 3
         assert mock_stomp().send.call_count == 3
 
+    def test_stomp_async_publish(self, mock_stomp):
+        plugin = messaging.StompPlugin(**MESSAGE_BUS_KWARGS, async_publish=True)
+        for i in range(3):
+            plugin.publish({"id": i})
+        plugin.close()
+
+        mock_stomp().connect.assert_called_once()
+        bodies = [call.kwargs["body"] for call in mock_stomp().send.call_args_list]
+        assert [json.loads(body)["id"] for body in bodies] == [0, 1, 2]
+
+    def test_stomp_async_publish_failed(self, mock_stomp):
+        plugin = messaging.StompPlugin(**MESSAGE_BUS_KWARGS, async_publish=True)
+
+        mock_stomp().send.side_effect = stomp.exception.StompException()
+        plugin.publish({})
+        plugin.close()
+
+        assert mock_stomp().send.call_count == 3
+
+    def test_stomp_async_overflow_drop(self, mock_stomp):
+        plugin = messaging.StompPlugin(
+            **MESSAGE_BUS_KWARGS, async_publish=True, queue_size=1, overflow="drop"
+        )
+        with patch.object(plugin, "_start_sender"):
+            plugin.publish({"id": 1})
+            plugin.publish({"id": 2})
+            assert plugin.queue.qsize() == 1
+
+        plugin.close()
+        mock_stomp().send.assert_not_called()
+
+    def test_stomp_async_overflow_spill(self, mock_stomp, tmp_path):
+        kwargs = dict(
+            MESSAGE_BUS_KWARGS,
+            async_publish=True,
+            queue_size=1,
+            overflow="spill",
+            spill_dir=str(tmp_path),
+        )
+        plugin1 = messaging.StompPlugin(**kwargs)
+        with patch.object(plugin1, "_start_sender"):
+            for i in range(3):
+                plugin1.publish({"id": i})
+        assert plugin1.queue.qsize() == 1
+        assert plugin1.spilled == 2
+
+        # Spill file is still owned by the first plugin
+        plugin2 = messaging.StompPlugin(**kwargs)
+        plugin2.publish({"id": 3})
+        plugin2.close()
+        bodies = [call.kwargs["body"] for call in mock_stomp().send.call_args_list]
+        assert [json.loads(body)["id"] for body in bodies] == [3]
+
+        # Unsent messages are spilled on exit and picked up by the next process
+        plugin1.close()
+        assert len(list(tmp_path.iterdir())) == 1
+        plugin3 = messaging.StompPlugin(**kwargs)
+        plugin3.publish({"id": 4})
+        plugin3.close()
+        bodies = [call.kwargs["body"] for call in mock_stomp().send.call_args_list]
+        assert [json.loads(body)["id"] for body in bodies] == [3, 1, 2, 0, 4]
+        assert list(tmp_path.iterdir()) == []
+
+    def test_stomp_async_invalid_overflow(self):
+        expected_error = "Invalid 'overflow' option 'wait' for stomp messaging plugin"
+        with raises(ValueError, match=expected_error):
+            messaging.StompPlugin(**MESSAGE_BUS_KWARGS, async_publish=True, overflow="wait")
+
+    def test_stomp_async_missing_spill_dir(self):
+        expected_error = "Missing 'spill_dir' option for stomp messaging plugin"
+        with raises(ValueError, match=expected_error):
+            messaging.StompPlugin(**MESSAGE_BUS_KWARGS, async_publish=True, overflow="spill")
+
+    def test_fedmsg_async_publish(self, fake_broker):
+        plugin = messaging.FedmsgPlugin(modname="resultsdb", async_publish=True)
+        with patch.object(plugin, "_start_sender"):
+            plugin.publish({"id": 0})
+        assert Observation(1, {"plugin": "fedmsg"}) in messaging.observe_queue_depth(None)
+
+        for i in range(1, 3):
+            plugin.publish({"id": i})
+        plugin.close()
+
+        assert [msg.body for msg in fake_broker.messages] == [{"id": 0}, {"id": 1}, {"id": 2}]
+        assert fake_broker.messages[0].topic == "resultsdb.result.new"
+        assert fake_broker.threads == {"fedmsg-sender"}
+        assert Observation(0, {"plugin": "fedmsg"}) in messaging.observe_queue_depth(None)
+
+    def test_fedmsg_async_publish_retry(self, fake_broker):
+        fake_broker.failures = [
+            PublishTimeout(),
+            ConnectionException(reason="Connection lost"),
+            None,
+            PublishReturned(reason="Unroutable"),
+        ]
+        plugin = messaging.FedmsgPlugin(modname="resultsdb", async_publish=True)
+        with patch.object(plugin, "_start_sender"):
+            for i in range(3):
+                plugin.publish({"id": i})
+        plugin._start_sender()
+        plugin.close()
+
+        # The rejected message is not retried
+        assert [msg.body for msg in fake_broker.messages] == [{"id": 0}, {"id": 2}]
+        assert fake_broker.failures == []
+
+    def test_fedmsg_async_publish_failed(self, fake_broker, tmp_path):
+        fake_broker.failures = [PublishTimeout()] * 3
+        plugin = messaging.FedmsgPlugin(
+            modname="resultsdb", async_publish=True, overflow="spill", spill_dir=str(tmp_path)
+        )
+        plugin.publish({"id": 0})
+        plugin.close()
+
+        assert fake_broker.messages == []
+        assert fake_broker.failures == []
+        (spill_file,) = tmp_path.iterdir()
+        assert spill_file.name.startswith("fedmsg-")
+        assert spill_file.read_text() == '{"id": 0}\n'
+
 
 class TestGetResultsParseArgs:
     # TODO: write something!